@@ -0,0 +1,15 @@
+# encoding: utf-8
+
+"""
+Benchmarks for the last.fm library.
+
+Each module in this package is a benchmark suite that can be run from the root
+of the source tree, e.g.:
+    
+    python -m benchmarks.client --output results.json
+
+Network benchmarks run against benchmarks.fakeserver, a local stand-in for the
+last.fm web service, so they need no API key and do not touch the real
+service. Run any suite with --help to see its options, including --baseline
+for comparing against the results of an earlier run.
+"""
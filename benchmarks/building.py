@@ -0,0 +1,49 @@
+# encoding: utf-8
+
+"""
+Measures the per-call overhead of the client outside the network: resolving
+method names, building request URLs, and the whole path through APIAccess
+with an agent that answers instantly.
+    
+    python -m benchmarks.building --output building.json
+"""
+
+from cStringIO import StringIO
+import sys
+
+import lastfm
+from lastfm.network import Agent, WS_ROOT
+from benchmarks import harness
+
+class NullAgent(Agent):
+    """An agent that builds the request URL but never sends it."""
+    
+    body = '{"artist": {"name": "Cher"}}'
+    
+    def get(self, url, data=None, **kwargs):
+        self._add_params(url, data or {})
+        return StringIO(self.body)
+
+def suite(options):
+    n = options.iterations * 100
+    client = lastfm.Client('benchmark', cache=False, agent=NullAgent())
+    raw = client.raw
+    params = {
+        'artist': u'Cher', 'api_key': 'benchmark', 'method': 'artist.getInfo',
+        'format': 'json'
+    }
+    unicode_params = dict(params, artist=u'Bj\xf6rk Gu\xf0mundsd\xf3ttir')
+    
+    return [
+        harness.measure('resolve_method',
+            lambda: raw.artist.get_top_albums, n),
+        harness.measure('add_params',
+            lambda: Agent._add_params(WS_ROOT, params), n),
+        harness.measure('add_params.unicode',
+            lambda: Agent._add_params(WS_ROOT, unicode_params), n),
+        harness.measure('call_api',
+            lambda: raw.artist.get_info(artist='Cher'), n)
+    ]
+
+if __name__ == '__main__':
+    sys.exit(harness.main('building', suite))
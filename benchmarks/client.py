@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+"""
+Benchmarks the client's main paths against a local fake last.fm server:
+artist lookups, search pagination, row decoding and the cache backends.
+    
+    python -m benchmarks.client --latency 0.005 --output client.json
+"""
+
+from itertools import cycle
+import sys
+
+import lastfm
+from lastfm.artists import Artist
+from lastfm.albums import Album
+from lastfm.caching import local
+from benchmarks import harness, payloads
+from benchmarks.fakeserver import FakeLastFM
+
+def add_options(parser):
+    parser.add_option('--latency', type='float', default=0.0,
+        help='seconds of latency added to each fake response [%default]')
+    parser.add_option('--jitter', type='float', default=0.0,
+        help='up to this many seconds of random extra latency [%default]')
+    parser.add_option('--pages', type='int', default=5,
+        help='search result pages loaded per search [%default]')
+    parser.add_option('--memcache', metavar='HOST:PORT',
+        help='also benchmark the memcached cache backend')
+
+def suite(options):
+    n = options.iterations
+    results = []
+    
+    server = FakeLastFM(options.latency, options.jitter).start()
+    try:
+        client = lastfm.Client('benchmark', cache=False, agent=server.agent())
+        
+        names = cycle('Artist %d' % i for i in range(100))
+        results.append(harness.measure('artists.get',
+            lambda: client.artists.get(names.next()), n))
+        
+        def paginate():
+            result = client.artists.search('Query')
+            for page in range(options.pages - 1):
+                result.load_next_page()
+        results.append(harness.measure('artists.search.%d_pages' %
+            options.pages, paginate, max(n // options.pages, 1)))
+        
+        results.append(harness.measure('raw.artist.get_similar',
+            lambda: client.raw.artist.get_similar(artist='Artist'), n))
+        results.append(harness.measure('raw.artist.get_top_albums',
+            lambda: client.raw.artist.get_top_albums(artist='Artist'), n))
+        
+        cached = lastfm.Client('benchmark', agent=server.agent())
+        cached.artists.get('Artist')
+        results.append(harness.measure('artists.get.cached',
+            lambda: cached.artists.get('Artist'), n * 10))
+    finally:
+        server.stop()
+    
+    results.extend(decoding(n * 10))
+    results.extend(caches(options, n * 100))
+    return results
+
+def decoding(n):
+    client = lastfm.Client('benchmark', cache=False)
+    artist = payloads.artist_info()['artist']
+    album = payloads.album_info()['album']
+    matches = payloads.artist_search()['results']['artistmatches']['artist']
+    top = payloads.top_albums()['topalbums']['album']
+    
+    return [
+        harness.measure('decode.artist_info',
+            lambda: Artist.from_row(client, artist), n),
+        harness.measure('decode.album_info',
+            lambda: Album.from_row(client, album), n),
+        harness.measure('decode.search_page',
+            lambda: [Artist.from_row(client, m) for m in matches],
+            max(n // 10, 1), rows=len(matches)),
+        harness.measure('decode.top_albums',
+            lambda: [Album.from_row(client, row) for row in top],
+            max(n // 10, 1), rows=len(top))
+    ]
+
+def caches(options, n):
+    backends = [('local', local.Cache())]
+    if options.memcache:
+        from lastfm.caching import memcache
+        backends.append(('memcache', memcache.Cache(options.memcache,
+            format='lastfm_benchmark_%s')))
+    
+    row = payloads.artist_info()['artist']
+    results = []
+    for name, cache in backends:
+        keys = ['artist:Artist %d' % i for i in range(1000)]
+        setter = cycle(keys)
+        getter = cycle(keys)
+        missing = cycle('artist:Missing %d' % i for i in range(1000))
+        
+        def store():
+            cache[setter.next()] = row
+        results.append(harness.measure('cache.%s.set' % name, store, n))
+        results.append(harness.measure('cache.%s.hit' % name,
+            lambda: cache[getter.next()], n))
+        results.append(harness.measure('cache.%s.miss' % name,
+            lambda: cache[missing.next()], n))
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('client', suite, add_options))
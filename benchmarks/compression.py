@@ -0,0 +1,54 @@
+# encoding: utf-8
+
+"""
+Compares bytes transferred and end-to-end latency of API calls with and
+without compressed transfer, on representative payloads.
+    
+    python -m benchmarks.compression --bandwidth 1000000 --output gzip.json
+"""
+
+import sys
+
+from lastfm.network import APIAccess
+from benchmarks import harness
+from benchmarks.fakeserver import FakeLastFM
+
+CALLS = [
+    ('artist.getInfo', 'artist', 'get_info', {'artist': 'Artist'}),
+    ('album.getInfo', 'album', 'get_info', {'artist': 'Artist',
+        'album': 'Album'}),
+    ('artist.search', 'artist', 'search', {'artist': 'Query', 'page': 1}),
+    ('artist.getSimilar', 'artist', 'get_similar', {'artist': 'Artist'}),
+    ('artist.getTopAlbums', 'artist', 'get_top_albums', {'artist': 'Artist'})
+]
+
+def add_options(parser):
+    parser.add_option('--latency', type='float', default=0.0,
+        help='seconds of latency added to each fake response [%default]')
+    parser.add_option('--bandwidth', type='float', default=1000000,
+        help='emulated link speed in bytes per second; 0 for unlimited '
+        '[%default]')
+
+def suite(options):
+    results = []
+    server = FakeLastFM(options.latency,
+        bandwidth=options.bandwidth or None).start()
+    try:
+        for compress in (False, True):
+            label = (compress and 'compressed') or 'identity'
+            access = APIAccess('benchmark', server.agent(compress=compress))
+            for method, module, name, params in CALLS:
+                call = getattr(getattr(access, module), name)
+                before = (server.requests, server.bytes_sent)
+                record = harness.measure('%s.%s' % (method, label),
+                    lambda: call(**dict(params)), options.iterations, 0)
+                requests = server.requests - before[0]
+                record['bytes_per_request'] = ((server.bytes_sent -
+                    before[1]) // max(requests, 1))
+                results.append(record)
+    finally:
+        server.stop()
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('compression', suite, add_options))
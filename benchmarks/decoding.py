@@ -0,0 +1,63 @@
+# encoding: utf-8
+
+"""
+Compares the JSON decoders available to the client on last.fm payloads, and
+decoding from the response bytes against decoding through a file object.
+    
+    python -m benchmarks.decoding --output decoding.json
+    python -m benchmarks.decoding --cassette traffic.cassette
+
+By default, canned payloads shaped like real responses are used; with
+--cassette, every response recorded by lastfm.replay.RecordingAgent is
+decoded instead.
+"""
+
+from cStringIO import StringIO
+import sys
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm import decoding
+from lastfm.replay import ReplayAgent
+from benchmarks import harness, payloads
+
+def add_options(parser):
+    parser.add_option('-c', '--cassette',
+        help='decode the responses recorded in this cassette')
+
+def load_bodies(options):
+    """Returns a list of (name, body) pairs to decode."""
+    if options.cassette:
+        agent = ReplayAgent(options.cassette)
+        try:
+            return [('cassette', list(agent.bodies()))]
+        finally:
+            agent.close()
+    return [(method, [json.dumps(make())])
+        for method, make in sorted(payloads.methods.items())]
+
+def suite(options):
+    results = []
+    for label, bodies in load_bodies(options):
+        size = sum(len(body) for body in bodies)
+        
+        def via_stream():
+            for body in bodies:
+                json.load(StringIO(body))
+        results.append(harness.measure('%s.json_stream' % label, via_stream,
+            options.iterations, bytes=size))
+        
+        for name in decoding.available():
+            decode = decoding.get_decoder(name)
+            def via_bytes():
+                for body in bodies:
+                    decode(body)
+            results.append(harness.measure('%s.%s' % (label, name), via_bytes,
+                options.iterations, bytes=size))
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('decoding', suite, add_options))
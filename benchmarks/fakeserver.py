@@ -0,0 +1,155 @@
+# encoding: utf-8
+
+"""
+A local HTTP stand-in for the last.fm web service, serving canned responses.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+import random
+import threading
+import time
+import zlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm.network import Agent
+from benchmarks import payloads
+
+class FakeLastFM(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server that answers last.fm API requests with the canned
+    payloads from benchmarks.payloads.
+    
+    Each response is delayed by `latency` seconds, plus a random amount of up
+    to `jitter` seconds. If `bandwidth` is given, responses are further delayed
+    as if they were sent over a link carrying that many bytes per second.
+    Clients that accept gzip or deflate encoding get compressed responses
+    unless `compress` is false. Encoded responses are cached, so the server
+    spends as little time as possible on its own work.
+    """
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, compress=True,
+        host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), _RequestHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.compress = compress
+        self.requests = 0
+        self.bytes_sent = 0
+        self._responses = {}
+        self._thread = None
+    
+    @property
+    def url(self):
+        """The URL to use in place of lastfm.network.WS_ROOT."""
+        return 'http://%s:%d/2.0/' % self.server_address
+    
+    def start(self):
+        """Starts serving requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stops the server."""
+        self.shutdown()
+        self.server_close()
+    
+    def agent(self, **kwargs):
+        """Returns an Agent that sends its requests to this server."""
+        return RedirectingAgent(self.url, **kwargs)
+    
+    def respond(self, params, encoding=None):
+        """
+        Returns the response body for the given request, compressed with the
+        given content `encoding` if it is "gzip" or "deflate".
+        """
+        key = (encoding,) + tuple(sorted(params.items()))
+        try:
+            return self._responses[key]
+        except KeyError:
+            pass
+        
+        method = params.get('method')
+        handler = payloads.methods.get(method)
+        if handler:
+            args = dict((k, v) for k, v in params.iteritems()
+                if k not in ('method', 'api_key', 'format'))
+            data = handler(**args)
+        else:
+            data = {'error': 3, 'message': 'Invalid Method - No method with '
+                'that name in this package'}
+        
+        body = json.dumps(data)
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            body = compressor.compress(body) + compressor.flush()
+        elif encoding == 'deflate':
+            body = zlib.compress(body, 6)
+        
+        self._responses[key] = body
+        return body
+    
+    def delay(self, size):
+        pause = self.latency
+        if self.jitter:
+            pause += random.random() * self.jitter
+        if self.bandwidth:
+            pause += float(size) / self.bandwidth
+        if pause > 0:
+            time.sleep(pause)
+
+
+class RedirectingAgent(Agent):
+    """An agent that sends all of its requests to a different root URL."""
+    
+    def __init__(self, root, **kwargs):
+        super(RedirectingAgent, self).__init__(**kwargs)
+        self._root = root
+    
+    def get(self, url, data=None, headers=None, timeout=None):
+        return super(RedirectingAgent, self).get(self._root, data, headers,
+            timeout)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+    
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        params = dict((k, v[-1]) for k, v in query.iteritems())
+        
+        encoding = None
+        if self.server.compress:
+            accepted = self.headers.get('Accept-Encoding', '')
+            for candidate in ('gzip', 'deflate'):
+                if candidate in accepted:
+                    encoding = candidate
+                    break
+        
+        server = self.server
+        body = server.respond(params, encoding)
+        server.requests += 1
+        server.bytes_sent += len(body)
+        server.delay(len(body))
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,74 @@
+# encoding: utf-8
+
+"""
+Compares decoding result lists into columnar frames against building an
+Artist or Album object per row and reading the columns back out of them.
+    
+    python -m benchmarks.frames --rows 1000 --output frames.json
+"""
+
+import sys
+
+import lastfm
+from lastfm import frames
+from lastfm.artists import Artist
+from lastfm.albums import Album
+from benchmarks import harness, payloads
+
+def add_options(parser):
+    parser.add_option('--rows', type='int', default=500,
+        help='rows per result list [%default]')
+
+def suite(options):
+    client = lastfm.Client('benchmark', cache=False)
+    n = options.iterations
+    count = options.rows
+    top = payloads.top_albums(count=count)['topalbums']['album']
+    similar = payloads.similar_artists(count=count)['similarartists']['artist']
+    matches = payloads.album_search(per_page=count, total=count)
+    matches = matches['results']['albummatches']['album']
+    for row in top + matches:
+        row['releasedate'] = '    6 Apr 1999, 00:00'
+    
+    # The objects' private attributes are read, as the public properties
+    # would try to load missing fields from last.fm.
+    def album_objects(rows):
+        albums = [Album.from_row(client, row) for row in rows]
+        return ([album._name for album in albums],
+            [album._play_count for album in albums],
+            [album._release_date for album in albums])
+    
+    def artist_objects():
+        pairs = [(float(row['match']), Artist.from_row(client, row))
+            for row in similar]
+        return ([artist._name for match, artist in pairs],
+            [match for match, artist in pairs])
+    
+    backends = [False]
+    if frames.numpy is not None:
+        backends.append(True)
+    
+    results = [
+        harness.measure('top_albums.objects', lambda: album_objects(top), n,
+            rows=count),
+        harness.measure('similar.objects', artist_objects, n, rows=count),
+        harness.measure('search.objects', lambda: album_objects(matches), n,
+            rows=count)
+    ]
+    for use_numpy in backends:
+        label = (use_numpy and 'numpy') or 'array'
+        results.extend([
+            harness.measure('top_albums.frame_%s' % label,
+                lambda: frames.decode(top, frames.TOP_ALBUM_COLUMNS,
+                    use_numpy), n, rows=count),
+            harness.measure('similar.frame_%s' % label,
+                lambda: frames.decode(similar, frames.SIMILAR_COLUMNS,
+                    use_numpy), n, rows=count),
+            harness.measure('search.frame_%s' % label,
+                lambda: frames.decode(matches, frames.ALBUM_COLUMNS,
+                    use_numpy), n, rows=count)
+        ])
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('frames', suite, add_options))
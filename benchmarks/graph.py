@@ -0,0 +1,62 @@
+# encoding: utf-8
+
+"""
+Measures queries against a synthetic similarity graph, with and without
+NumPy, after saving it and memory-mapping it back.
+    
+    python -m benchmarks.graph --nodes 100000 --output graph.json
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+from lastfm import graph
+from benchmarks import harness
+
+def add_options(parser):
+    parser.add_option('--nodes', type='int', default=20000,
+        help='number of artists in the graph [%default]')
+    parser.add_option('--degree', type='int', default=50,
+        help='similar artists per artist [%default]')
+
+def suite(options):
+    rng = random.Random(42)
+    count = options.nodes
+    nodes = [(u'Artist %d' % i, None) for i in xrange(count)]
+    edges = [(i, rng.randrange(count), rng.random())
+        for i in xrange(count) for j in xrange(options.degree)]
+    
+    backends = [False]
+    if graph.numpy is not None:
+        backends.append(True)
+    
+    results = []
+    handle, path = tempfile.mkstemp(suffix='.graph')
+    os.close(handle)
+    try:
+        for use_numpy in backends:
+            label = (use_numpy and 'numpy') or 'array'
+            built = graph.SimilarityGraph.build(nodes, edges, use_numpy)
+            built.save(path)
+            loaded = graph.SimilarityGraph.load(path, use_numpy)
+            picks = [rng.randrange(count) for i in xrange(1000)]
+            queries = iter(picks * (options.iterations // 10 + 1))
+            
+            results.append(harness.measure('top_k.%s' % label,
+                lambda: loaded.top_k(next(queries), 10), options.iterations,
+                nbytes=loaded.nbytes))
+            results.append(harness.measure('k_hop.%s' % label,
+                lambda: loaded.k_hop(next(queries), 2),
+                options.iterations // 10))
+            results.append(harness.measure('personalized_rank.%s' % label,
+                lambda: loaded.personalized_rank([next(queries)],
+                    iterations=10), max(options.iterations // 200, 3), 1))
+            loaded.close()
+    finally:
+        os.remove(path)
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('graph', suite, add_options))
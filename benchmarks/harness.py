@@ -0,0 +1,150 @@
+# encoding: utf-8
+
+"""
+Timing, reporting and regression checks shared by the benchmark suites.
+"""
+
+from optparse import OptionParser
+from time import time
+import platform
+import sys
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import lastfm
+
+def percentile(timings, p):
+    """Returns the `p`th percentile (0-100) of a sorted list of timings."""
+    if not timings:
+        return None
+    index = int(round((len(timings) - 1) * p / 100.0))
+    return timings[index]
+
+def measure(name, func, iterations, warmup=None, **extra):
+    """
+    Calls `func` `iterations` times (after `warmup` untimed calls, which
+    defaults to a tenth of `iterations`) and returns a result dictionary with
+    its throughput and latency distribution. Any keyword arguments are
+    included in the result as-is.
+    """
+    if warmup is None:
+        warmup = iterations // 10
+    for i in xrange(warmup):
+        func()
+    
+    timings = []
+    started = time()
+    for i in xrange(iterations):
+        start = time()
+        func()
+        timings.append(time() - start)
+    elapsed = time() - started
+    
+    return result(name, timings, elapsed, **extra)
+
+def result(name, timings, elapsed, **extra):
+    """
+    Builds a result dictionary from a list of per-operation `timings` and the
+    total `elapsed` time, both in seconds.
+    """
+    timings = sorted(timings)
+    count = len(timings)
+    record = {
+        'name': name,
+        'iterations': count,
+        'seconds': elapsed,
+        'ops_per_sec': (elapsed and count / elapsed) or None,
+        'mean_ms': (count and sum(timings) / count * 1000) or None,
+        'p50_ms': _ms(percentile(timings, 50)),
+        'p99_ms': _ms(percentile(timings, 99)),
+        'max_ms': _ms(percentile(timings, 100))
+    }
+    record.update(extra)
+    return record
+
+def _ms(seconds):
+    return (seconds is not None and seconds * 1000) or None
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the throughput of each result with the result of the same name in
+    `baseline`. Returns a list of (name, change) pairs, where `change` is the
+    relative change in operations per second, and a list of the names of the
+    benchmarks that got slower by more than `tolerance`.
+    """
+    previous = dict((r['name'], r) for r in baseline['results'])
+    changes = []
+    regressions = []
+    for record in results:
+        old = previous.get(record['name'])
+        if not old or not old.get('ops_per_sec') or not record['ops_per_sec']:
+            continue
+        change = record['ops_per_sec'] / old['ops_per_sec'] - 1.0
+        changes.append((record['name'], change))
+        if change < -tolerance:
+            regressions.append(record['name'])
+    return changes, regressions
+
+def report(results, out=sys.stderr):
+    """Prints a table of results."""
+    out.write('%-36s %12s %10s %10s %10s\n' % ('benchmark', 'ops/sec',
+        'p50 ms', 'p99 ms', 'max ms'))
+    for r in results:
+        out.write('%-36s %12.1f %10.3f %10.3f %10.3f\n' % (r['name'],
+            r['ops_per_sec'] or 0, r['p50_ms'] or 0, r['p99_ms'] or 0,
+            r['max_ms'] or 0))
+
+def main(suite_name, suite, add_options=None, args=None):
+    """
+    Runs a benchmark suite from the command line.
+    
+    The `suite` callable is given the parsed options and must return a list of
+    result dictionaries (see `measure`). `add_options`, if given, is called
+    with the OptionParser to add suite-specific options.
+    """
+    parser = OptionParser(usage='python -m benchmarks.%s [options]' %
+        suite_name)
+    parser.add_option('-n', '--iterations', type='int', default=1000,
+        help='number of timed iterations per benchmark [%default]')
+    parser.add_option('-o', '--output', metavar='FILE',
+        help='write machine-readable (JSON) results to FILE')
+    parser.add_option('-b', '--baseline', metavar='FILE',
+        help='compare throughput against the results in FILE')
+    parser.add_option('-t', '--tolerance', type='float', default=0.1,
+        help='fractional slowdown tolerated when comparing against a '
+        'baseline [%default]')
+    if add_options:
+        add_options(parser)
+    options, args = parser.parse_args(args)
+    
+    results = suite(options)
+    report(results)
+    
+    document = {
+        'suite': suite_name,
+        'lastfm_version': lastfm.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'timestamp': time(),
+        'results': results
+    }
+    if options.output:
+        out = open(options.output, 'w')
+        try:
+            json.dump(document, out, indent=2, sort_keys=True)
+        finally:
+            out.close()
+    
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+        changes, regressions = compare(results, baseline, options.tolerance)
+        for name, change in changes:
+            flag = (name in regressions and '  REGRESSION') or ''
+            sys.stderr.write('%-36s %+7.1f%%%s\n' % (name, change * 100, flag))
+        if regressions:
+            return 1
+    return 0
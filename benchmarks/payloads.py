@@ -0,0 +1,126 @@
+# encoding: utf-8
+
+"""
+Canned last.fm API responses, shaped like the real JSON the service returns.
+"""
+
+_LOREM = ('Lorem ipsum dolor sit amet, consectetur adipisicing elit, sed do '
+    'eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad '
+    'minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip '
+    'ex ea commodo consequat. ')
+
+def _images(url):
+    return [{'#text': '%s/%s.jpg' % (url, size), 'size': size}
+        for size in ('small', 'medium', 'large', 'extralarge')]
+
+def _tags(prefix, count=5):
+    return {'tag': [{'name': '%s tag %d' % (prefix, i),
+        'url': 'http://www.last.fm/tag/%d' % i} for i in range(count)]}
+
+def _mbid(seed):
+    return '%08x-0000-4000-8000-%012x' % (hash(seed) & 0xffffffff,
+        hash(seed[::-1]) & 0xffffffffffff)
+
+def _wiki(paragraphs):
+    return {
+        'published': 'Mon, 12 Jan 2009 15:12:01 +0000',
+        'summary': _LOREM,
+        'content': _LOREM * paragraphs
+    }
+
+def artist_row(name, detailed=False):
+    url = 'http://www.last.fm/music/%s' % name.replace(' ', '+')
+    row = {
+        'name': name,
+        'mbid': _mbid(name),
+        'url': url,
+        'streamable': '1',
+        'image': _images(url)
+    }
+    if detailed:
+        row.update({
+            'stats': {'listeners': '1234567', 'playcount': '98765432'},
+            'similar': {'artist': [artist_row('%s Similar %d' % (name, i))
+                for i in range(5)]},
+            'tags': _tags(name),
+            'bio': _wiki(40)
+        })
+    return row
+
+def album_row(name, artist, detailed=False):
+    url = 'http://www.last.fm/music/%s/%s' % (artist.replace(' ', '+'),
+        name.replace(' ', '+'))
+    row = {
+        'name': name,
+        'artist': artist,
+        'mbid': _mbid(artist + name),
+        'url': url,
+        'image': _images(url)
+    }
+    if detailed:
+        row.update({
+            'id': '2026',
+            'releasedate': '    6 Apr 1999, 00:00',
+            'listeners': '654321',
+            'playcount': '7654321',
+            'toptags': _tags(name),
+            'wiki': _wiki(20)
+        })
+    return row
+
+def artist_info(artist='Artist', **params):
+    return {'artist': artist_row(artist, detailed=True)}
+
+def album_info(artist='Artist', album='Album', **params):
+    return {'album': album_row(album, artist, detailed=True)}
+
+def _search(field, query, page, per_page, total, make_row):
+    page = int(page)
+    first = (page - 1) * per_page
+    matches = [make_row('%s %d' % (query, i))
+        for i in range(first, min(first + per_page, total))]
+    return {'results': {
+        '@attr': {'for': query},
+        'opensearch:Query': {'#text': '', 'role': 'request',
+            'searchTerms': query, 'startPage': str(page)},
+        'opensearch:totalResults': str(total),
+        'opensearch:startIndex': str(first),
+        'opensearch:itemsPerPage': str(per_page),
+        '%smatches' % field: {field: matches}
+    }}
+
+def artist_search(artist='Artist', page=1, per_page=30, total=300, **params):
+    return _search('artist', artist, page, per_page, total, artist_row)
+
+def album_search(album='Album', page=1, per_page=30, total=300, **params):
+    return _search('album', album, page, per_page, total,
+        lambda name: album_row(name, 'Artist'))
+
+def similar_artists(artist='Artist', count=100, **params):
+    similar = []
+    for i in range(count):
+        row = artist_row('%s Similar %d' % (artist, i))
+        row['match'] = '%.6f' % (1.0 - float(i) / count)
+        similar.append(row)
+    return {'similarartists': {'@attr': {'artist': artist},
+        'artist': similar}}
+
+def top_albums(artist='Artist', count=50, **params):
+    albums = []
+    for i in range(count):
+        row = album_row('Album %d' % i, artist)
+        row['artist'] = {'name': artist, 'mbid': _mbid(artist),
+            'url': 'http://www.last.fm/music/%s' % artist}
+        row['playcount'] = str(100000 - i)
+        row['@attr'] = {'rank': str(i + 1)}
+        albums.append(row)
+    return {'topalbums': {'@attr': {'artist': artist}, 'album': albums}}
+
+methods = {
+    'artist.getInfo': artist_info,
+    'album.getInfo': album_info,
+    'artist.search': artist_search,
+    'album.search': album_search,
+    'artist.getSimilar': similar_artists,
+    'artist.getTopAlbums': top_albums
+}
@@ -0,0 +1,69 @@
+# encoding: utf-8
+
+"""
+Measures searches and autocompletion answered from a local search index of
+synthetic artist names.
+    
+    python -m benchmarks.search --rows 100000 --output search.json
+"""
+
+import random
+import sys
+
+from lastfm.search import SearchIndex
+from benchmarks import harness
+
+# Letters roughly in proportion to their frequency in English text.
+_letters = ('eeeeeeeeeeeetttttttttaaaaaaaaooooooooiiiiiiinnnnnnnsssssshhhhhh'
+    'rrrrrrddddllllcccuuummwwffggyyppbbvkjxqz')
+
+def add_options(parser):
+    parser.add_option('--rows', type='int', default=50000,
+        help='number of artists in the index [%default]')
+    parser.add_option('--names', metavar='FILE',
+        help='index the names in FILE (one per line) instead of synthetic '
+        'names')
+
+def make_names(rng, count):
+    """
+    Makes up artist names of one to three words, drawn from a vocabulary in
+    which a few words are very common, as in real names.
+    """
+    vocabulary = [''.join(rng.choice(_letters)
+        for j in xrange(rng.randint(3, 9))).capitalize()
+        for i in xrange(max(count // 5, 100))]
+    def word():
+        return vocabulary[int(len(vocabulary) ** rng.random()) - 1]
+    return [' '.join(word() for j in xrange(rng.randint(1, 3)))
+        for i in xrange(count)]
+
+def misspell(rng, name):
+    position = rng.randrange(len(name))
+    return name[:position] + name[position + 1:]
+
+def suite(options):
+    rng = random.Random(7)
+    if options.names:
+        names = [line.strip().decode('utf-8') for line in open(options.names)
+            if line.strip()][:options.rows]
+    else:
+        names = make_names(rng, options.rows)
+    index = SearchIndex()
+    
+    rows = iter([{'name': name} for name in names])
+    results = [harness.measure('add',
+        lambda: index.add('artist', next(rows)), options.rows, 0)]
+    
+    queries = iter([misspell(rng, rng.choice(names))
+        for i in xrange(options.iterations * 2)])
+    prefixes = iter([rng.choice(names)[:4]
+        for i in xrange(options.iterations * 2)])
+    results.append(harness.measure('search.misspelled',
+        lambda: index.search('artist', next(queries)), options.iterations))
+    results.append(harness.measure('complete.prefix',
+        lambda: index.complete('artist', next(prefixes)),
+        options.iterations))
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('search', suite, add_options))
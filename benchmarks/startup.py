@@ -0,0 +1,56 @@
+# encoding: utf-8
+
+"""
+Measures how long it takes a fresh interpreter to import the library and get
+a client ready, as a short-lived script would.
+    
+    python -m benchmarks.startup --output startup.json
+
+Each case runs in its own Python process (a twentieth as many times as the
+--iterations option asks for), and only the time spent in the measured
+statements is counted, not interpreter startup.
+"""
+
+import subprocess
+import sys
+
+from benchmarks import harness
+
+CASES = [
+    ('import', 'import lastfm'),
+    ('client', 'import lastfm; lastfm.Client("benchmark")'),
+    ('client.artists', 'import lastfm; lastfm.Client("benchmark").artists'),
+    ('errors', 'from lastfm.errors import APIError')
+]
+
+# Run in the child process: times the statement and prints the elapsed
+# seconds and the number of modules loaded by it.
+TIMER = '''
+import sys, time
+before = len(sys.modules)
+start = time.time()
+exec(%r)
+print("%%r %%d" %% (time.time() - start, len(sys.modules) - before))
+'''
+
+def run(statement):
+    """Runs `statement` in a new interpreter and returns its timing."""
+    output = subprocess.check_output([sys.executable, '-c',
+        TIMER % statement])
+    elapsed, modules = output.split()
+    return float(elapsed), int(modules)
+
+def suite(options):
+    runs = max(options.iterations // 20, 3)
+    results = []
+    for name, statement in CASES:
+        timings = []
+        for i in xrange(runs):
+            elapsed, modules = run(statement)
+            timings.append(elapsed)
+        results.append(harness.result(name, timings, sum(timings),
+            modules_loaded=modules))
+    return results
+
+if __name__ == '__main__':
+    sys.exit(harness.main('startup', suite))
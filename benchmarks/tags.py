@@ -0,0 +1,63 @@
+# encoding: utf-8
+
+"""
+Measures keeping a tag index of synthetic artists up to date, and answering
+"artists tagged X and Y" from it rather than by scanning every row.
+    
+    python -m benchmarks.tags --rows 100000 --output tags.json
+"""
+
+import random
+import sys
+
+from lastfm.data import handle_tags
+from lastfm.tags import TagIndex
+from benchmarks import harness
+
+def add_options(parser):
+    parser.add_option('--rows', type='int', default=20000,
+        help='number of artists in the index [%default]')
+    parser.add_option('--tags', type='int', default=2000,
+        help='number of distinct tags [%default]')
+
+def suite(options):
+    rng = random.Random(42)
+    n = options.iterations
+    
+    # A few tags (like "rock") are on many artists, most on very few.
+    def tag():
+        return u'tag %d' % (int(options.tags ** rng.random()) - 1)
+    def make_row(i):
+        return {'name': u'Artist %d' % i, 'tags': {'tag': [{'name': tag()}
+            for j in xrange(5)]}}
+    
+    rows = [make_row(i) for i in xrange(options.rows)]
+    index = TagIndex()
+    for row in rows:
+        index.add('artist', row, handle_tags(row['tags']))
+    updates = iter([make_row(rng.randrange(options.rows))
+        for i in xrange(n + n // 10)])
+    pairs = [(tag(), tag()) for i in xrange(100)]
+    queries = iter(pairs * (n // 50 + 1))
+    scans = iter(pairs * (n // 500 + 1))
+    
+    def update():
+        row = updates.next()
+        index.add('artist', row, handle_tags(row['tags']))
+    
+    def scan():
+        wanted = set(scans.next())
+        return [row for row in rows
+            if wanted.issubset(handle_tags(row['tags']))]
+    
+    return [
+        harness.measure('update', update, n),
+        harness.measure('tagged.index',
+            lambda: index.tagged('artist', *queries.next()), n),
+        harness.measure('tagged.scan', scan, max(n // 100, 1),
+            rows=options.rows),
+        harness.measure('related', lambda: index.related('artist', tag()), n)
+    ]
+
+if __name__ == '__main__':
+    sys.exit(harness.main('tags', suite, add_options))
@@ -11,6 +11,57 @@ __version__ = "0.1.0"
 __copyright__ = "Copyright © 2009 Eric Naeseth"
 __license__   = "MIT"
 
-from lastfm.api import Client
+import sys
+from types import ModuleType
 
 __all__ = ['api', 'caching', 'Client']
+
+# Names exported by the package, mapped to the module that defines them. They
+# (and the package's submodules) are imported when first used, so that
+# `import lastfm` does not pull in the HTTP and JSON machinery.
+_exports = {
+    'Client': 'lastfm.api'
+}
+
+class _LazyPackage(ModuleType):
+    """The lastfm package, loading its contents on demand."""
+    
+    # The package's own attributes are read from its __dict__ rather than
+    # from the globals of this module, as reloading the package executes
+    # this file again in that __dict__.
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        
+        package = self.__dict__
+        if name in package['_exports']:
+            module = __import__(package['_exports'][name], fromlist=[name])
+            value = getattr(module, name)
+        elif name in self._submodules():
+            value = __import__('%s.%s' % (self.__name__, name),
+                fromlist=[name])
+        else:
+            raise AttributeError("module %r has no attribute %r" %
+                (self.__name__, name))
+        setattr(self, name, value)
+        return value
+    
+    def _submodules(self):
+        """Returns the names of the package's modules and subpackages."""
+        import pkgutil
+        return frozenset(name for loader, name, is_package in
+            pkgutil.iter_modules(self.__path__))
+    
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self.__dict__['_exports']) |
+            self._submodules())
+
+# When the package is reloaded, this file runs again in the lazy package's
+# own namespace, which must stay the module that sys.modules holds.
+if type(sys.modules[__name__]) is ModuleType:
+    _package = _LazyPackage(__name__, __doc__)
+    _package.__dict__.update(globals())
+    # Keep the original module alive: Python 2 clears the globals of a
+    # module that is garbage-collected, and the functions above use them.
+    _package._original = sys.modules[__name__]
+    sys.modules[__name__] = _package
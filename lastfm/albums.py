@@ -8,14 +8,14 @@ from lastfm import artists
 from lastfm.errors import APIError, UnderspecifiedError
 from lastfm.results import SearchResult
 from lastfm.data import *
-from datetime import date
-from email.utils import parsedate
 
 class Album(SmartData):
     """
     Represents an album in the last.fm database.
     """
     
+    _kind = 'album'
+    
     def __init__(self, client, name=None):
         super(Album, self).__init__(client)
         if name:
@@ -25,7 +25,7 @@ class Album(SmartData):
         ("name", None),
         ("artist", handle_album_artist, "_artist", True),
         ("mbid", None, "_id"),
-        ("releasedate", lambda v: date(*parsedate(v)[:3]),
+        ("releasedate", lambda v: parse_timestamp(v).date(),
             "_release_date"),
         ("wiki", WikiEntry.from_row, "_description"),
         ("image", lambda lst: [Image.from_row(i) for i in lst], "_images"),
@@ -98,6 +98,7 @@ class Album(SmartData):
             criterion = spec.get('mbid')
         cached = client._cache_find('album', criterion)
         if cached:
+            client._index_row('album', cached)
             return cached
         
         fresh = client.raw.album.get_info(**spec)['album']
@@ -106,6 +107,7 @@ class Album(SmartData):
         client.cache['album:%s' % qualified_name] = fresh
         if 'mbid' in fresh:
             client.cache['album:%s' % fresh['mbid']] = fresh
+        client._index_row('album', fresh)
         return fresh
     
     def __repr__(self):
@@ -145,10 +147,14 @@ class AlbumCollection(Collection):
     
     def search(self, name):
         """
-        Searches last.fm for albums with the given name.
+        Searches last.fm for albums with the given name. If the client has a
+        search index with a close match, the first page of results is
+        answered from the index instead; the total and any further pages
+        still come from last.fm.
         """
         
         client = self._client
+        local = client._search_locally('album', name)
         def retrieve_page(page):
             cached = client._cache_find('album_search', '%s:%d' % (name, page))
             if cached:
@@ -159,7 +165,37 @@ class AlbumCollection(Collection):
             return result
             
         def match_to_album(match):
+            client._index_row('album', match)
             return Album.from_row(self._client, match)
         
-        return SearchResult(retrieve_page, 'album', match_to_album)
+        return SearchResult(retrieve_page, 'album', match_to_album, local)
     
+    def autocomplete(self, prefix, limit=10):
+        """
+        Returns up to `limit` albums whose names start with `prefix`, from the
+        client's search index. If the index has none (or the client has no
+        index), the first results of a search for `prefix` are returned.
+        """
+        
+        index = self._client.search_index
+        rows = []
+        if index is not None:
+            rows = index.complete('album', prefix, limit)
+        if rows:
+            return [Album.from_row(self._client, row) for row in rows]
+        return self.search(prefix)[:limit]
+    
+    def tagged(self, *tags):
+        """
+        Returns the albums the client has loaded that carry all of the given
+        tags, from the client's tag index, in no particular order. Raises
+        ValueError if the client has no tag index.
+        """
+        
+        index = self._client.tag_index
+        if index is None:
+            raise ValueError('the client has no tag index; create it with '
+                'tag_index=True')
+        return [Album.from_row(self._client, row)
+            for row in index.tagged('album', *tags)]
+
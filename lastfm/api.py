@@ -4,15 +4,13 @@
 Provides access to the last.fm API.
 """
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
-    
+from lastfm import deadlines, decoding
 from lastfm.caching import local
-from lastfm.network import Agent, APIAccess
-from lastfm.artists import ArtistCollection
-from lastfm.albums import AlbumCollection
+from lastfm.stats import Stats
+from lastfm.hedging import HedgePolicy
+from lastfm.breaker import CircuitBreaker
+from lastfm.keys import KeyPool
+from lastfm.network import Agent, APIAccess, ResponseStore
 
 class Client(object):
     """
@@ -22,16 +20,22 @@ class Client(object):
     All API requests are synchronous.
     """
     
-    def __init__(self, api_key, secret=None, cache=None, agent=None):
+    def __init__(self, api_key, secret=None, cache=None, agent=None,
+        stats=None, tracer=None, revalidate=False, hedge=None, breaker=None,
+        timeout=None, decoder=None, search_index=None, tag_index=None):
         """
         Creates a new last.fm API client.
         
         The `api_key` is your application's API key. An API key must be obtained
         from last.fm before the API can be used by any means (including via
-        this library).
+        this library). To spread calls across several keys, `api_key` can also
+        be a list of keys or a lastfm.keys.KeyPool; each key then gets its own
+        rate limit, and keys rejected by last.fm are paused automatically.
         
         The `secret` is your application's secret key. This key
-        is only used in requests that require authorization.
+        is only used in requests that require authorization. With several API
+        keys, those requests are all made with the pool's `signing_key` (by
+        default, the first key), which the secret must belong to.
         
         The `cache` parameter can be set to a cache object which will be used to
         cache results from the last.fm service. This can be any object which
@@ -47,10 +51,61 @@ class Client(object):
         The `agent` parameter specifies an agent object used for making HTTP
         requests. If set to None, a live, urllib2-based implementation will be
         used. Changing the agent is mostly useful for testing.
+        
+        The `stats` parameter turns on instrumentation. If it is True, a new
+        lastfm.stats.Stats object is created to hold call counts, latency
+        histograms and cache activity; an existing Stats object can also be
+        given to share it between clients. By default, nothing is recorded.
+        
+        The `tracer` parameter can be set to a lastfm.tracing.Tracer to record
+        the phases (URL building, connecting, waiting, reading and decoding) of
+        sampled requests. It is also given to the default agent.
+        
+        If `revalidate` is true, API responses that come with HTTP validators
+        (ETag or Last-Modified headers) are kept in the cache alongside the
+        data built from them, for a day or for `revalidate` seconds if it is a
+        number. Once the data expires, it is refetched with a conditional
+        request, and if last.fm reports that it has not changed, the kept
+        response is reused without being downloaded or decoded again.
+        
+        The `hedge` parameter turns on hedged reads: if a read is not answered
+        within a high percentile of recent latencies, a duplicate request is
+        sent and the first answer is used. It can be a
+        lastfm.hedging.HedgePolicy, or True to use the default policy.
+        
+        The `breaker` parameter can be set to a lastfm.breaker.CircuitBreaker,
+        or to True to use one with the default settings. After repeated
+        failures, the breaker stops calls to last.fm for a while, and they
+        fail immediately with lastfm.errors.CircuitOpenError. If `revalidate`
+        is also set, reads are answered with a stale copy of their last
+        response instead, if one is still in the cache; keeping those copies
+        costs a cache entry per distinct read, so it is not done otherwise.
+        
+        The `timeout` parameter gives the longest time, in seconds, that any
+        single API call may take. Overall latency budgets for a series of
+        calls can be set with the `deadline` method.
+        
+        The `decoder` parameter chooses the JSON decoder used for responses:
+        either the name of one of the decoders known to lastfm.decoding (e.g.,
+        "ujson" or "json"), or a function that decodes a byte string. By
+        default, the preferred decoder installed is used.
+        
+        The `search_index` parameter can be set to a
+        lastfm.search.SearchIndex, or to True to create one. Every artist and
+        album the client loads is then added to the index, and the first page
+        of artist and album searches is answered from it when it has a close
+        match.
+        
+        The `tag_index` parameter can be set to a lastfm.tags.TagIndex, or to
+        True to create one. Every artist and album the client decodes with its
+        top tags is then indexed by tag, so that the collections' `tagged`
+        methods can find them.
         """
         
         if not api_key:
             raise ValueError("cannot create a client with no API key")
+        if isinstance(api_key, (list, tuple)):
+            api_key = KeyPool(api_key)
         
         self._key = api_key
         self._secret = secret
@@ -61,16 +116,56 @@ class Client(object):
             self._cache = local.Cache()
         else:
             self._cache = cache
+        
+        if stats is True:
+            stats = Stats()
+        self._stats = stats or None
+        if self._stats is not None:
+            self._cache = self._stats.monitor_cache(self._cache)
             
-        self._agent = agent or Agent()
-        self._access = APIAccess(self._key, self._agent)
+        if revalidate is True:
+            responses = ResponseStore(self._cache)
+        elif revalidate:
+            responses = ResponseStore(self._cache, revalidate)
+        else:
+            responses = None
         
-        self._artists = ArtistCollection(self)
-        self._albums = AlbumCollection(self)
+        if hedge is True:
+            hedge = HedgePolicy()
+        if breaker is True:
+            breaker = CircuitBreaker()
+        self._breaker = breaker or None
         
+        if isinstance(decoder, basestring):
+            decoder = decoding.get_decoder(decoder)
+        
+        self._agent = agent or Agent(tracer)
+        self._access = APIAccess(self._key, self._agent, self._stats, tracer,
+            responses, self._secret, hedge or None, self._breaker, timeout,
+            decoder)
+        
+        # The collections (and the modules defining them) are loaded on first
+        # use, so that clients that only make raw calls start up faster.
+        self._artists = None
+        self._albums = None
+        
+        if search_index is True:
+            from lastfm.search import SearchIndex
+            search_index = SearchIndex()
+        elif search_index is False:
+            search_index = None
+        self._search_index = search_index
+        
+        if tag_index is True:
+            from lastfm.tags import TagIndex
+            tag_index = TagIndex()
+        elif tag_index is False:
+            tag_index = None
+        self._tag_index = tag_index
+    
     @property
     def api_key(self):
-        """The API key used by the client."""
+        """The API key (or lastfm.keys.KeyPool) used by the client."""
         return self._key
         
     @property
@@ -83,6 +178,38 @@ class Client(object):
         """The object cache used by the client."""
         return self._cache
         
+    @property
+    def search_index(self):
+        """
+        The lastfm.search.SearchIndex of the rows loaded by the client, or None
+        if there is none.
+        """
+        return self._search_index
+    
+    @property
+    def tag_index(self):
+        """
+        The lastfm.tags.TagIndex of the artists and albums decoded by the
+        client, or None if there is none.
+        """
+        return self._tag_index
+    
+    def _index_row(self, kind, row):
+        if self._search_index is not None:
+            self._search_index.add(kind, row)
+    
+    def _search_locally(self, kind, query):
+        """
+        Returns the rows matching `query` in the search index, or None if
+        there is no index or it has no confident match.
+        """
+        if self._search_index is None:
+            return None
+        matches = self._search_index.search(kind, query)
+        if not self._search_index.confident(matches):
+            return None
+        return [row for score, row in matches]
+    
     def _cache_find(self, namespace, *values):
         for value in values:
             if value:
@@ -97,6 +224,39 @@ class Client(object):
         """The HTTP request agent used by the client."""
         return self._agent
     
+    @property
+    def stats(self):
+        """
+        The lastfm.stats.Stats object recording the client's activity, or None
+        if instrumentation is turned off.
+        """
+        return self._stats
+    
+    @property
+    def breaker(self):
+        """
+        The lastfm.breaker.CircuitBreaker guarding calls made by the client, or
+        None if there is none.
+        """
+        return self._breaker
+    
+    def deadline(self, seconds):
+        """
+        Returns a context manager that limits all API calls made on this thread
+        within its block to finish in `seconds` seconds, including the calls
+        made implicitly when loading artist and album properties or further
+        search result pages. For example:
+            
+            with client.deadline(1.5):
+                artist = client.artists.get('Cher')
+                bio = artist.biography
+        
+        Calls that cannot start before the deadline raise
+        lastfm.errors.DeadlineExceededError, as do calls that time out because
+        of it. See lastfm.deadlines.
+        """
+        return deadlines.deadline(seconds)
+    
     @property
     def raw(self):
         """An APIAccess object that gives raw access to the last.fm API."""
@@ -105,11 +265,17 @@ class Client(object):
     @property
     def artists(self):
         """An object that gives access to last.fm artist information."""
+        if self._artists is None:
+            from lastfm.artists import ArtistCollection
+            self._artists = ArtistCollection(self)
         return self._artists
     
     @property
     def albums(self):
         """An object that gives access to last.fm album information."""
+        if self._albums is None:
+            from lastfm.albums import AlbumCollection
+            self._albums = AlbumCollection(self)
         return self._albums
     
     def __repr__(self):
@@ -123,6 +289,9 @@ class Client(object):
 
         def __setitem__(self, key, value):
             pass
+        
+        def set(self, key, value, timeout=None):
+            pass
 
         def __delitem__(self, key):
             pass
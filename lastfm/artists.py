@@ -13,6 +13,8 @@ class Artist(SmartData):
     Represents an artist in the last.fm database.
     """
     
+    _kind = 'artist'
+    
     def __init__(self, client, name=None, id=None, url=None):
         super(Artist, self).__init__(client)
         if name:
@@ -81,7 +83,7 @@ class Artist(SmartData):
         
         matches = []
         for artist in artists:
-            match = float(artist.pop('match'))
+            match = float(artist['match'])
             matches.append((match, Artist.from_row(self._client, artist)))
         return matches
     
@@ -105,6 +107,7 @@ class Artist(SmartData):
         cached = client._cache_find('artist', spec.get('mbid'),
             spec.get('artist'))
         if cached:
+            client._index_row('artist', cached)
             return cached
         
         fresh = client.raw.artist.get_info(**spec)['artist']
@@ -119,6 +122,7 @@ class Artist(SmartData):
         client.cache['artist:%s' % fresh['name']] = fresh
         if 'mbid' in fresh:
             client.cache['artist:%s' % fresh['mbid']] = fresh
+        client._index_row('artist', fresh)
         return fresh
         
     def __repr__(self):
@@ -158,10 +162,14 @@ class ArtistCollection(Collection):
 
     def search(self, name):
         """
-        Searches last.fm for artists that match the given `name`.
+        Searches last.fm for artists that match the given `name`. If the
+        client has a search index with a close match, the first page of
+        results is answered from the index instead; the total and any further
+        pages still come from last.fm.
         """
         
         client = self._client
+        local = client._search_locally('artist', name)
         def retrieve_page(page):
             cached = client._cache_find('artist_search', '%s:%d' % (name, page))
             if cached:
@@ -172,6 +180,36 @@ class ArtistCollection(Collection):
             return result
             
         def match_to_artist(match):
+            client._index_row('artist', match)
             return Artist.from_row(self._client, match)
         
-        return SearchResult(retrieve_page, 'artist', match_to_artist)
+        return SearchResult(retrieve_page, 'artist', match_to_artist, local)
+    
+    def autocomplete(self, prefix, limit=10):
+        """
+        Returns up to `limit` artists whose names start with `prefix`, from
+        the client's search index. If the index has none (or the client has no
+        index), the first results of a search for `prefix` are returned.
+        """
+        
+        index = self._client.search_index
+        rows = []
+        if index is not None:
+            rows = index.complete('artist', prefix, limit)
+        if rows:
+            return [Artist.from_row(self._client, row) for row in rows]
+        return self.search(prefix)[:limit]
+    
+    def tagged(self, *tags):
+        """
+        Returns the artists the client has loaded that carry all of the given
+        tags, from the client's tag index, in no particular order. Raises
+        ValueError if the client has no tag index.
+        """
+        
+        index = self._client.tag_index
+        if index is None:
+            raise ValueError('the client has no tag index; create it with '
+                'tag_index=True')
+        return [Artist.from_row(self._client, row)
+            for row in index.tagged('artist', *tags)]
@@ -0,0 +1,161 @@
+# encoding: utf-8
+
+"""
+A circuit breaker that stops calling last.fm while it is down.
+
+After `failure_threshold` consecutive failures (the service reporting that it
+is offline, or the request failing at the network or HTTP level), the breaker
+opens, and calls fail immediately with lastfm.errors.CircuitOpenError instead
+of waiting on the service. After `reset_timeout` seconds, the breaker lets a
+probe request through; if it succeeds, the breaker closes again, and if not,
+it stays open for another `reset_timeout` seconds.
+
+While the breaker is open, reads for which a response was stored earlier (see
+the client's `revalidate` option) are answered with that (possibly stale)
+response instead of failing. Callers that retry failed calls should wait for
+`retry_after` seconds before retrying a call the breaker rejected.
+"""
+
+from time import time
+import httplib
+import threading
+
+from lastfm.errors import ServiceOfflineError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitBreaker(object):
+    """
+    Tracks the health of the last.fm service and decides whether calls should
+    be attempted.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, probes=1):
+        """
+        Creates a new, closed circuit breaker.
+        
+        `probes` is the number of requests let through at once to test
+        whether the service has recovered.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = 0
+        self.times_opened = 0
+        self.rejected = 0
+    
+    @property
+    def state(self):
+        """The state of the breaker: "closed", "open" or "half-open"."""
+        with self._lock:
+            if self._state == OPEN and self._ready_to_probe():
+                return HALF_OPEN
+            return self._state
+    
+    def _ready_to_probe(self):
+        return time() - self._opened_at >= self.reset_timeout
+    
+    def allow(self):
+        """
+        Returns whether a call should be attempted. Every call that is allowed
+        must be followed by a call to `success`, `failure` or `abandon`.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self._ready_to_probe():
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return True
+            self.rejected += 1
+            return False
+    
+    def success(self):
+        """Records that a call succeeded."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = max(self._probing - 1, 0)
+            self._state = CLOSED
+            self._failures = 0
+    
+    def failure(self):
+        """Records that a call failed."""
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN:
+                self._probing = max(self._probing - 1, 0)
+                self._trip()
+            elif (self._state == CLOSED and
+                self._failures >= self.failure_threshold):
+                self._trip()
+    
+    def abandon(self):
+        """
+        Records that a call ended in a way that says nothing about the health
+        of the service (e.g., the caller ran out of time).
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = max(self._probing - 1, 0)
+    
+    def retry_after(self):
+        """
+        Returns the number of seconds until an open breaker lets a probe
+        through (0 if the breaker is not open, or is ready for a probe).
+        """
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time())
+    
+    def _trip(self):
+        # A failed probe reopens the breaker, but does not count as opening
+        # it again.
+        if self._state == CLOSED:
+            self.times_opened += 1
+        self._state = OPEN
+        self._opened_at = time()
+    
+    def reset(self):
+        """Closes the breaker."""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = 0
+    
+    @staticmethod
+    def is_failure(error):
+        """
+        Returns whether an exception raised by a call indicates that the
+        service is unhealthy (as opposed to, say, invalid parameters).
+        """
+        if isinstance(error, ServiceOfflineError):
+            return True
+        code = getattr(error, 'code', None)
+        if isinstance(error, IOError) and isinstance(code, int):
+            # An HTTP error response; only server errors count.
+            return code >= 500
+        return isinstance(error, (IOError, httplib.HTTPException))
+    
+    def snapshot(self):
+        """Returns the state of the breaker as a dictionary, for monitoring."""
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'opened_at': self._opened_at,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+    
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.state)
@@ -18,10 +18,14 @@ class Cache(object):
         Creates a new local cache.
         
         The `timeout` parameter is the number of seconds that an item can
-        live in the cache before expiring.
+        live in the cache before expiring. Expired items are kept until they
+        are replaced or purged; the cache purges them as items are stored, at
+        most once every `timeout` seconds.
         """
         self._store = {}
         self._timeout = timeout
+        self._next_purge = time() + timeout
+        self.evictions = 0
         
     def __getitem__(self, key):
         try:
@@ -29,10 +33,46 @@ class Cache(object):
             return (expiration >= time() and item) or None
         except KeyError:
             return None
-        
+    
+    def purge(self):
+        """
+        Drops the expired items without waiting for the next periodic purge,
+        and returns the number dropped.
+        """
+        now = time()
+        self._next_purge = now + self._timeout
+        expired = [key for key, (item, expiration) in self._store.items()
+            if expiration < now]
+        for key in expired:
+            self._store.pop(key, None)
+        self.evictions += len(expired)
+        return len(expired)
+    
     def __setitem__(self, key, value):
-        self._store[key] = (value, time() + self._timeout)
+        self.set(key, value)
         
+    def set(self, key, value, timeout=None):
+        """
+        Stores `value` under `key`. If `timeout` is given, the item expires
+        after that many seconds instead of the cache's default timeout.
+        """
+        if timeout is None:
+            timeout = self._timeout
+        now = time()
+        if now >= self._next_purge:
+            self.purge()
+        self._store[key] = (value, now + timeout)
+    
+    def entries(self):
+        """
+        Yields a (key, value, expiration) tuple for each unexpired item in the
+        cache, where `expiration` is a Unix timestamp.
+        """
+        now = time()
+        for key, (item, expiration) in self._store.items():
+            if expiration >= now:
+                yield (key, item, expiration)
+    
     def __delitem__(self, key):
         try:
             del self._store[key]
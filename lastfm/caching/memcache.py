@@ -16,7 +16,13 @@ except ImportError:
         raise ImportError("No memcache implementation module found "
             "(tried cmemcache and memcache)")
 
+from math import ceil
 import re
+from time import time
+
+# memcached reads expiration times longer than this many seconds (30 days) as
+# absolute Unix timestamps.
+_MAX_RELATIVE_EXPIRATION = 60 * 60 * 24 * 30
 
 class Cache(object):
     """
@@ -32,7 +38,7 @@ class Cache(object):
     
     _control_chars = re.compile(r'[\x00-\x21\x7f]+')
     
-    def __init__(self, servers, format=None, timeout=600):
+    def __init__(self, servers, format=None, timeout=600, track_keys=False):
         """
         Creates a new memcached-backed cache.
         
@@ -52,10 +58,16 @@ class Cache(object):
         
         The `timeout` parameter gives the time to live for items in this cache
         in seconds.
+        
+        memcached cannot list the keys it holds, so by default the contents of
+        this cache cannot be enumerated (e.g., by lastfm.caching.snapshot). If
+        `track_keys` is true, the cache remembers the keys and expiration times
+        of the items stored through it so that they can be.
         """
         
         self._format = format or '%s'
         self._timeout = timeout
+        self._tracked = (track_keys and {}) or None
         
         if isinstance(servers, basestring):
             servers = [servers]
@@ -69,10 +81,74 @@ class Cache(object):
         return self._client.get(self._expand_key(key))
         
     def __setitem__(self, key, value):
-        self._client.set(self._expand_key(key), value, self._timeout)
+        self.set(key, value)
+    
+    def set(self, key, value, timeout=None):
+        """
+        Stores `value` under `key`. If `timeout` is given, the item expires
+        after that many seconds instead of the cache's default timeout.
+        """
+        if timeout is None:
+            timeout = self._timeout
+        self._client.set(self._expand_key(key), value,
+            self._expiration(timeout))
+        if self._tracked is not None:
+            self._tracked[key] = time() + timeout
+    
+    @staticmethod
+    def _expiration(timeout):
+        """
+        Converts a time to live in seconds to the expiration time given to
+        memcached.
+        """
+        # Round up: to memcached, 0 means "never expire".
+        seconds = max(1, int(ceil(timeout)))
+        if seconds > _MAX_RELATIVE_EXPIRATION:
+            return int(ceil(time() + timeout))
+        return seconds
         
     def __delitem__(self, key):
         self._client.delete(self._expand_key(key))
+        if self._tracked is not None:
+            self._tracked.pop(key, None)
+    
+    def entries(self):
+        """
+        Yields a (key, value, expiration) tuple for each unexpired item stored
+        through this cache object. Only available if the cache was created
+        with `track_keys` set.
+        """
+        if self._tracked is None:
+            raise TypeError("memcached caches can only be enumerated when "
+                "created with track_keys=True")
+        
+        now = time()
+        for key, expiration in self._tracked.items():
+            if expiration < now:
+                del self._tracked[key]
+                continue
+            value = self[key]
+            if value is not None:
+                yield (key, value, expiration)
         
+    @property
+    def evictions(self):
+        """
+        The number of items the memcached servers have evicted to make room
+        for others, summed over the servers that answer, or None if the
+        memcache module cannot report server statistics. The count covers
+        everything stored on the servers, not only this cache's items, and
+        asking for it takes a round trip to each server.
+        """
+        try:
+            get_stats = self._client.get_stats
+        except AttributeError:
+            return None
+        
+        total = 0
+        for server, stats in get_stats():
+            total += int(stats.get('evictions', 0))
+        return total
+    
     def __contains__(self, key):
         return self[key] is not None
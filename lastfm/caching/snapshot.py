@@ -0,0 +1,99 @@
+# encoding: utf-8
+
+"""
+Exports the contents of a cache to a compact file and loads them back into
+another cache. This can be used to warm up a fresh cache from a snapshot of a
+busy one instead of refilling it from the last.fm service.
+
+Any cache can be exported if it has an `entries` method that yields
+(key, value, expiration) tuples, and any cache can be loaded if it has a
+`set(key, value, timeout)` method. Both bundled caches support this; see their
+documentation for details.
+    
+    from lastfm.caching import local, snapshot
+    
+    snapshot.dump(client.cache, 'lastfm-cache.snap')
+    ...
+    warm = local.Cache()
+    snapshot.load(warm, 'lastfm-cache.snap')
+"""
+
+import gzip
+from time import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+SNAPSHOT_VERSION = 1
+
+def dump(cache, destination):
+    """
+    Writes every unexpired item in `cache` to `destination`, which may be a
+    filename or a file object opened for writing in binary mode. Returns the
+    number of items written.
+    
+    Each item is stored with its expiration time, so items loaded back from
+    the snapshot keep the remainder of their time to live.
+    """
+    
+    try:
+        entries = cache.entries
+    except AttributeError:
+        raise TypeError('%s objects cannot be enumerated' %
+            type(cache).__name__)
+    
+    stream = _open(destination, 'wb')
+    try:
+        header = {'version': SNAPSHOT_VERSION, 'created': time()}
+        pickle.dump(header, stream, pickle.HIGHEST_PROTOCOL)
+        
+        count = 0
+        for entry in entries():
+            pickle.dump(entry, stream, pickle.HIGHEST_PROTOCOL)
+            count += 1
+        return count
+    finally:
+        stream.close()
+
+def load(cache, source):
+    """
+    Stores the items from the snapshot in `source` (a filename or a file object
+    opened for reading in binary mode) into `cache`. Items that have expired
+    since the snapshot was taken are skipped. Returns the number of items
+    loaded.
+    """
+    
+    try:
+        store = cache.set
+    except AttributeError:
+        raise TypeError('%s objects do not support setting timeouts' %
+            type(cache).__name__)
+    
+    stream = _open(source, 'rb')
+    try:
+        header = pickle.load(stream)
+        if header.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('unsupported cache snapshot version %r' %
+                header.get('version'))
+        
+        count = 0
+        now = time()
+        while True:
+            try:
+                key, value, expiration = pickle.load(stream)
+            except EOFError:
+                break
+            
+            remaining = expiration - now
+            if remaining > 0:
+                store(key, value, remaining)
+                count += 1
+        return count
+    finally:
+        stream.close()
+
+def _open(target, mode):
+    if isinstance(target, basestring):
+        return gzip.open(target, mode)
+    return gzip.GzipFile(fileobj=target, mode=mode)
@@ -0,0 +1,480 @@
+# encoding: utf-8
+
+"""
+Crawls the graph of similar artists breadth-first, starting from a set of
+seed artists:
+    
+    crawler = lastfm.crawler.Crawler(client, depth=3, max_nodes=100000,
+        workers=8, checkpoint='similar.crawl')
+    crawler.crawl(['Cher', 'Madonna'])
+    for source, target, match in crawler.edges():
+        ...
+
+Each artist found becomes a node, numbered in the order in which it was
+discovered; `crawler.nodes` lists the (name, mbid) of each one. Artists are
+matched by their MusicBrainz ID when last.fm gives one, and by their name
+(ignoring case) otherwise, so an artist reached along several paths is only
+fetched once. Each edge links an artist to one of its similar artists, with
+last.fm's match score as its weight. An artist's depth is its distance from
+the nearest seed: if a shorter path to an artist turns up after it was found,
+its depth is lowered, and it is expanded (again) if that brings it within
+reach.
+
+The similar artists of up to `workers` artists are fetched at a time. All
+calls go through the client, so the per-key rate limits of a client created
+with a KeyPool apply; otherwise, the crawler keeps to `rate` calls per second.
+
+If a `checkpoint` path is given, the state of the crawl is saved there every
+`checkpoint_interval` seconds and when the crawl ends or is interrupted. A
+crawler created later with the same path picks up where the last one stopped.
+
+Progress is logged to the "lastfm.crawler" logger every `report_interval`
+seconds, and passed to the `progress` callback, if one was given.
+"""
+
+from array import array
+from collections import deque
+from time import time
+import gzip
+import heapq
+import logging
+import os
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from lastfm.errors import CircuitOpenError, RateLimitExceededError
+from lastfm.breaker import CircuitBreaker
+from lastfm.keys import KeyPool, RateLimiter
+
+log = logging.getLogger('lastfm.crawler')
+
+CHECKPOINT_VERSION = 2
+
+# What has been done with each node. A node is requeued when it has been
+# expanded, but a shorter path to it has been found since.
+_NEW, _QUEUED, _EXPANDED, _REQUEUED = 0, 1, 2, 3
+
+# last.fm's published limit on calls per second for each API key.
+DEFAULT_RATE = 5.0
+
+class Crawler(object):
+    """
+    A breadth-first crawler of the similar-artist graph.
+    """
+    
+    def __init__(self, client, depth=2, max_nodes=10000, workers=4, rate=None,
+        limit=None, min_match=0.0, retries=2, checkpoint=None,
+        checkpoint_interval=60.0, report_interval=10.0, progress=None,
+        retry_delay=1.0, max_retry_delay=60.0):
+        """
+        Creates a new crawler that makes its calls through `client`.
+        
+        The similar artists of the seeds and of every artist up to `depth`
+        steps away from them are fetched, until `max_nodes` artists have been
+        found; further artists are not added to the graph. Each call asks for
+        up to `limit` similar artists (by default, last.fm's default of 100),
+        and similar artists whose match score is below `min_match` are
+        ignored.
+        
+        If the client does not use a lastfm.keys.KeyPool, calls are limited
+        to `rate` calls per second (5 by default); a KeyPool already limits
+        each of its keys, so no further limit is applied unless `rate` is
+        given. Calls that fail because the service is unavailable are retried
+        up to `retries` times, after waiting `retry_delay` seconds; the wait
+        doubles with each retry, up to `max_retry_delay` seconds.
+        
+        `progress`, if given, is called with the result of `snapshot` every
+        `report_interval` seconds while the crawl runs.
+        """
+        self._client = client
+        self.depth = depth
+        self.max_nodes = max_nodes
+        self.workers = workers
+        self.limit = limit
+        self.min_match = min_match
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.checkpoint_path = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.report_interval = report_interval
+        self._progress = progress
+        
+        if rate is None and not isinstance(client.api_key, KeyPool):
+            rate = DEFAULT_RATE
+        self._limiter = (rate and RateLimiter(rate)) or None
+        
+        self._lock = threading.Condition()
+        self._stopping = False
+        self._finished = threading.Event()
+        self._running = 0
+        
+        # Node attributes, indexed by node ID.
+        self.nodes = []
+        self._depths = array('H')
+        self._states = bytearray()
+        # "mbid:..." and "name:..." keys, mapped to node IDs.
+        self._ids = {}
+        self._sources = array('i')
+        self._targets = array('i')
+        self._weights = array('f')
+        
+        self._frontier = deque()
+        # (time, node) pairs of nodes to retry once the time has come.
+        self._retrying = []
+        self._in_flight = set()
+        self._expanded = 0
+        self._attempts = {}
+        self.failed = set()
+        
+        self.calls = 0
+        self.errors = 0
+        self._elapsed = 0.0
+        self._started = None
+        
+        if checkpoint and os.path.exists(checkpoint):
+            self._restore(checkpoint)
+    
+    def crawl(self, seeds=()):
+        """
+        Adds the given seed artists (names or Artist objects) to the crawl
+        and runs it until every artist within reach has been expanded, the
+        node budget is exhausted or `stop` is called. Returns the final
+        progress snapshot.
+        """
+        with self._lock:
+            for seed in seeds:
+                if isinstance(seed, basestring):
+                    self._add_node(seed, None, 0)
+                else:
+                    self._add_node(seed.name, seed.id, 0)
+            self._stopping = False
+            self._finished.clear()
+            self._running = self.workers
+        
+        self._started = time()
+        threads = []
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self._work,
+                name='lastfm-crawler-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        
+        next_report = time() + self.report_interval
+        next_checkpoint = time() + self.checkpoint_interval
+        try:
+            while not self._finished.wait(0.5):
+                now = time()
+                if now >= next_report:
+                    self._report()
+                    next_report = now + self.report_interval
+                if self.checkpoint_path and now >= next_checkpoint:
+                    self.save_checkpoint()
+                    next_checkpoint = now + self.checkpoint_interval
+        finally:
+            # Let the calls in flight finish so that their results are kept.
+            self.stop()
+            for thread in threads:
+                thread.join()
+            self._elapsed += time() - self._started
+            self._started = None
+            if self.checkpoint_path:
+                self.save_checkpoint()
+        
+        return self._report()
+    
+    def stop(self):
+        """
+        Asks the crawl to stop once the calls in flight have finished. The
+        artists left to expand are kept, and are expanded by the next call to
+        `crawl`.
+        """
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+    
+    def _work(self):
+        try:
+            while True:
+                with self._lock:
+                    while not self._stopping:
+                        now = time()
+                        while self._retrying and self._retrying[0][0] <= now:
+                            self._frontier.append(
+                                heapq.heappop(self._retrying)[1])
+                        if self._frontier or not (self._in_flight or
+                            self._retrying):
+                            break
+                        self._lock.wait((self._retrying and
+                            self._retrying[0][0] - now) or None)
+                    if self._stopping or not self._frontier:
+                        self._lock.notify_all()
+                        return
+                    node = self._frontier.popleft()
+                    self._in_flight.add(node)
+                    self.calls += 1
+                
+                try:
+                    rows = self._fetch(node)
+                except Exception as e:
+                    with self._lock:
+                        self._in_flight.discard(node)
+                        self._fail(node, e)
+                        self._lock.notify_all()
+                    continue
+                
+                with self._lock:
+                    self._in_flight.discard(node)
+                    self._expand(node, rows)
+                    self._lock.notify_all()
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self._finished.set()
+    
+    def _fetch(self, node):
+        name, mbid = self.nodes[node]
+        params = {'artist': name}
+        if self.limit:
+            params['limit'] = self.limit
+        if self._limiter:
+            self._limiter.acquire()
+        
+        raw = self._client.raw.artist.get_similar(**params)
+        rows = raw['similarartists'].get('artist') or []
+        if isinstance(rows, dict):
+            # last.fm gives a lone similar artist as an object, not a list.
+            rows = [rows]
+        return rows
+    
+    def _expand(self, node, rows):
+        # A node expanded again (after a shorter path to it was found) only
+        # passes its new depth on; its edges are already known.
+        again = self._states[node] == _REQUEUED
+        self._states[node] = _EXPANDED
+        depth = self._depths[node] + 1
+        for row in rows:
+            match = float(row.get('match') or 0)
+            if match < self.min_match:
+                continue
+            target = self._add_node(row['name'], row.get('mbid'), depth)
+            if target is None or target == node or again:
+                continue
+            self._sources.append(node)
+            self._targets.append(target)
+            self._weights.append(match)
+        self._attempts.pop(node, None)
+        if not again:
+            self._expanded += 1
+    
+    def _fail(self, node, error):
+        self.errors += 1
+        attempts = self._attempts.get(node, 0) + 1
+        if attempts <= self.retries and _is_transient(error):
+            self._attempts[node] = attempts
+            delay = min(self.retry_delay * (2 ** (attempts - 1)),
+                self.max_retry_delay)
+            breaker = getattr(self._client, 'breaker', None)
+            if isinstance(error, CircuitOpenError) and breaker:
+                # Retrying before the breaker lets a probe through would
+                # only be rejected again.
+                delay = max(delay, breaker.retry_after())
+            heapq.heappush(self._retrying, (time() + delay, node))
+            return
+        
+        self._attempts.pop(node, None)
+        self.failed.add(node)
+        log.warning('could not fetch the artists similar to %s: %s',
+            self.nodes[node][0], error)
+    
+    def _add_node(self, name, mbid, depth):
+        """
+        Returns the ID of the node for the given artist, adding it (and
+        queueing it for expansion) if it is new. Returns None if the artist is
+        new but the node budget has been used up.
+        """
+        keys = []
+        if mbid:
+            keys.append('mbid:' + mbid)
+        keys.append('name:' + name.lower())
+        for key in keys:
+            node = self._ids.get(key)
+            if node is not None:
+                for alias in keys:
+                    self._ids.setdefault(alias, node)
+                if depth < self._depths[node]:
+                    self._lower_depth(node, depth)
+                return node
+        
+        if len(self.nodes) >= self.max_nodes:
+            return None
+        node = len(self.nodes)
+        self.nodes.append((name, mbid or None))
+        self._depths.append(depth)
+        self._states.append(_NEW)
+        for key in keys:
+            self._ids[key] = node
+        if depth < self.depth:
+            self._states[node] = _QUEUED
+            self._frontier.append(node)
+        return node
+    
+    def _lower_depth(self, node, depth):
+        """
+        Records a shorter path to `node`, queueing it for expansion if that
+        brings it (or, if it was already expanded, its similar artists) within
+        reach. Nodes that are queued or being fetched pick the new depth up
+        when they are expanded.
+        """
+        self._depths[node] = depth
+        if depth >= self.depth:
+            return
+        state = self._states[node]
+        if state == _NEW:
+            self._states[node] = _QUEUED
+            self._frontier.append(node)
+        elif state == _EXPANDED:
+            self._states[node] = _REQUEUED
+            self._frontier.append(node)
+    
+    def node_id(self, name=None, mbid=None):
+        """
+        Returns the ID of the node for the artist with the given name or
+        MusicBrainz ID, or None if it has not been found.
+        """
+        node = mbid and self._ids.get('mbid:' + mbid)
+        if node is None and name:
+            node = self._ids.get('name:' + name.lower())
+        return node
+    
+    def depth_of(self, node):
+        """Returns the number of steps from the nearest seed to `node`."""
+        return self._depths[node]
+    
+    def edges(self):
+        """Yields every edge found as a (source, target, match) tuple."""
+        for i in xrange(len(self._sources)):
+            yield self._sources[i], self._targets[i], self._weights[i]
+    
+    def edge_arrays(self):
+        """
+        Returns copies of the arrays holding the source node, target node and
+        match score of every edge.
+        """
+        with self._lock:
+            return (array('i', self._sources), array('i', self._targets),
+                array('f', self._weights))
+    
+    def snapshot(self):
+        """Returns the progress of the crawl as a dictionary."""
+        with self._lock:
+            elapsed = self._elapsed
+            if self._started is not None:
+                elapsed += time() - self._started
+            return {
+                'nodes': len(self.nodes),
+                'edges': len(self._sources),
+                'expanded': self._expanded,
+                'frontier': len(self._frontier),
+                'retrying': len(self._retrying),
+                'in_flight': len(self._in_flight),
+                'failed': len(self.failed),
+                'calls': self.calls,
+                'errors': self.errors,
+                'elapsed': elapsed,
+                'calls_per_sec': (elapsed and self.calls / elapsed) or 0.0
+            }
+    
+    def _report(self):
+        progress = self.snapshot()
+        log.info('%(nodes)d artists found, %(expanded)d expanded, '
+            '%(frontier)d waiting, %(edges)d edges, %(errors)d errors '
+            '(%(calls_per_sec).1f calls/s)', progress)
+        if self._progress:
+            self._progress(progress)
+        return progress
+    
+    def save_checkpoint(self, path=None):
+        """
+        Saves the state of the crawl to `path` (by default, the crawler's
+        checkpoint path). The file is replaced atomically, so an interrupted
+        save leaves the previous checkpoint intact.
+        """
+        path = path or self.checkpoint_path
+        with self._lock:
+            state = {
+                'version': CHECKPOINT_VERSION,
+                'created': time(),
+                'nodes': list(self.nodes),
+                'depths': array('H', self._depths),
+                'states': bytearray(self._states),
+                'ids': dict(self._ids),
+                'sources': array('i', self._sources),
+                'targets': array('i', self._targets),
+                'weights': array('f', self._weights),
+                # Artists being fetched or waiting to be retried are
+                # expanded after a resume.
+                'frontier': list(self._in_flight) + [node for ready, node in
+                    sorted(self._retrying)] + list(self._frontier),
+                'expanded': self._expanded,
+                'failed': set(self.failed),
+                'calls': self.calls,
+                'errors': self.errors,
+                'elapsed': self._elapsed + ((self._started is not None and
+                    time() - self._started) or 0.0)
+            }
+        
+        temporary = path + '.tmp'
+        stream = gzip.open(temporary, 'wb', 1)
+        try:
+            pickle.dump(state, stream, pickle.HIGHEST_PROTOCOL)
+        finally:
+            stream.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary, path)
+    
+    def _restore(self, path):
+        stream = gzip.open(path, 'rb')
+        try:
+            state = pickle.load(stream)
+        finally:
+            stream.close()
+        if state.get('version') not in (1, CHECKPOINT_VERSION):
+            raise ValueError('unsupported crawl checkpoint version %r' %
+                state.get('version'))
+        
+        self.nodes = state['nodes']
+        self._depths = state['depths']
+        self._states = state.get('states')
+        if self._states is None:
+            # Version 1 did not keep states; every node within reach that
+            # is not waiting to be expanded has been.
+            self._states = bytearray(((depth < self.depth and _EXPANDED) or
+                _NEW) for depth in self._depths)
+            for node in state['frontier']:
+                self._states[node] = _QUEUED
+        self._ids = state['ids']
+        self._sources = state['sources']
+        self._targets = state['targets']
+        self._weights = state['weights']
+        self._frontier = deque(state['frontier'])
+        self._expanded = state['expanded']
+        self.failed = state['failed']
+        self.calls = state['calls']
+        self.errors = state['errors']
+        self._elapsed = state['elapsed']
+    
+    def __repr__(self):
+        return '<%s %d nodes, %d edges>' % (type(self).__name__,
+            len(self.nodes), len(self._sources))
+
+def _is_transient(error):
+    """Returns whether a failed call is worth retrying."""
+    return (isinstance(error, RateLimitExceededError) or
+        CircuitBreaker.is_failure(error))
@@ -4,8 +4,8 @@
 Common data types used elsewhere in the library.
 """
 
-from email.utils import parsedate
 from datetime import datetime
+from time import time
 import re
 
 class Image(object):
@@ -81,6 +81,9 @@ class SmartData(object):
     always immediately available (e.g., artists).
     """
     
+    # The kind of the rows of this type, as they are indexed by the client.
+    _kind = None
+    
     def __init__(self, client):
         self._client = client
         
@@ -96,6 +99,10 @@ class SmartData(object):
         return obj
         
     def _add_data(self, row):
+        stats = getattr(getattr(self, '_client', None), 'stats', None)
+        if stats is not None:
+            start = time()
+        
         def add(prop, converter=None, dest=None, needs_client=False):
             if not dest:
                 dest = '_%s' % prop
@@ -124,8 +131,20 @@ class SmartData(object):
             
             add(spec[0], spec[1], dest, needs_client)
         
+        index = getattr(getattr(self, '_client', None), 'tag_index', None)
+        if index is not None and self._kind is not None:
+            self._index_tags(index, row)
+        
+        if stats is not None:
+            stats.observe('time.decode', time() - start)
         return self
         
+    def _index_tags(self, index, row):
+        # Only rows that come with their tags can say what the tags are.
+        for spec in self._fields:
+            if spec[1] is handle_tags and spec[0] in row:
+                index.add(self._kind, row, handle_tags(row[spec[0]]))
+    
     def __getstate__(self):
         state = dict(self.__dict__)
         if '_client' in state:
@@ -229,6 +248,8 @@ def parse_timestamp(stamp):
     Parses an RFC822 timestamp as used by last.fm and returns a
     datetime.datetime object representing that time.
     """
+    # The email package is slow to import, and is only needed here.
+    from email.utils import parsedate
     return datetime(*parsedate(stamp)[:6])
 
 def handle_album_artist(info, client):
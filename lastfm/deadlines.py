@@ -0,0 +1,79 @@
+# encoding: utf-8
+
+"""
+Latency budgets that cover every API call made while they are in effect.
+
+A deadline is set for a block of code with the `deadline` context manager
+(also available as Client.deadline):
+    
+    with client.deadline(2.0):
+        artist = client.artists.get('Cher')
+        albums = artist.top_albums
+
+Every API call made on the same thread inside the block, including the ones
+made behind the scenes by lazily-loaded properties, misspelling redirects and
+search result pages, gets a socket timeout no longer than the time left. Once
+the time is up, further calls raise lastfm.errors.DeadlineExceededError
+without being sent. Deadlines can be nested; the earliest one applies.
+
+The time left is also checked between the reads of a response body, so a
+slowly trickling response is cut off. A socket timeout only bounds each
+connection attempt and read on its own, though, and the DNS lookup is not
+bounded at all, so a call can overrun its deadline by up to one socket
+operation (plus the lookup).
+"""
+
+from contextlib import contextmanager
+from time import time
+import threading
+
+from lastfm.errors import DeadlineExceededError
+
+_local = threading.local()
+
+@contextmanager
+def deadline(seconds):
+    """
+    Sets a deadline `seconds` from now for the calls made in the block.
+    """
+    expires = time() + seconds
+    previous = getattr(_local, 'expires', None)
+    if previous is not None and previous < expires:
+        expires = previous
+    
+    _local.expires = expires
+    try:
+        yield expires
+    finally:
+        _local.expires = previous
+
+def remaining():
+    """
+    Returns the number of seconds left before the current deadline, or None
+    if there is no deadline.
+    """
+    expires = getattr(_local, 'expires', None)
+    if expires is None:
+        return None
+    return expires - time()
+
+def expired():
+    """Returns whether the current deadline has passed."""
+    left = remaining()
+    return left is not None and left <= 0
+
+def timeout(limit=None):
+    """
+    Returns the timeout to use for a call: the smaller of `limit` and the
+    time left before the current deadline, or None if there is neither.
+    Raises DeadlineExceededError if the deadline has already passed.
+    """
+    left = remaining()
+    if left is None:
+        return limit
+    if left <= 0:
+        raise DeadlineExceededError('deadline exceeded by %.3f seconds' %
+            -left)
+    if limit is None:
+        return left
+    return min(limit, left)
@@ -0,0 +1,81 @@
+# encoding: utf-8
+
+"""
+JSON decoders for API responses.
+
+By default, responses are decoded with ujson if it is installed, and with the
+standard library's json module otherwise; both return Unicode strings, as the
+client always has. simplejson is often faster than json, but returns byte
+strings rather than Unicode strings for ASCII text, so it is only used when
+asked for. A particular decoder can be chosen by name when creating a client:
+    
+    client = lastfm.Client(api_key, decoder='json')
+
+A decoder can also be any function that takes the body of a response (a byte
+string holding UTF-8 encoded JSON) and returns the decoded data.
+"""
+
+def _ujson():
+    import ujson
+    return ujson.loads
+
+def _simplejson():
+    import simplejson
+    # Without its C extension, simplejson is slower than the standard library.
+    from simplejson import _speedups
+    return simplejson.loads
+
+def _json():
+    try:
+        import json
+    except ImportError:
+        import simplejson as json
+    return json.loads
+
+# The known decoders, in order of preference; the default is chosen from
+# those that decode strings the same way.
+DECODERS = ('ujson', 'json', 'simplejson')
+_DEFAULTS = ('ujson', 'json')
+_loaders = {'ujson': _ujson, 'simplejson': _simplejson, 'json': _json}
+_default = None
+_available = None
+
+def get_decoder(name=None):
+    """
+    Returns the decoding function called `name`, or the preferred one installed
+    if `name` is None.
+    
+    Raises ValueError if the name is not one of DECODERS, and ImportError if
+    the decoder is not installed.
+    """
+    global _default
+    if name is None:
+        if _default is None:
+            for name in _DEFAULTS:
+                try:
+                    _default = _loaders[name]()
+                    break
+                except ImportError:
+                    pass
+        return _default
+    
+    try:
+        loader = _loaders[name]
+    except KeyError:
+        raise ValueError('unknown JSON decoder %r; expected one of %s' %
+            (name, ', '.join(DECODERS)))
+    return loader()
+
+def available():
+    """Returns the names of the installed decoders, in order of preference."""
+    global _available
+    if _available is None:
+        names = []
+        for name in DECODERS:
+            try:
+                _loaders[name]()
+            except ImportError:
+                continue
+            names.append(name)
+        _available = tuple(names)
+    return list(_available)
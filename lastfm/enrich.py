@@ -0,0 +1,440 @@
+# encoding: utf-8
+
+"""
+Enriches large lists of artists or albums with their last.fm information,
+using several processes that share one rate limit.
+
+From the command line, a CSV file with an "artist" column (and an "album"
+column, for albums) is enriched into a JSON Lines file:
+    
+    python -m lastfm.enrich --api-key KEY --processes 8 artists.csv out.jsonl
+    python -m lastfm.enrich --api-key KEY --kind album albums.csv out.jsonl
+
+or from Python, with any iterable of dictionaries as the input:
+    
+    enricher = BulkEnricher(api_key, kind='artist', processes=8)
+    enricher.run(csv.DictReader(open('artists.csv')), 'out.jsonl')
+
+Each output line holds the number of the input row (`row`), the input row
+itself (`input`), and either the `artist.getInfo` or `album.getInfo` data
+(`artist` or `album`) or an `error` object. Lines are written in the order in
+which lookups finish, not in input order.
+
+Rows are read as they are needed: each worker process has a bounded queue
+of rows waiting for it, and reading stops while the queues are full. Rows are
+assigned to workers by their artist (and album) name, so repeated names are
+answered from the worker's cache. A memcached cache can also be shared by all
+workers and across runs.
+
+Progress is saved next to the output file every few seconds. If a run is
+interrupted, running it again with the same output file skips the rows that
+have already been written and continues after them.
+"""
+
+from optparse import OptionParser
+from time import time, sleep
+import csv
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import zlib
+from Queue import Empty
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm.errors import CircuitOpenError, RateLimitExceededError
+from lastfm.breaker import CircuitBreaker
+from lastfm.keys import KeyPool, SharedRateLimiter
+
+log = logging.getLogger('lastfm.enrich')
+
+# last.fm's published limit on calls per second for each API key.
+DEFAULT_RATE = 5.0
+PROGRESS_VERSION = 1
+
+KINDS = ('artist', 'album')
+
+class BulkEnricher(object):
+    """
+    Looks up many artists or albums at once with a pool of processes.
+    """
+    
+    def __init__(self, api_key, kind='artist', processes=4, rate=None,
+        memcached=None, queue_size=100, retries=3, timeout=30.0,
+        artist_column='artist', album_column='album', report_interval=10.0,
+        checkpoint_interval=5.0):
+        """
+        Creates a new enricher that makes its calls with `api_key` (a key or
+        a list of keys).
+        
+        `kind` is "artist" or "album". Calls are spread over `processes`
+        worker processes, which together make no more than `rate` calls per
+        second (by default, 5 per API key); each key also keeps to its own
+        rate limit across all the workers. `memcached`, if given, is a list
+        of memcached servers used as a cache by every worker; otherwise each
+        worker keeps a local cache.
+        
+        Each worker has at most `queue_size` rows waiting for it. Lookups that
+        fail because the service is unavailable or overloaded are retried up
+        to `retries` times, and each call times out after `timeout` seconds.
+        
+        Names are read from the `artist_column` and `album_column` fields of
+        each input row.
+        """
+        if kind not in KINDS:
+            raise ValueError('unknown kind %r; expected one of %s' %
+                (kind, ', '.join(KINDS)))
+        self.api_key = api_key
+        self.kind = kind
+        self.processes = processes
+        if rate is None:
+            keys = (isinstance(api_key, (list, tuple)) and len(api_key)) or 1
+            rate = DEFAULT_RATE * keys
+        self.rate = rate
+        self.memcached = memcached
+        self.queue_size = queue_size
+        self.retries = retries
+        self.timeout = timeout
+        self.artist_column = artist_column
+        self.album_column = album_column
+        self.report_interval = report_interval
+        self.checkpoint_interval = checkpoint_interval
+    
+    def _shard(self, row):
+        key = row.get(self.artist_column) or ''
+        if self.kind == 'album':
+            key += '\0' + (row.get(self.album_column) or '')
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return (zlib.crc32(key.lower()) & 0xffffffff) % self.processes
+    
+    def run(self, rows, output, progress=None):
+        """
+        Enriches the dictionaries in `rows`, appending the results to the file
+        at `output`, and returns a summary of the run.
+        
+        Progress is kept in the file at `progress` (by default, the output
+        path followed by ".progress"). If it exists, rows that a previous run
+        already finished are skipped.
+        """
+        progress_path = progress or output + '.progress'
+        state = _Progress.load(progress_path)
+        if state is None:
+            if os.path.exists(output) and os.path.getsize(output):
+                raise ValueError('%s already exists, but there is no record '
+                    'of the run that wrote it in %s' % (output, progress_path))
+            state = _Progress()
+        out = _open_output(output, state.offset)
+        
+        limiter = SharedRateLimiter(self.rate)
+        api_key = self.api_key
+        if isinstance(api_key, (list, tuple)):
+            # One pool for all the workers, so that each key's rate limit is
+            # kept across processes rather than separately by each of them.
+            api_key = KeyPool(api_key, shared=True)
+        results = multiprocessing.Queue(self.queue_size * self.processes)
+        tasks = [multiprocessing.Queue(self.queue_size)
+            for i in xrange(self.processes)]
+        settings = dict(api_key=api_key, kind=self.kind,
+            memcached=self.memcached, retries=self.retries,
+            timeout=self.timeout, artist_column=self.artist_column,
+            album_column=self.album_column)
+        workers = [multiprocessing.Process(target=_work,
+            args=(settings, tasks[i], results, limiter))
+            for i in xrange(self.processes)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        
+        reader = _Reader(self, rows, tasks, state)
+        reader.start()
+        
+        stats = {'written': 0, 'errors': 0, 'skipped': 0}
+        started = time()
+        next_report = started + self.report_interval
+        next_checkpoint = started + self.checkpoint_interval
+        running = self.processes
+        try:
+            while running:
+                try:
+                    message = results.get(timeout=1.0)
+                except Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise RuntimeError('the worker processes exited '
+                            'unexpectedly')
+                    continue
+                if message is None:
+                    running -= 1
+                    continue
+                
+                number, record = message
+                out.write(json.dumps(record, separators=(',', ':')) + '\n')
+                state.finish(number)
+                stats['written'] += 1
+                if 'error' in record:
+                    stats['errors'] += 1
+                
+                now = time()
+                if now >= next_checkpoint:
+                    state.save(progress_path, out)
+                    next_checkpoint = now + self.checkpoint_interval
+                if now >= next_report:
+                    self._report(stats, state, reader, started)
+                    next_report = now + self.report_interval
+        finally:
+            reader.stop()
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            state.save(progress_path, out)
+            out.close()
+        
+        if reader.error:
+            raise reader.error
+        stats['skipped'] = reader.skipped
+        stats['elapsed'] = time() - started
+        self._report(stats, state, reader, started)
+        return stats
+    
+    def _report(self, stats, state, reader, started):
+        elapsed = time() - started
+        log.info('%d rows written (%d errors), %d read, %d skipped; '
+            '%.1f rows/s', stats['written'], stats['errors'], reader.read,
+            reader.skipped, (elapsed and stats['written'] / elapsed) or 0.0)
+
+
+class _Reader(threading.Thread):
+    """Feeds input rows to the workers' queues, skipping finished rows."""
+    
+    def __init__(self, enricher, rows, tasks, state):
+        super(_Reader, self).__init__(name='lastfm-enrich-reader')
+        self.daemon = True
+        self._enricher = enricher
+        self._rows = rows
+        self._tasks = tasks
+        self._state = state
+        self._stopping = False
+        self.read = 0
+        self.skipped = 0
+        self.error = None
+    
+    def run(self):
+        try:
+            for number, row in enumerate(self._rows):
+                if self._stopping:
+                    return
+                self.read += 1
+                if self._state.is_finished(number):
+                    self.skipped += 1
+                    continue
+                queue = self._tasks[self._enricher._shard(row)]
+                # Blocks while the worker is behind, holding back the input.
+                queue.put((number, row))
+        except Exception as e:
+            self.error = e
+        finally:
+            for queue in self._tasks:
+                queue.put(None)
+    
+    def stop(self):
+        self._stopping = True
+
+
+class _Progress(object):
+    """
+    Tracks which rows have been written: every row before `next`, plus the
+    rows in `done`, which finished out of order.
+    """
+    
+    def __init__(self, next=0, done=(), offset=0):
+        self.next = next
+        self.done = set(done)
+        self.offset = offset
+    
+    @classmethod
+    def load(cls, path):
+        try:
+            stream = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            state = json.load(stream)
+        finally:
+            stream.close()
+        if state.get('version') != PROGRESS_VERSION:
+            raise ValueError('unsupported enrichment progress version %r' %
+                state.get('version'))
+        return cls(state['next'], state['done'], state['offset'])
+    
+    def is_finished(self, number):
+        return number < self.next or number in self.done
+    
+    def finish(self, number):
+        self.done.add(number)
+        while self.next in self.done:
+            self.done.remove(self.next)
+            self.next += 1
+    
+    def save(self, path, out):
+        out.flush()
+        os.fsync(out.fileno())
+        self.offset = out.tell()
+        
+        temporary = path + '.tmp'
+        stream = open(temporary, 'wb')
+        try:
+            json.dump({'version': PROGRESS_VERSION, 'next': self.next,
+                'done': sorted(self.done), 'offset': self.offset}, stream)
+        finally:
+            stream.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary, path)
+
+
+def _open_output(path, offset):
+    """
+    Opens the output file for appending, first discarding anything written
+    after the last saved progress (those rows will be looked up again).
+    """
+    out = open(path, 'ab')
+    out.seek(0, os.SEEK_END)
+    if out.tell() != offset:
+        out.truncate(offset)
+        out.seek(offset)
+    return out
+
+def _work(settings, tasks, results, limiter):
+    """The main function of a worker process."""
+    from lastfm.api import Client
+    
+    if settings['memcached']:
+        from lastfm.caching.memcache import Cache
+        cache = Cache(settings['memcached'])
+    else:
+        cache = None
+    agent = _LimitedAgent(limiter, timeout=settings['timeout'])
+    client = Client(settings['api_key'], cache=cache, agent=agent)
+    
+    if settings['kind'] == 'artist':
+        from lastfm.artists import Artist as kind
+    else:
+        from lastfm.albums import Album as kind
+    
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            number, row = task
+            record = _lookup(client, kind, settings, row)
+            record['row'] = number
+            results.put((number, record))
+    finally:
+        results.put(None)
+
+def _lookup(client, kind, settings, row):
+    record = {'row': None, 'input': row}
+    spec = {'artist': _text(row.get(settings['artist_column']))}
+    if settings['kind'] == 'album':
+        spec['album'] = _text(row.get(settings['album_column']))
+    if not all(spec.values()):
+        record['error'] = {'code': None, 'message': 'missing %s name' %
+            settings['kind']}
+        return record
+    
+    attempt = 0
+    while True:
+        try:
+            record[settings['kind']] = kind.fetch_row(client, spec)
+            return record
+        except Exception as e:
+            attempt += 1
+            transient = (isinstance(e, RateLimitExceededError) or
+                CircuitBreaker.is_failure(e))
+            if not transient or attempt > settings['retries']:
+                record['error'] = {'code': getattr(e, 'code', None),
+                    'message': unicode(e) or type(e).__name__}
+                return record
+            delay = min(2 ** attempt, 30)
+            breaker = client.breaker
+            if isinstance(e, CircuitOpenError) and breaker:
+                delay = max(delay, breaker.retry_after())
+            sleep(delay)
+
+def _text(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+class _LimitedAgent(object):
+    """Wraps an agent so that its requests keep to a shared rate limit."""
+    
+    def __init__(self, limiter, **kwargs):
+        from lastfm.network import Agent
+        self._agent = Agent(**kwargs)
+        self._limiter = limiter
+    
+    def get(self, url, data=None, **kwargs):
+        self._limiter.acquire()
+        return self._agent.get(url, data, **kwargs)
+    
+    def post(self, url, data=None, **kwargs):
+        self._limiter.acquire()
+        return self._agent.post(url, data, **kwargs)
+
+def main(args=None):
+    """The command-line entry point."""
+    parser = OptionParser(usage='%prog [options] INPUT.csv OUTPUT.jsonl')
+    parser.add_option('-k', '--api-key', action='append', dest='api_keys',
+        help='last.fm API key (repeat to spread calls across several keys)')
+    parser.add_option('--kind', choices=KINDS, default='artist',
+        help='what the rows name: artist or album [%default]')
+    parser.add_option('-p', '--processes', type='int',
+        default=multiprocessing.cpu_count(),
+        help='number of worker processes [%default]')
+    parser.add_option('-r', '--rate', type='float',
+        help='most calls per second across all workers [5 per key]')
+    parser.add_option('-m', '--memcached', action='append',
+        help='memcached server to share as a cache (repeatable)')
+    parser.add_option('--artist-column', default='artist',
+        help='CSV column holding artist names [%default]')
+    parser.add_option('--album-column', default='album',
+        help='CSV column holding album names [%default]')
+    parser.add_option('--queue-size', type='int', default=100,
+        help='rows waiting per worker [%default]')
+    parser.add_option('-q', '--quiet', action='store_true',
+        help='do not report progress')
+    options, arguments = parser.parse_args(args)
+    
+    if len(arguments) != 2:
+        parser.error('expected an input and an output file')
+    if not options.api_keys:
+        parser.error('an API key is required')
+    
+    logging.basicConfig(level=(options.quiet and logging.WARNING) or
+        logging.INFO, format='%(asctime)s %(message)s')
+    
+    keys = options.api_keys
+    enricher = BulkEnricher((len(keys) > 1 and keys) or keys[0],
+        kind=options.kind, processes=options.processes, rate=options.rate,
+        memcached=options.memcached, queue_size=options.queue_size,
+        artist_column=options.artist_column,
+        album_column=options.album_column)
+    
+    source, output = arguments
+    stream = (source == '-' and sys.stdin) or open(source, 'rb')
+    try:
+        rows = csv.DictReader(stream)
+        enricher.run(rows, output)
+    finally:
+        stream.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
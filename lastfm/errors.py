@@ -16,6 +16,20 @@ class UnderspecifiedError(LastFMError, TypeError):
     """
     pass
 
+class DeadlineExceededError(LastFMError):
+    """
+    Raised when an API call cannot be completed before the deadline set with
+    lastfm.deadlines.deadline.
+    """
+    pass
+
+class ReplayMissError(LastFMError, LookupError):
+    """
+    Raised by lastfm.replay.ReplayAgent when it is asked to make a request for
+    which no response was recorded.
+    """
+    pass
+
 class APIError(LastFMError):
     """
     The base class for errors returned by the last.fm servers.
@@ -25,6 +39,11 @@ class APIError(LastFMError):
         if code and typ is APIError and code in api_errors:
             return api_errors[code](message, code)
         return LastFMError.__new__(typ, message)
+    
+    @property
+    def code(self):
+        """The last.fm error code, or None if there was none."""
+        return (len(self.args) > 1 and self.args[1]) or None
 
 class InvalidServiceError(APIError):
     pass
@@ -56,6 +75,19 @@ class ServiceOfflineError(APIError):
 class SubscribersOnlyError(APIError):
     pass
 
+class SuspendedAPIKeyError(APIError):
+    pass
+
+class RateLimitExceededError(APIError):
+    pass
+
+class CircuitOpenError(ServiceOfflineError):
+    """
+    Raised instead of calling last.fm when a circuit breaker has detected that
+    the service is down.
+    """
+    pass
+
 api_errors = {
     2: InvalidServiceError,
     3: InvalidMethodError,
@@ -66,5 +98,7 @@ api_errors = {
     9: InvalidSessionKeyError,
     10: InvalidAPIKeyError,
     11: ServiceOfflineError,
-    12: SubscribersOnlyError
+    12: SubscribersOnlyError,
+    26: SuspendedAPIKeyError,
+    29: RateLimitExceededError
 }
@@ -0,0 +1,274 @@
+# encoding: utf-8
+
+"""
+Columnar frames of artist and album results, for analytics.
+
+Turning every row of a result into an Artist or Album object, only to read a
+few attributes back out of each, is slow and uses a lot of memory. The
+functions here decode result lists straight into a Frame, which holds each
+field as a single column: numbers in compact typed arrays, text in lists.
+    
+    albums = frames.top_albums(client, 'Cher')
+    print sum(albums['play_count']), albums['name'][0]
+    
+    similar = frames.similar(client, 'Cher')
+    matches = frames.search(client, 'album', 'believe', page=2)
+
+If NumPy is installed, numeric columns are NumPy arrays (and release dates
+are `datetime64[D]` arrays); otherwise they are the standard library's
+arrays, with dates held as days since 1970-01-01. Pass `use_numpy` to choose.
+Missing integers are given as -1, missing floats as NaN and missing dates as
+NO_DAY (NaT with NumPy).
+
+The batched conversion functions `to_ints`, `to_floats` and `to_dates` can
+also be used on their own.
+"""
+
+from array import array
+from datetime import date
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from lastfm.results import read_search_results
+
+# Stands for a missing date in date columns that do not use NumPy.
+NO_DAY = -0x80000000
+
+_epoch = date(1970, 1, 1).toordinal()
+_months = dict((month, number + 1) for number, month in
+    enumerate('jan feb mar apr may jun jul aug sep oct nov dec'.split()))
+# The form of the release dates on album pages: "    6 Apr 1999, 00:00".
+_day_pattern = re.compile(r'\s*(\d{1,2}) (\w{3}) (\d{4})\b')
+
+class Frame(object):
+    """
+    A table of results held column by column.
+    """
+    
+    def __init__(self, names, columns):
+        """
+        Creates a frame from a sequence of column names and a matching
+        sequence of equally long columns (internal use only; see `decode`).
+        """
+        self._names = tuple(names)
+        self._columns = dict(zip(self._names, columns))
+        self._length = (columns and len(columns[0])) or 0
+    
+    @property
+    def columns(self):
+        """The names of the frame's columns, in order."""
+        return self._names
+    
+    def __getitem__(self, name):
+        return self._columns[name]
+    
+    def __contains__(self, name):
+        return name in self._columns
+    
+    def __len__(self):
+        return self._length
+    
+    def rows(self):
+        """Yields each row of the frame as a dictionary keyed by column."""
+        columns = [self._columns[name] for name in self._names]
+        for i in xrange(self._length):
+            yield dict((name, column[i]) for name, column in
+                zip(self._names, columns))
+    
+    def __repr__(self):
+        return '<%s of %d rows: %s>' % (type(self).__name__, self._length,
+            ', '.join(self._names))
+
+
+def _album_artist(row):
+    artist = row.get('artist')
+    if isinstance(artist, dict):
+        return artist.get('name')
+    return artist
+
+def _rank(row):
+    return (row.get('@attr') or {}).get('rank')
+
+# Columns as (name, field or getter, batched converter); the field of a row
+# is read with row.get, and columns without a converter hold the raw values.
+ARTIST_COLUMNS = (
+    ('name', 'name', None),
+    ('mbid', 'mbid', None),
+    ('url', 'url', None),
+    ('listeners', 'listeners', 'ints'),
+    ('streamable', 'streamable', 'ints')
+)
+SIMILAR_COLUMNS = ARTIST_COLUMNS[:3] + (
+    ('match', 'match', 'floats'),
+)
+ALBUM_COLUMNS = (
+    ('name', 'name', None),
+    ('artist', _album_artist, None),
+    ('mbid', 'mbid', None),
+    ('url', 'url', None),
+    ('listeners', 'listeners', 'ints'),
+    ('play_count', 'playcount', 'ints'),
+    ('release_date', 'releasedate', 'dates')
+)
+TOP_ALBUM_COLUMNS = ALBUM_COLUMNS + (
+    ('rank', _rank, 'ints'),
+)
+
+def decode(rows, columns, use_numpy=None):
+    """
+    Decodes a list of result rows (as decoded from the API) into a Frame with
+    the given columns, such as ARTIST_COLUMNS or ALBUM_COLUMNS.
+    """
+    converters = {'ints': to_ints, 'floats': to_floats, 'dates': to_dates}
+    names, decoded = [], []
+    for name, field, converter in columns:
+        if isinstance(field, basestring):
+            values = [row.get(field) for row in rows]
+        else:
+            values = map(field, rows)
+        if converter is not None:
+            values = converters[converter](values, use_numpy)
+        names.append(name)
+        decoded.append(values)
+    return Frame(names, decoded)
+
+def top_albums(client, artist, use_numpy=None):
+    """Returns a Frame of the top-played albums by the named artist."""
+    key = 'top_album_rows:%s' % artist
+    rows = client.cache[key]
+    if rows is None:
+        raw = client.raw.artist.get_top_albums(artist=artist)
+        rows = client.cache[key] = _as_list(raw['topalbums'].get('album'))
+    return decode(rows, TOP_ALBUM_COLUMNS, use_numpy)
+
+def similar(client, artist, use_numpy=None):
+    """
+    Returns a Frame of the artists similar to the named artist, with their
+    match scores, most similar first.
+    """
+    key = 'similar_artist_rows:%s' % artist
+    rows = client.cache[key]
+    if rows is None:
+        raw = client.raw.artist.get_similar(artist=artist)
+        rows = client.cache[key] = _as_list(
+            raw['similarartists'].get('artist'))
+    return decode(rows, SIMILAR_COLUMNS, use_numpy)
+
+def search(client, kind, name, page=1, use_numpy=None):
+    """
+    Returns a Frame of one page of the results of searching last.fm for
+    artists or albums (as `kind` is "artist" or "album") matching `name`.
+    The search pages are shared with the collections' `search` methods.
+    """
+    if kind not in ('artist', 'album'):
+        raise ValueError('can only search for artists or albums, not %r' %
+            kind)
+    
+    criterion = '%s:%d' % (name, page)
+    result = client._cache_find('%s_search' % kind, criterion)
+    if not result:
+        method = getattr(client.raw, kind).search
+        result = method(**{kind: name, 'page': page})
+        client.cache['%s_search:%s' % (kind, criterion)] = result
+    
+    total, rows = read_search_results(result, kind)
+    columns = (kind == 'artist' and ARTIST_COLUMNS) or ALBUM_COLUMNS
+    return decode(rows, columns, use_numpy)
+
+def to_ints(values, use_numpy=None, missing=-1):
+    """
+    Converts a list of integers given as strings (or numbers) to an array,
+    replacing missing and malformed values with `missing`.
+    """
+    try:
+        converted = array('l', map(int, values))
+    except (TypeError, ValueError):
+        converted = array('l', [_to_int(value, missing) for value in values])
+    return _finish(converted, use_numpy, 'int_')
+
+def to_floats(values, use_numpy=None, missing=float('nan')):
+    """
+    Converts a list of numbers given as strings (or numbers) to an array of
+    doubles, replacing missing and malformed values with `missing`.
+    """
+    try:
+        converted = array('d', map(float, values))
+    except (TypeError, ValueError):
+        converted = array('d', [_to_float(value, missing)
+            for value in values])
+    return _finish(converted, use_numpy, 'float64')
+
+def to_dates(values, use_numpy=None):
+    """
+    Converts a list of last.fm dates to an array of days since 1970-01-01
+    (or, with NumPy, to a `datetime64[D]` array). Missing and malformed dates
+    become NO_DAY (or NaT).
+    """
+    # Albums often share release dates, and parsing them is the slow part.
+    seen = {}
+    days = array('l')
+    for value in values:
+        try:
+            day = seen[value]
+        except KeyError:
+            day = seen[value] = _to_day(value)
+        days.append(day)
+    
+    converted = _finish(days, use_numpy, 'int_')
+    if converted is days:
+        return days
+    missing = converted == NO_DAY
+    converted = converted.astype('datetime64[D]')
+    converted[missing] = numpy.datetime64('NaT')
+    return converted
+
+def _to_int(value, missing):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return missing
+
+def _to_float(value, missing):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return missing
+
+def _to_day(stamp):
+    """Returns the day of a last.fm date as days since 1970-01-01."""
+    if not stamp or not isinstance(stamp, basestring):
+        return NO_DAY
+    
+    match = _day_pattern.match(stamp)
+    try:
+        if match:
+            day, month, year = match.groups()
+            parsed = date(int(year), _months[month.lower()], int(day))
+        else:
+            from lastfm.data import parse_timestamp
+            parsed = parse_timestamp(stamp).date()
+    except (KeyError, TypeError, ValueError):
+        return NO_DAY
+    return parsed.toordinal() - _epoch
+
+def _finish(values, use_numpy, dtype):
+    """Converts an array to a NumPy array of `dtype` if it is to be used."""
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError('NumPy is not installed')
+    if not use_numpy:
+        return values
+    return numpy.frombuffer(values.tostring(), getattr(numpy, dtype)).copy()
+
+def _as_list(rows):
+    # A list of one row comes back from the API as the row itself.
+    if rows is None:
+        return []
+    if isinstance(rows, dict):
+        return [rows]
+    return rows
@@ -0,0 +1,439 @@
+# encoding: utf-8
+
+"""
+A compact, read-only store for similar-artist graphs that answers neighbor
+and ranking queries from memory.
+
+Each artist is a node with a small integer ID. The similar artists of each
+node are kept in compressed sparse row (CSR) form: one array of row offsets,
+one of target nodes (32-bit integers) and one of match scores (32-bit
+floats), each row sorted from the most to the least similar artist. Names and
+MusicBrainz IDs are kept as UTF-8 blobs. A graph of a million edges takes
+about 8 MB, where the same data as lists of (match, Artist) tuples takes
+hundreds.
+
+Graphs are built from a crawl or from the results of Artist.get_similar,
+saved to a file, and memory-mapped back:
+    
+    graph = SimilarityGraph.from_crawler(crawler)
+    graph.save('similar.graph')
+    ...
+    graph = SimilarityGraph.load('similar.graph')
+    for node, match in graph.top_k('Cher', 10):
+        print graph.name(node), match
+
+If NumPy is installed, it is used to hold the arrays (which then stay in the
+mapped file rather than being read into memory) and to compute rankings;
+otherwise the arrays are held in the standard library's compact arrays.
+"""
+
+from array import array
+import mmap
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = 'LFMGRAPH'
+GRAPH_VERSION = 1
+
+# Magic, version, byte order (1 for little-endian), node count, edge count,
+# and the sizes of the name and MBID blobs.
+_header = struct.Struct('<8sHBxIQQQ')
+_little_endian = sys.byteorder == 'little'
+
+class SimilarityGraph(object):
+    """
+    A directed graph of artists weighted by their similarity.
+    """
+    
+    def __init__(self, offsets, targets, weights, names, mbids,
+        use_numpy=None):
+        """
+        Creates a graph from its CSR arrays (internal use only; see `build`,
+        `from_crawler`, `from_similar` and `load`).
+        
+        `names` and `mbids` are (offsets, blob) pairs locating each node's
+        UTF-8 encoded name and MBID in a byte string.
+        """
+        self._np = (_use_numpy(use_numpy) and numpy) or None
+        
+        self._offsets = offsets
+        self._targets = targets
+        self._weights = weights
+        self._name_offsets, self._names = names
+        self._mbid_offsets, self._mbids = mbids
+        self._index = None
+        self._sources = None
+        self._mapping = None
+    
+    @classmethod
+    def build(cls, nodes, edges, use_numpy=None):
+        """
+        Builds a graph from a list of (name, mbid) pairs, one per node, and an
+        iterable of (source, target, match) edges between node IDs.
+        """
+        sources, targets, weights = array('i'), array('i'), array('f')
+        for source, target, weight in edges:
+            sources.append(source)
+            targets.append(target)
+            weights.append(weight)
+        return cls._from_arrays(nodes, sources, targets, weights, use_numpy)
+    
+    @classmethod
+    def from_crawler(cls, crawler, use_numpy=None):
+        """Builds a graph from the results of a lastfm.crawler.Crawler."""
+        sources, targets, weights = crawler.edge_arrays()
+        return cls._from_arrays(crawler.nodes, sources, targets, weights,
+            use_numpy)
+    
+    @classmethod
+    def from_similar(cls, similar, use_numpy=None):
+        """
+        Builds a graph from a dictionary that maps artists to the list of
+        (match, Artist) pairs returned by their `get_similar` method. Artists
+        are matched by MusicBrainz ID, or by name if they have none.
+        """
+        nodes, ids = [], {}
+        def node_for(artist):
+            # Reading `id` would load the artist's info if it has no MBID.
+            mbid = getattr(artist, '_id', None) or None
+            key = mbid or artist.name.lower()
+            node = ids.get(key)
+            if node is None:
+                node = ids[key] = len(nodes)
+                nodes.append((artist.name, mbid))
+            return node
+        
+        sources, targets, weights = array('i'), array('i'), array('f')
+        for artist, matches in similar.iteritems():
+            source = node_for(artist)
+            for match, other in matches:
+                sources.append(source)
+                targets.append(node_for(other))
+                weights.append(match)
+        return cls._from_arrays(nodes, sources, targets, weights, use_numpy)
+    
+    @classmethod
+    def _from_arrays(cls, nodes, sources, targets, weights, use_numpy):
+        count = len(nodes)
+        name_offsets, names = _pack_strings(name for name, mbid in nodes)
+        mbid_offsets, mbids = _pack_strings(mbid or u''
+            for name, mbid in nodes)
+        
+        # Sort the edges by source, and each row by descending match.
+        if _use_numpy(use_numpy):
+            def convert(values, dtype):
+                return numpy.frombuffer(values.tostring(), dtype)
+            sources = convert(sources, numpy.int32)
+            targets = convert(targets, numpy.int32)
+            weights = convert(weights, numpy.float32)
+            order = numpy.lexsort((-weights, sources))
+            offsets = numpy.zeros(count + 1, numpy.int32)
+            numpy.cumsum(numpy.bincount(sources, minlength=count),
+                out=offsets[1:])
+            return cls(offsets, targets[order], weights[order],
+                (convert(name_offsets, numpy.int32), names),
+                (convert(mbid_offsets, numpy.int32), mbids), True)
+        
+        order = sorted(xrange(len(sources)),
+            key=lambda i: (sources[i], -weights[i]))
+        offsets = array('i', [0] * (count + 1))
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in xrange(count):
+            offsets[i + 1] += offsets[i]
+        targets = array('i', (targets[i] for i in order))
+        weights = array('f', (weights[i] for i in order))
+        return cls(offsets, targets, weights, (name_offsets, names),
+            (mbid_offsets, mbids), False)
+    
+    def save(self, path):
+        """Writes the graph to the file at `path`."""
+        sections = [self._offsets, self._targets, self._weights,
+            self._name_offsets, self._mbid_offsets, self._names, self._mbids]
+        
+        out = open(path, 'wb')
+        try:
+            out.write(_header.pack(MAGIC, GRAPH_VERSION, int(_little_endian),
+                len(self), self.edge_count, len(self._names),
+                len(self._mbids)))
+            position = _header.size
+            for section in sections:
+                data = _tobytes(section)
+                out.write(data)
+                position += len(data)
+                # Keep every section aligned for in-place NumPy arrays.
+                padding = -position % 8
+                out.write('\0' * padding)
+                position += padding
+        finally:
+            out.close()
+    
+    @classmethod
+    def load(cls, path, use_numpy=None):
+        """
+        Memory-maps the graph saved at `path`. With NumPy, the arrays are used
+        in place, so only the parts of the file that are queried are read.
+        """
+        use_numpy = _use_numpy(use_numpy)
+        source = open(path, 'rb')
+        try:
+            mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            source.close()
+        
+        (magic, version, little_endian, count, edges, names_size,
+            mbids_size) = _header.unpack_from(mapping)
+        if magic != MAGIC:
+            raise ValueError('%s is not a similarity graph' % path)
+        if version != GRAPH_VERSION:
+            raise ValueError('unsupported similarity graph version %r' %
+                version)
+        swap = bool(little_endian) != _little_endian
+        
+        layout = [('i', count + 1), ('i', edges), ('f', edges),
+            ('i', count + 1), ('i', count + 1)]
+        sections = []
+        position = _header.size
+        for typecode, length in layout:
+            size = length * 4
+            if use_numpy:
+                dtype = (typecode == 'i' and numpy.int32) or numpy.float32
+                values = numpy.frombuffer(mapping, dtype, length, position)
+                if swap:
+                    values = values.byteswap()
+            else:
+                values = array(typecode)
+                values.fromstring(mapping[position:position + size])
+                if swap:
+                    values.byteswap()
+            sections.append(values)
+            position += size + (-size % 8)
+        
+        names = mapping[position:position + names_size]
+        position += names_size + (-names_size % 8)
+        mbids = mapping[position:position + mbids_size]
+        
+        offsets, targets, weights, name_offsets, mbid_offsets = sections
+        graph = cls(offsets, targets, weights, (name_offsets, names),
+            (mbid_offsets, mbids), use_numpy)
+        graph._mapping = mapping
+        return graph
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+    
+    @property
+    def edge_count(self):
+        """The number of edges in the graph."""
+        return len(self._targets)
+    
+    @property
+    def nbytes(self):
+        """The approximate number of bytes taken by the graph's data."""
+        arrays = (self._offsets, self._targets, self._weights,
+            self._name_offsets, self._mbid_offsets)
+        return (sum(len(values) * 4 for values in arrays) + len(self._names) +
+            len(self._mbids))
+    
+    def name(self, node):
+        """Returns the name of the artist at `node`."""
+        start, end = self._name_offsets[node], self._name_offsets[node + 1]
+        return self._names[start:end].decode('utf-8')
+    
+    def mbid(self, node):
+        """Returns the MusicBrainz ID of the artist at `node`, if known."""
+        start, end = self._mbid_offsets[node], self._mbid_offsets[node + 1]
+        return self._mbids[start:end].decode('utf-8') or None
+    
+    def node_id(self, name=None, mbid=None):
+        """
+        Returns the node of the artist with the given name or MusicBrainz ID,
+        or None if it is not in the graph.
+        """
+        if self._index is None:
+            index = {}
+            for node in xrange(len(self)):
+                index.setdefault(u'name:' + self.name(node).lower(), node)
+                node_mbid = self.mbid(node)
+                if node_mbid:
+                    index.setdefault(u'mbid:' + node_mbid, node)
+            self._index = index
+        
+        node = mbid and self._index.get(u'mbid:' + mbid)
+        if node is None and name:
+            node = self._index.get(u'name:' + name.lower())
+        return node
+    
+    def _resolve(self, node):
+        if isinstance(node, basestring):
+            found = self.node_id(name=node)
+            if found is None:
+                raise KeyError('no artist named %r in the graph' % node)
+            return found
+        return int(node)
+    
+    def neighbors(self, node):
+        """
+        Returns the artists similar to `node` (a node ID or an artist name) as
+        (node, match) pairs, most similar first.
+        """
+        return self.top_k(node, None)
+    
+    def top_k(self, node, k=10):
+        """
+        Returns the `k` artists most similar to `node` (a node ID or an artist
+        name) as (node, match) pairs, most similar first.
+        """
+        node = self._resolve(node)
+        start, end = self._offsets[node], self._offsets[node + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return zip(self._targets[start:end].tolist(),
+            self._weights[start:end].tolist())
+    
+    def k_hop(self, node, hops=2):
+        """
+        Returns a dictionary mapping every node reachable from `node` in at
+        most `hops` steps (excluding `node` itself) to its distance.
+        """
+        start = self._resolve(node)
+        distances = {start: 0}
+        frontier = [start]
+        offsets, targets = self._offsets, self._targets
+        for hop in xrange(1, hops + 1):
+            reached = []
+            for current in frontier:
+                row = targets[offsets[current]:offsets[current + 1]].tolist()
+                for target in row:
+                    if target not in distances:
+                        distances[target] = hop
+                        reached.append(target)
+            frontier = reached
+        del distances[start]
+        return distances
+    
+    def personalized_rank(self, seeds, k=10, alpha=0.15, iterations=20):
+        """
+        Ranks artists by personalized PageRank: the probability of being at
+        each artist during a random walk that follows similarity links in
+        proportion to their match scores, and jumps back to one of the
+        `seeds` (node IDs or artist names) with probability `alpha` at each
+        step. Returns the `k` best-ranked artists other than the seeds as
+        (node, score) pairs.
+        """
+        seeds = [self._resolve(seed) for seed in seeds]
+        if not seeds:
+            return []
+        if self._np is not None:
+            ranks = self._rank_numpy(seeds, alpha, iterations)
+        else:
+            ranks = self._rank_sparse(seeds, alpha, iterations)
+        
+        for seed in seeds:
+            ranks.pop(seed, None)
+        best = sorted(ranks.iteritems(), key=lambda item: -item[1])
+        return best[:k]
+    
+    def _out_weights(self):
+        np = self._np
+        if self._sources is None:
+            degrees = np.diff(self._offsets)
+            self._sources = np.repeat(np.arange(len(self), dtype=np.int32),
+                degrees)
+            self._totals = np.bincount(self._sources, self._weights,
+                len(self)).astype(np.float32)
+        return self._sources, self._totals
+    
+    def _rank_numpy(self, seeds, alpha, iterations):
+        np = self._np
+        sources, totals = self._out_weights()
+        restart = np.zeros(len(self))
+        np.add.at(restart, seeds, 1.0 / len(seeds))
+        dangling = totals == 0
+        share = np.where(dangling, 0.0, 1.0 / np.where(dangling, 1.0, totals))
+        edge_share = self._weights * share[sources]
+        
+        ranks = restart.copy()
+        for i in xrange(iterations):
+            flow = np.bincount(self._targets, ranks[sources] * edge_share,
+                len(self))
+            lost = ranks[dangling].sum()
+            ranks = (1 - alpha) * (flow + lost * restart) + alpha * restart
+        
+        nonzero = np.flatnonzero(ranks)
+        return dict(zip(nonzero.tolist(), ranks[nonzero].tolist()))
+    
+    def _rank_sparse(self, seeds, alpha, iterations):
+        restart = dict.fromkeys(seeds, 0.0)
+        for seed in seeds:
+            restart[seed] += 1.0 / len(seeds)
+        
+        offsets, targets, weights = self._offsets, self._targets, self._weights
+        ranks = dict(restart)
+        for i in xrange(iterations):
+            flow = {}
+            lost = 0.0
+            for node, rank in ranks.iteritems():
+                start, end = offsets[node], offsets[node + 1]
+                row = weights[start:end]
+                total = sum(row)
+                if not total:
+                    lost += rank
+                    continue
+                share = rank / total
+                for target, weight in zip(targets[start:end], row):
+                    flow[target] = flow.get(target, 0.0) + share * weight
+            
+            for node, mass in restart.iteritems():
+                flow[node] = flow.get(node, 0.0) + lost * mass
+            ranks = dict((node, (1 - alpha) * mass)
+                for node, mass in flow.iteritems())
+            for node, mass in restart.iteritems():
+                ranks[node] = ranks.get(node, 0.0) + alpha * mass
+        return ranks
+    
+    def close(self):
+        """Unmaps the file the graph was loaded from."""
+        if self._mapping is not None:
+            self._offsets = self._targets = self._weights = None
+            self._name_offsets = self._mbid_offsets = self._sources = None
+            self._mapping.close()
+            self._mapping = None
+    
+    def __repr__(self):
+        return '<%s %d nodes, %d edges>' % (type(self).__name__, len(self),
+            self.edge_count)
+
+def _use_numpy(requested):
+    """Decides whether to use NumPy, given the `use_numpy` argument."""
+    if requested is None:
+        return numpy is not None
+    if requested and numpy is None:
+        raise ImportError('NumPy is not installed')
+    return bool(requested)
+
+def _pack_strings(strings):
+    """
+    Encodes strings as UTF-8 and packs them into one byte string, returning
+    an array of their offsets in it and the byte string.
+    """
+    offsets = array('i', [0])
+    pieces = []
+    total = 0
+    for value in strings:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        pieces.append(value)
+        total += len(value)
+        offsets.append(total)
+    return offsets, ''.join(pieces)
+
+def _tobytes(values):
+    if isinstance(values, str):
+        return values
+    return values.tostring()
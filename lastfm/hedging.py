@@ -0,0 +1,212 @@
+# encoding: utf-8
+
+"""
+Hedged requests: if a read has not been answered within a high percentile of
+recent latencies, a duplicate request is sent, and whichever answers first is
+used. This cuts the tail latency caused by occasional slow responses at the
+cost of a small number of extra requests.
+
+Hedging is turned on by passing a HedgePolicy (or True, for the default
+policy) as the `hedge` parameter of the Client. Only reads are hedged; signed
+POST calls are always sent once.
+"""
+
+from collections import deque
+from time import time
+import threading
+
+class HedgePolicy(object):
+    """
+    Decides when to send a duplicate request, and sends it.
+    """
+    
+    def __init__(self, percentile=95, budget=0.05, burst=5, min_delay=0.01,
+        min_samples=20, window=500):
+        """
+        Creates a new hedging policy.
+        
+        A duplicate request is sent when the original has not been answered
+        within the `percentile`th percentile of the last `window` observed
+        latencies (but no sooner than `min_delay` seconds). Nothing is hedged
+        until `min_samples` latencies have been observed.
+        
+        The `budget` bounds the number of duplicate requests to that fraction
+        of all requests, so that hedging cannot push a client over the API's
+        rate limit. Up to `burst` duplicates can be sent in a row if the budget
+        has been saved up.
+        """
+        if not 0 < percentile < 100:
+            raise ValueError('percentile must be between 0 and 100')
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        
+        self._latencies = deque(maxlen=window)
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.won = 0
+    
+    def delay(self):
+        """
+        Returns the number of seconds after which a request should be hedged,
+        or None if too few latencies have been observed.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = int(len(ordered) * self.percentile / 100.0)
+        return max(ordered[min(index, len(ordered) - 1)], self.min_delay)
+    
+    def observe(self, latency):
+        """Records the latency of a completed request."""
+        with self._lock:
+            self._latencies.append(latency)
+    
+    def _earn(self):
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self._tokens + self.budget, self.burst)
+    
+    def _spend(self):
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            self.hedged += 1
+            return True
+    
+    def _refund(self):
+        with self._lock:
+            self._tokens = min(self._tokens + 1.0, self.burst)
+            self.hedged -= 1
+    
+    def _record_win(self):
+        with self._lock:
+            self.won += 1
+    
+    def call(self, func, duplicate=None):
+        """
+        Calls `func`, calling it again on another thread if the first call is
+        slow, and returns the result of whichever call succeeds first. If all
+        calls fail, the exception raised by the first call to fail is
+        re-raised.
+        
+        If `duplicate` is given, it is called when a duplicate request is due,
+        and returns the function to call for it (e.g., one that sends the
+        request with another API key), or None if no duplicate can be sent
+        now.
+        """
+        delay = self.delay()
+        self._earn()
+        if delay is None:
+            start = time()
+            result = func()
+            self.observe(time() - start)
+            return result
+        
+        race = _Race(self, func)
+        race.launch(func, primary=True)
+        if not race.wait(delay):
+            race.hedge(duplicate)
+        race.wait()
+        return race.result()
+    
+    def snapshot(self):
+        """Returns counts of the requests made and hedged."""
+        return {
+            'calls': self.calls,
+            'hedged': self.hedged,
+            'won': self.won,
+            'delay': self.delay()
+        }
+    
+    def __repr__(self):
+        return '<%s p%s budget=%s>' % (type(self).__name__, self.percentile,
+            self.budget)
+
+
+class _Race(object):
+    """Runs copies of a call on separate threads until one succeeds."""
+    
+    def __init__(self, policy, func):
+        self._policy = policy
+        self._func = func
+        self._done = threading.Condition()
+        self._running = 0
+        self._finished = False
+        self._value = None
+        self._error = None
+    
+    def launch(self, func, primary):
+        with self._done:
+            self._running += 1
+        self._start(func, primary)
+    
+    def hedge(self, duplicate=None):
+        """
+        Sends a duplicate request if the race is still on and the policy's
+        budget allows it.
+        """
+        with self._done:
+            # Checked and counted under the lock, so that the race cannot end
+            # with the primary's error between the check and the launch.
+            if self._finished or not self._policy._spend():
+                return
+            func = self._func
+            if duplicate is not None:
+                func = duplicate()
+                if func is None:
+                    self._policy._refund()
+                    return
+            self._running += 1
+        self._start(func, False)
+    
+    def _start(self, func, primary):
+        thread = threading.Thread(target=self._attempt, args=(func, primary))
+        thread.daemon = True
+        thread.start()
+    
+    def _attempt(self, func, primary):
+        start = time()
+        try:
+            value = func()
+        except Exception as e:
+            with self._done:
+                self._running -= 1
+                if self._error is None:
+                    self._error = e
+                if not self._running:
+                    self._finished = True
+                    self._done.notify_all()
+            return
+        
+        self._policy.observe(time() - start)
+        with self._done:
+            self._running -= 1
+            if not self._finished:
+                self._finished = True
+                self._value = value
+                self._error = None
+                if not primary:
+                    self._policy._record_win()
+                self._done.notify_all()
+    
+    def wait(self, timeout=None):
+        """Waits for the race to finish; returns whether it has."""
+        with self._done:
+            if timeout is None:
+                while not self._finished:
+                    self._done.wait()
+            elif not self._finished:
+                self._done.wait(timeout)
+            return self._finished
+    
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._value
@@ -0,0 +1,239 @@
+# encoding: utf-8
+
+"""
+Spreads API calls across several API keys.
+
+Each last.fm API key has its own rate limit. A client created with a list of
+keys (or a KeyPool) sends each call with the key that has the most capacity
+left, keeps every key under its own request rate, and stops using a key for a
+while if last.fm starts rejecting it:
+    
+    client = lastfm.Client(['key one', 'key two', 'key three'])
+
+Cache keys never include the API key, so data fetched with one key is shared
+by calls made with any other.
+"""
+
+from time import time, sleep
+import threading
+
+from lastfm.errors import (InvalidAPIKeyError, SuspendedAPIKeyError,
+    RateLimitExceededError)
+
+class RateLimiter(object):
+    """
+    A token bucket that allows `rate` events per second on average, with
+    bursts of up to `burst` events.
+    """
+    
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+    
+    def available(self):
+        """Returns the number of events that could happen right now."""
+        with self._lock:
+            self._refill(time())
+            return self._tokens
+    
+    def wait_time(self):
+        """Returns how long until an event could happen."""
+        with self._lock:
+            self._refill(time())
+            return max(0.0, (1.0 - self._tokens) / self.rate)
+    
+    def try_acquire(self):
+        """Takes a token if one is available; returns whether it did."""
+        with self._lock:
+            self._refill(time())
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+    
+    def acquire(self, timeout=None):
+        """
+        Waits for a token and takes it. Returns False if none became available
+        within `timeout` seconds.
+        """
+        deadline = timeout is not None and time() + timeout
+        while not self.try_acquire():
+            pause = self.wait_time()
+            if deadline and time() + pause > deadline:
+                return False
+            sleep(pause)
+        return True
+    
+    def __repr__(self):
+        return '<%s %s/s>' % (type(self).__name__, self.rate)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter whose budget is shared by the processes started (e.g., with
+    the multiprocessing module) by the process that created it.
+    """
+    
+    def __init__(self, rate, burst=None):
+        import multiprocessing
+        self._state = multiprocessing.Array('d', 2, lock=False)
+        super(SharedRateLimiter, self).__init__(rate, burst)
+        self._lock = multiprocessing.Lock()
+    
+    def _get_tokens(self):
+        return self._state[0]
+    
+    def _set_tokens(self, value):
+        self._state[0] = value
+    
+    def _get_updated(self):
+        return self._state[1]
+    
+    def _set_updated(self, value):
+        self._state[1] = value
+    
+    _tokens = property(_get_tokens, _set_tokens)
+    _updated = property(_get_updated, _set_updated)
+
+
+class KeyPool(object):
+    """
+    A set of API keys that calls are load-balanced across.
+    """
+    
+    def __init__(self, keys, rate=5.0, burst=None, backoff=30.0,
+        max_backoff=3600.0, shared=False, signing_key=None):
+        """
+        Creates a pool of the given API keys.
+        
+        Each key is allowed `rate` calls per second on average (last.fm's
+        published limit is 5), in bursts of up to `burst` calls. A key that
+        last.fm reports as invalid, suspended or over its rate limit is not
+        used for `backoff` seconds; the pause doubles each time the key is
+        rejected again, up to `max_backoff` seconds, and is reset once a call
+        with the key succeeds.
+        
+        If `shared` is true, each key's rate limit is kept in a
+        SharedRateLimiter, so that processes started after the pool was
+        created keep to it together. (Paused keys are still tracked by each
+        process on its own.)
+        
+        Signed calls are always made with `signing_key` (by default, the
+        first key), since the client's secret and users' session keys belong
+        to a single API key.
+        """
+        keys = list(keys)
+        if not keys:
+            raise ValueError('cannot create a key pool with no keys')
+        if signing_key is None:
+            signing_key = keys[0]
+        elif signing_key not in keys:
+            raise ValueError('the signing key %r is not in the pool' %
+                signing_key)
+        self._keys = keys
+        self.signing_key = signing_key
+        limiter = (shared and SharedRateLimiter) or RateLimiter
+        self._limiters = dict((key, limiter(rate, burst)) for key in keys)
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._paused_until = dict.fromkeys(keys, 0.0)
+        self._penalties = dict.fromkeys(keys, 0)
+        self._calls = dict.fromkeys(keys, 0)
+        self._rejections = dict.fromkeys(keys, 0)
+        self._turn = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def keys(self):
+        """The API keys in the pool."""
+        return list(self._keys)
+    
+    def _usable(self, now):
+        return [key for key in self._keys if self._paused_until[key] <= now]
+    
+    def acquire(self, timeout=None, key=None):
+        """
+        Picks the key with the most capacity left, waiting for one to become
+        available if they are all at their rate limit, and returns it. If
+        `key` is given, only that key is used.
+        
+        Raises RateLimitExceededError if every key is paused or none becomes
+        available within `timeout` seconds.
+        """
+        deadline = timeout is not None and time() + timeout
+        while True:
+            now = time()
+            with self._lock:
+                usable = self._usable(now)
+                turn = self._turn % len(self._keys)
+                self._turn += 1
+            if key is not None:
+                usable = [k for k in usable if k == key]
+                if not usable:
+                    raise RateLimitExceededError('the API key %s is paused '
+                        'after being rejected by last.fm' % key, 29)
+            if not usable:
+                raise RateLimitExceededError('all API keys are paused after '
+                    'being rejected by last.fm', 29)
+            
+            # Keys with the same capacity left (e.g., all of them, when calls
+            # are slower than the rate limit) are taken in turn; the sort is
+            # stable, so rotating the list first spreads the ties.
+            turn %= len(usable)
+            usable = usable[turn:] + usable[:turn]
+            usable.sort(key=lambda k: -self._limiters[k].available())
+            for candidate in usable:
+                if self._limiters[candidate].try_acquire():
+                    with self._lock:
+                        self._calls[candidate] += 1
+                    return candidate
+            
+            pause = min(self._limiters[k].wait_time() for k in usable)
+            if deadline and time() + pause > deadline:
+                raise RateLimitExceededError('no API key became available '
+                    'in time', 29)
+            sleep(pause)
+    
+    def report(self, key, error=None):
+        """
+        Records the outcome of a call made with `key`. If `error` shows that
+        last.fm rejected the key, the key is paused.
+        """
+        if key not in self._paused_until:
+            return
+        
+        with self._lock:
+            if isinstance(error, (InvalidAPIKeyError, SuspendedAPIKeyError,
+                RateLimitExceededError)):
+                penalty = self._penalties[key]
+                pause = min(self._backoff * (2 ** penalty), self._max_backoff)
+                self._paused_until[key] = time() + pause
+                self._penalties[key] = penalty + 1
+                self._rejections[key] += 1
+            elif error is None:
+                self._penalties[key] = 0
+    
+    def snapshot(self):
+        """Returns the usage and status of each key, for monitoring."""
+        now = time()
+        with self._lock:
+            return dict((key, {
+                'calls': self._calls[key],
+                'rejections': self._rejections[key],
+                'paused_for': max(0.0, self._paused_until[key] - now),
+                'available': self._limiters[key].available()
+            }) for key in self._keys)
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def __repr__(self):
+        return '<%s of %d keys>' % (type(self).__name__, len(self._keys))
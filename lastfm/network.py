@@ -4,57 +4,122 @@
 Handles the low-level details of communicating with last.fm over HTTP.
 """
 
-from urllib import urlencode
+from urllib import urlencode, quote_plus
 import urllib2
+import httplib
 from urlparse import urlparse, urlunparse
 try:
     from urlparse import parse_qs
 except ImportError:
     from cgi import parse_qs
+from time import time
+from hashlib import md5
+import socket
 import sys
 import re
+import zlib
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
-    
-from lastfm.errors import APIError
+from lastfm.errors import (APIError, CircuitOpenError, DeadlineExceededError,
+    RateLimitExceededError)
+from lastfm import deadlines, decoding
+from lastfm.keys import KeyPool
 
 __version__ = '0.1'
 WS_ROOT = 'http://ws.audioscrobbler.com/2.0/'
 
+# Response bodies are read this many bytes at a time when a call has a time
+# limit, so that the limit can be checked between reads.
+_READ_SIZE = 16384
+
 class Agent(object):
     """
     Makes HTTP requests.
     """
     
-    def __init__(self):
+    def __init__(self, tracer=None, compress=True, timeout=None):
         """
         Creates a new request agent.
+        
+        If a lastfm.tracing.Tracer is given as `tracer`, the agent records the
+        phases of the requests that are being traced by it.
+        
+        Unless `compress` is false, the agent asks the server to compress its
+        responses with gzip or deflate, and transparently decompresses them.
+        
+        The `timeout` is the default socket timeout for requests, in seconds.
+        By default, requests never time out. Like any socket timeout, it
+        applies to each connection attempt and each read on its own, not to a
+        request as a whole, and it does not cover the DNS lookup.
         """
-        self._opener = urllib2.build_opener()
+        self._tracer = tracer
+        self._timeout = timeout
+        if tracer:
+            self._opener = urllib2.build_opener(_TracingHTTPHandler(tracer))
+        else:
+            self._opener = urllib2.build_opener()
         self._opener.addheaders = [
             ('User-Agent', self._user_agent)
         ]
+        if compress:
+            self._opener.addheaders.append(('Accept-Encoding', 'gzip, deflate'))
         
-    def get(self, url, data=None):
+    def get(self, url, data=None, headers=None, timeout=None):
         """
         Opens an HTTP connection and sends a GET request.
-        The parameters in `params` are added as GET parameters.
+        The parameters in `params` are added as GET parameters, and any extra
+        request headers in the `headers` dictionary are sent along. If
+        `timeout` is given, it overrides the agent's default timeout.
+        
+        A "304 Not Modified" response to a conditional request is returned
+        like any other response; check its `code` attribute.
         """
-        return self._opener.open(self._add_params(url, data or {}))
+        trace = self._tracer and self._tracer.current()
+        if not trace:
+            return self._open(self._add_params(url, data or {}), None, headers,
+                timeout)
+        
+        start = time()
+        url = self._add_params(url, data or {})
+        built = time()
+        trace.add('build_url', start, built)
+        stream = self._open(url, None, headers, timeout)
         
-    def post(self, url, data=None):
+        # The handler records when the connection was established; the rest of
+        # the time until open() returns was spent waiting for the response.
+        connected = max(end for name, start, end in trace.spans)
+        trace.add('first_byte', connected, time())
+        return stream
+        
+    def post(self, url, data=None, timeout=None):
         """
         Opens an HTTP connection and sends a POST request.
         If `data` is a dictionary, it is first converted to URL-encoded
         parameters.
         """
         if isinstance(data, dict):
-            data = urlencode(data)
+            data = urlencode(self._encode_params(data))
         
-        return self._opener.open(url, data)
+        return self._open(url, data, None, timeout)
+    
+    def _open(self, url, data=None, headers=None, timeout=None):
+        if headers:
+            url = urllib2.Request(url, data, headers)
+        if timeout is None:
+            timeout = self._timeout
+        try:
+            if timeout is None:
+                stream = self._opener.open(url, data)
+            else:
+                stream = self._opener.open(url, data, timeout)
+        except urllib2.HTTPError as e:
+            if e.code != 304:
+                raise
+            return e
+        
+        encoding = stream.info().get('Content-Encoding', '').strip().lower()
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            return DecompressingStream(stream, encoding)
+        return stream
         
     @classmethod
     def _encode_params(cls, params):
@@ -64,17 +129,53 @@ class Agent(object):
         
         return [(enc(k), enc(v)) for k, v in params.iteritems()]
         
+    # Base URLs that have already been split, mapped to a (prefix, params)
+    # pair: the URL up to and including the "?", and its own GET parameters.
+    _split_urls = {}
+    
+    @classmethod
+    def _split_url(cls, url):
+        try:
+            return cls._split_urls[url]
+        except KeyError:
+            pass
+        
+        parsed = urlparse(url)
+        url_params = dict((k, v[-1]) for k, v in
+            parse_qs(parsed.query).iteritems())
+        prefix = urlunparse(parsed[:4] + ('', '')) + '?'
+        if len(cls._split_urls) < 64:
+            cls._split_urls[url] = (prefix, url_params)
+        return prefix, url_params
+    
     @classmethod
     def _add_params(cls, url, params):
         """Appends GET parameters to the URL and returns the result."""
         
-        parsed = urlparse(url)
-        url_params = parse_qs(parsed.query)
-        url_params.update(params)
-        parsed = list(parsed)
-        parsed[4] = urlencode(cls._encode_params(url_params))
+        prefix, url_params = cls._split_url(url)
+        if url_params:
+            url_params = dict(url_params)
+            url_params.update(params)
+            params = url_params
         
-        return urlunparse(parsed)
+        return prefix + cls._encode_query(params)
+    
+    @staticmethod
+    def _encode_query(params):
+        """
+        URL-encodes a dictionary of parameters in a single pass, encoding
+        Unicode keys and values as UTF-8.
+        """
+        pieces = []
+        for k, v in params.iteritems():
+            if isinstance(k, unicode):
+                k = k.encode('utf-8')
+            if isinstance(v, unicode):
+                v = v.encode('utf-8')
+            elif not isinstance(v, str):
+                v = str(v)
+            pieces.append(quote_plus(k) + '=' + quote_plus(v))
+        return '&'.join(pieces)
 
     @property
     def _user_agent(self):
@@ -84,6 +185,215 @@ class Agent(object):
             sys.platform.capitalize()
         )
 
+class DecompressingStream(object):
+    """
+    Wraps a gzip- or deflate-encoded HTTP response, decompressing the body
+    incrementally as it is read. Other attributes of the response (e.g., its
+    headers) are passed through.
+    """
+    
+    chunk_size = 16384
+    
+    def __init__(self, stream, encoding):
+        self._stream = stream
+        if encoding == 'deflate':
+            # Servers disagree on whether "deflate" means a zlib stream or a
+            # raw deflate stream; try the former first.
+            self._wbits = zlib.MAX_WBITS
+        else:
+            self._wbits = zlib.MAX_WBITS | 16
+        self._decompressor = zlib.decompressobj(self._wbits)
+        self._started = False
+        self._buffer = ''
+        self._eof = False
+    
+    def _inflate(self, chunk):
+        try:
+            data = self._decompressor.decompress(chunk)
+        except zlib.error:
+            if self._started or self._wbits != zlib.MAX_WBITS:
+                raise
+            self._wbits = -zlib.MAX_WBITS
+            self._decompressor = zlib.decompressobj(self._wbits)
+            data = self._decompressor.decompress(chunk)
+        self._started = True
+        return data
+    
+    def _fill(self, size):
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        while not self._eof and (size < 0 or length < size):
+            chunk = self._stream.read(self.chunk_size)
+            if chunk:
+                data = self._inflate(chunk)
+            else:
+                data = self._decompressor.flush()
+                self._eof = True
+            pieces.append(data)
+            length += len(data)
+        self._buffer = ''.join(pieces)
+    
+    def read(self, size=-1):
+        """Reads and returns up to `size` bytes of the decompressed body."""
+        if size is None or size < 0 or len(self._buffer) < size:
+            self._fill(size)
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+    
+    def close(self):
+        self._stream.close()
+    
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+class _TracingHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, host, tracer, **kwargs):
+        httplib.HTTPConnection.__init__(self, host, **kwargs)
+        self._tracer = tracer
+    
+    def connect(self):
+        start = time()
+        httplib.HTTPConnection.connect(self)
+        trace = self._tracer.current()
+        if trace:
+            trace.add('connect', start, time())
+
+class _TracingHTTPHandler(urllib2.HTTPHandler):
+    """An HTTP handler that records connection times in the current trace."""
+    
+    def __init__(self, tracer):
+        urllib2.HTTPHandler.__init__(self)
+        self._tracer = tracer
+    
+    def _create_connection(self, host, **kwargs):
+        return _TracingHTTPConnection(host, self._tracer, **kwargs)
+    
+    def http_open(self, req):
+        return self.do_open(self._create_connection, req)
+
+# Parameters that identify the caller rather than the data being requested.
+IGNORED_PARAMS = frozenset(['api_key', 'api_sig', 'sk'])
+
+def request_key(params):
+    """
+    Returns a string that identifies the data requested by the given API call
+    parameters. Parameters that do not affect the response (such as the API
+    key) are left out.
+    """
+    def enc(v):
+        return (isinstance(v, unicode) and v.encode('utf-8')) or str(v)
+    
+    return urlencode(sorted((enc(k), enc(v)) for k, v in params.iteritems()
+        if k not in IGNORED_PARAMS))
+
+def sign(params, secret):
+    """
+    Computes the signature (the `api_sig` parameter) of an API call with the
+    given parameters, as required for calls that need authorization.
+    """
+    def enc(v):
+        return (isinstance(v, unicode) and v.encode('utf-8')) or str(v)
+    
+    pieces = [enc(k) + enc(v) for k, v in sorted(params.iteritems())
+        if k not in ('format', 'callback', 'api_sig')]
+    pieces.append(enc(secret))
+    return md5(''.join(pieces)).hexdigest()
+
+def _read_body(stream, expires=None):
+    """
+    Reads the body of a response. If `expires` is given, raises socket.timeout
+    once that time has passed, checking before and between reads, so that a
+    body that trickles in cannot hold a call up long past its time limit.
+    """
+    if expires is None:
+        return stream.read()
+    
+    pieces = []
+    while True:
+        if time() > expires:
+            raise socket.timeout('timed out reading the response')
+        piece = stream.read(_READ_SIZE)
+        if not piece:
+            return ''.join(pieces)
+        pieces.append(piece)
+
+class ResponseStore(object):
+    """
+    Keeps decoded API responses together with the HTTP validators (ETag and
+    Last-Modified headers) they were served with, so that they can be
+    revalidated with a conditional request once the data built from them has
+    expired from the cache.
+    """
+    
+    def __init__(self, cache, timeout=86400):
+        """
+        Creates a response store that keeps its entries in `cache`.
+        
+        Entries should outlive the rows cached from them, so if the cache
+        supports it (i.e., has a `set` method), they are stored with a
+        time-to-live of `timeout` seconds.
+        """
+        self._cache = cache
+        self._timeout = timeout
+    
+    def _key(self, params):
+        return 'response:%s' % request_key(params)
+    
+    def find(self, params):
+        """
+        Returns a (validators, data) pair for the stored response to the
+        request with the given parameters, or None if there is none.
+        """
+        return self._cache[self._key(params)]
+    
+    def save(self, params, validators, data):
+        """Stores a response and its validators."""
+        entry = (validators, data)
+        try:
+            store = self._cache.set
+        except AttributeError:
+            self._cache[self._key(params)] = entry
+        else:
+            store(self._key(params), entry, self._timeout)
+    
+    @staticmethod
+    def validators(stream):
+        """
+        Returns a dictionary of the validators sent with an HTTP response.
+        """
+        try:
+            headers = stream.info()
+        except AttributeError:
+            return {}
+        
+        validators = {}
+        for name in ('ETag', 'Last-Modified'):
+            value = headers.get(name)
+            if value:
+                validators[name] = value
+        return validators
+    
+    @staticmethod
+    def conditions(validators):
+        """
+        Returns the request headers that make a request conditional on the
+        given validators.
+        """
+        headers = {}
+        if 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+        return headers
+
+# Python-style method names (e.g., "get_info") mapped to their last.fm names
+# ("getInfo"), filled in as methods are first used.
+_method_names = {}
+_underscore_pattern = re.compile(r'(.)_(.)')
+
 class APIAccess(object):
     """
     Gives a natural way of making calls to the last.fm API.
@@ -92,43 +402,302 @@ class APIAccess(object):
     method `artist.getInfo` via:
     
         api.artist.get_info(artist='Cher')
+    
+    Write methods are called with a signed POST request through the `post`
+    attribute of the method; this requires the application's secret:
+        
+        api.track.scrobble.post(sk=session_key, artist='Cher', ...)
+    
+    If a ResponseStore is given as `responses`, responses that came with HTTP
+    validators are kept in it, and repeated requests for the same data are
+    sent as conditional requests. If the server replies that the data has not
+    changed, the stored response is used without downloading or decoding it
+    again.
+    
+    If a lastfm.hedging.HedgePolicy is given as `hedge`, reads that are slow
+    to be answered are sent again, and the first answer is used.
+    
+    The `key` can be a single API key or a lastfm.keys.KeyPool, in which case
+    each call is made with the least-loaded key in the pool.
+    
+    Calls time out after `timeout` seconds, or sooner if a deadline set with
+    lastfm.deadlines.deadline runs out first; calls made after the deadline
+    has passed raise DeadlineExceededError.
+    
+    Responses are decoded with `decoder`, a function that takes the body of a
+    response as a byte string; by default, the preferred JSON decoder installed
+    is used (see lastfm.decoding).
+    
+    If a lastfm.breaker.CircuitBreaker is given as `breaker`, calls fail fast
+    with CircuitOpenError while it is open. Reads for which a response is kept
+    in the ResponseStore are then answered with the stored response, as are
+    reads that fail because the service is down.
     """
-    def __init__(self, key, agent):
+    def __init__(self, key, agent, stats=None, tracer=None, responses=None,
+        secret=None, hedge=None, breaker=None, timeout=None, decoder=None):
         self._key = key
+        self._pool = (isinstance(key, KeyPool) and key) or None
+        self._secret = secret
         self._agent = agent
+        self._stats = stats
+        self._tracer = tracer
+        self._responses = responses
+        self._hedge = hedge
+        self._breaker = breaker
+        self._timeout = timeout
+        # Resolved when the first response arrives, since importing a JSON
+        # decoder takes a while.
+        self._decode = decoder
         
     def __getattr__(self, name):
-        return self.ModuleAccess(self._key, self._agent, name)
+        module = self.ModuleAccess(self, name)
+        if not name.startswith('_'):
+            # Keep the object so that later lookups find it directly.
+            self.__dict__[name] = module
+        return module
+    
+    def _call(self, method, params, post=False):
+        """
+        Calls the API method `method` and returns its decoded response. If
+        `post` is true, the call is signed and sent as a POST request.
+        """
+        if post and not self._secret:
+            raise ValueError('signed calls require an API secret')
+        
+        stats = self._stats
+        if stats is not None:
+            prefix = 'api.%s.' % method
+            stats.count(prefix + 'calls')
+        
+        try:
+            timeout = deadlines.timeout(self._timeout)
+        except DeadlineExceededError:
+            if stats is not None:
+                stats.count(prefix + 'deadline_exceeded')
+            raise
+        
+        params.update({
+            'method': method,
+            'format': 'json'
+        })
+        
+        # The breaker is asked first, so that calls it rejects fail fast
+        # rather than waiting for (and using up) an API key.
+        breaker = self._breaker
+        if breaker and not breaker.allow():
+            if stats is not None:
+                stats.count(prefix + 'rejected')
+            stale = not post and self._stale(params)
+            if stale:
+                return stale
+            raise CircuitOpenError('last.fm is unavailable; not calling %s' %
+                method, 11)
+        
+        key = self._key
+        if self._pool is not None:
+            try:
+                # Signatures and session keys are only valid with the key
+                # that the secret belongs to.
+                key, timeout = self._acquire_key(timeout,
+                    (post and self._pool.signing_key) or None)
+            except Exception as e:
+                if breaker:
+                    breaker.abandon()
+                if (isinstance(e, DeadlineExceededError) and
+                    stats is not None):
+                    stats.count(prefix + 'deadline_exceeded')
+                raise
+        params['api_key'] = key
+        if post:
+            params['api_sig'] = sign(params, self._secret)
+        
+        trace = self._tracer and self._tracer.begin(method, params)
+        start = time()
+        try:
+            if self._hedge and not post:
+                # Duplicate requests run on other threads, so their phases
+                # cannot be traced.
+                data = self._hedge.call(lambda: self._request(params, None,
+                    False, timeout), lambda: self._duplicate(params, timeout))
+            else:
+                data = self._request(params, trace, post, timeout)
+            if 'error' in data:
+                raise APIError(data['message'], int(data['error']))
+        except Exception as e:
+            if self._pool is not None:
+                self._pool.report(key, e)
+            if stats is not None:
+                stats.count(prefix + 'errors')
+                stats.observe(prefix + 'latency', time() - start)
+            if trace:
+                self._tracer.finish(trace, e)
+            
+            out_of_time = deadlines.expired()
+            if out_of_time and stats is not None:
+                stats.count(prefix + 'deadline_exceeded')
+            if breaker:
+                if out_of_time:
+                    # Running out of our own time says nothing about the
+                    # health of the service.
+                    breaker.abandon()
+                elif not breaker.is_failure(e):
+                    breaker.success()
+                else:
+                    breaker.failure()
+                    stale = not post and self._stale(params)
+                    if stale:
+                        return stale
+            if out_of_time and isinstance(e, (IOError, httplib.HTTPException)):
+                raise DeadlineExceededError('deadline exceeded during %s: %s' %
+                    (method, e))
+            raise
+        
+        if self._pool is not None:
+            self._pool.report(key)
+        if breaker:
+            breaker.success()
+        if stats is not None:
+            stats.observe(prefix + 'latency', time() - start)
+        if trace:
+            self._tracer.finish(trace)
+        return data
+    
+    def _duplicate(self, params, timeout):
+        """
+        Returns a function that sends a hedged duplicate of a request, with
+        a key of its own from the pool, or None if no key is free right now.
+        """
+        if self._pool is None:
+            return lambda: self._request(params, None, False, timeout)
+        try:
+            key = self._pool.acquire(0)
+        except RateLimitExceededError:
+            return None
+        
+        def send():
+            try:
+                data = self._request(dict(params, api_key=key), None, False,
+                    timeout)
+            except Exception as e:
+                self._pool.report(key, e)
+                raise
+            self._pool.report(key)
+            return data
+        return send
+    
+    def _acquire_key(self, timeout, key=None):
+        """
+        Takes a key (or the given `key`) from the pool, waiting no longer than
+        `timeout`, and returns it with the time left for the call once the key
+        is in hand.
+        """
+        started = time()
+        key = self._pool.acquire(timeout, key)
+        if timeout is None:
+            return key, None
+        
+        limit = self._timeout
+        if limit is not None:
+            limit -= time() - started
+            if limit <= 0:
+                raise DeadlineExceededError('timed out waiting for an API '
+                    'key')
+        return key, deadlines.timeout(limit)
+    
+    def _stale(self, params):
+        """Returns the stored response to a request, if there is one."""
+        stored = self._responses and self._responses.find(params)
+        if not stored:
+            return None
+        if self._stats is not None:
+            self._stats.count('api.%s.stale' % params['method'])
+        return stored[1]
+    
+    def _request(self, params, trace=None, post=False, timeout=None):
+        """Sends a request and returns its decoded response."""
+        stored = not post and self._responses and self._responses.find(params)
+        
+        start = time()
+        conditions = stored and ResponseStore.conditions(stored[0])
+        # Only pass the extra arguments along when needed, so that simple
+        # agents need not support them.
+        extra = {}
+        expires = None
+        if timeout is not None:
+            extra['timeout'] = timeout
+            expires = start + timeout
+        if post:
+            stream = self._agent.post(WS_ROOT, params, **extra)
+        elif conditions:
+            stream = self._agent.get(WS_ROOT, params, headers=conditions,
+                **extra)
+        else:
+            stream = self._agent.get(WS_ROOT, params, **extra)
+        fetched = time()
+        
+        try:
+            if conditions and getattr(stream, 'code', None) == 304:
+                validators, data = stored
+                validators.update(ResponseStore.validators(stream))
+                self._responses.save(params, validators, data)
+                if self._stats is not None:
+                    self._stats.count('api.%s.not_modified' % params['method'])
+                return data
+            
+            body = _read_body(stream, expires)
+            read = time()
+            if self._decode is None:
+                self._decode = decoding.get_decoder()
+            data = self._decode(body)
+            decoded = time()
+            if trace:
+                trace.add('read', fetched, read)
+                trace.add('decode', read, decoded)
+            
+            if self._responses and not post and 'error' not in data:
+                # Responses without validators are only worth keeping as a
+                # fallback for when the circuit breaker is open.
+                validators = ResponseStore.validators(stream)
+                if validators or self._breaker:
+                    self._responses.save(params, validators, data)
+        finally:
+            stream.close()
+        
+        if self._stats is not None:
+            self._stats.observe('time.agent', fetched - start)
+            self._stats.observe('time.read', read - fetched)
+            self._stats.observe('time.json', decoded - read)
+        return data
     
     class ModuleAccess(object):
-        def __init__(self, key, agent, module):
-            self._key = key
-            self._agent = agent
+        def __init__(self, access, module):
+            self._access = access
             self._module = module
             
         def _translate_name(self, name):
+            try:
+                return _method_names[name]
+            except KeyError:
+                pass
+            
             def change_underscore(match):
                 return match.group(1) + match.group(2).upper()
-            return re.sub(r'(.)_(.)', change_underscore, name)
+            translated = _underscore_pattern.sub(change_underscore, name)
+            _method_names[name] = translated
+            return translated
             
         def __getattr__(self, name):
+            method = '.'.join([self._module, self._translate_name(name)])
+            
             def call_api(**kwargs):
-                method = '.'.join([self._module, self._translate_name(name)])
-                kwargs.update({
-                    'api_key': self._key,
-                    'method': method,
-                    'format': 'json'
-                })
-                
-                # XXX: a way to handle POST requests
-                stream = self._agent.get(WS_ROOT, kwargs)
-                try:
-                    data = json.load(stream)
-                    if 'error' in data:
-                        raise APIError(data['message'], int(data['error']))
-                    return data
-                finally:
-                    stream.close()
+                return self._access._call(method, kwargs)
+            
+            def post_api(**kwargs):
+                return self._access._call(method, kwargs, post=True)
                 
             call_api.__name__ = name
+            post_api.__name__ = '%s.post' % name
+            call_api.post = post_api
+            if not name.startswith('_'):
+                self.__dict__[name] = call_api
             return call_api
@@ -0,0 +1,213 @@
+# encoding: utf-8
+
+"""
+Agents that record last.fm responses to a cassette file and replay them
+without network access.
+
+Record real traffic by giving the client a RecordingAgent:
+    
+    agent = lastfm.replay.RecordingAgent('traffic.cassette')
+    client = lastfm.Client(key, agent=agent)
+    ...
+    agent.close()
+
+and replay it later with a ReplayAgent:
+    
+    client = lastfm.Client(key, agent=lastfm.replay.ReplayAgent(
+        'traffic.cassette', timing='recorded'))
+
+Requests are matched by their parameters, ignoring the API key, so a cassette
+recorded with one key can be replayed with any other. When a request was
+recorded more than once, its responses are replayed in the order in which
+they were recorded, starting over after the last one. POST requests (such as
+scrobbles) are recorded and replayed the same way as GET requests.
+"""
+
+from cStringIO import StringIO
+from time import time, sleep
+import mmap
+import socket
+import struct
+import threading
+import zlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm.errors import ReplayMissError
+from lastfm.network import Agent, request_key
+
+MAGIC = 'LFMCASS1'
+_record_header = struct.Struct('>IIf')
+_footer = struct.Struct('>Q8s')
+
+class RecordingAgent(object):
+    """
+    An agent that passes requests on to another agent and records the
+    responses in a cassette file.
+    
+    A cassette consists of a sequence of records, each holding a request key,
+    the zlib-compressed response body and the time the response took, followed
+    by an index of the records by request key. The index is written when the
+    agent is closed; a cassette that was not closed cannot be replayed.
+    """
+    
+    def __init__(self, path, agent=None):
+        """
+        Creates an agent that records to the cassette at `path`, overwriting
+        it if it exists. Requests are made through `agent`; by default, a new
+        live Agent is used.
+        """
+        self._agent = agent or Agent()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._index = {}
+        self._lock = threading.Lock()
+    
+    def get(self, url, data=None, headers=None, timeout=None):
+        extra = {}
+        if headers:
+            extra['headers'] = headers
+        if timeout is not None:
+            extra['timeout'] = timeout
+        
+        start = time()
+        stream = self._agent.get(url, data, **extra)
+        if getattr(stream, 'code', None) == 304:
+            return stream
+        return self._record_response(data, stream, start)
+    
+    def post(self, url, data=None, timeout=None):
+        extra = {}
+        if timeout is not None:
+            extra['timeout'] = timeout
+        
+        start = time()
+        stream = self._agent.post(url, data, **extra)
+        return self._record_response(data, stream, start)
+    
+    def _record_response(self, data, stream, start):
+        try:
+            body = stream.read()
+        finally:
+            stream.close()
+        elapsed = time() - start
+        
+        self.record(request_key(data or {}), body, elapsed)
+        return StringIO(body)
+    
+    def record(self, key, body, latency):
+        """Adds a response to the cassette."""
+        packed = zlib.compress(body)
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(_record_header.pack(len(key), len(packed),
+                latency))
+            self._file.write(key)
+            self._file.write(packed)
+            self._index.setdefault(key, []).append((offset, latency))
+    
+    def close(self):
+        """Writes the cassette's index and closes the file."""
+        with self._lock:
+            if self._file.closed:
+                return
+            index_offset = self._file.tell()
+            self._file.write(json.dumps(self._index))
+            self._file.write(_footer.pack(index_offset, MAGIC))
+            self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayAgent(object):
+    """
+    An agent that answers requests from a cassette written by RecordingAgent
+    and never touches the network.
+    """
+    
+    def __init__(self, path, timing=None, speed=1.0):
+        """
+        Opens the cassette at `path` for replay.
+        
+        If `timing` is None, responses are returned immediately. If it is
+        "recorded", each response is delayed by the time it originally took,
+        divided by `speed`. `timing` can also be a callable which is given the
+        recorded latency and returns the number of seconds to wait.
+        
+        Requests for which nothing was recorded raise
+        lastfm.errors.ReplayMissError. Requests whose delay would exceed their
+        timeout raise socket.timeout after waiting for the timeout.
+        """
+        if timing == 'recorded':
+            timing = lambda latency: latency / speed
+        elif timing is not None and not callable(timing):
+            raise ValueError('unknown replay timing %r' % (timing,))
+        self._timing = timing
+        
+        source = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(source.fileno(), 0,
+                access=mmap.ACCESS_READ)
+        finally:
+            source.close()
+        
+        index_offset, magic = _footer.unpack(self._data[-_footer.size:])
+        if self._data[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise ValueError('%s is not a complete last.fm cassette' % path)
+        index = json.loads(self._data[index_offset:-_footer.size])
+        self._index = dict((str(k), v) for k, v in index.iteritems())
+        
+        self._positions = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return sum(len(v) for v in self._index.itervalues())
+    
+    def get(self, url, data=None, headers=None, timeout=None):
+        return self._replay(data, timeout)
+    
+    def post(self, url, data=None, timeout=None):
+        return self._replay(data, timeout)
+    
+    def _replay(self, data, timeout):
+        key = request_key(data or {})
+        try:
+            records = self._index[key]
+        except KeyError:
+            raise ReplayMissError('no response recorded for %s' % key)
+        
+        with self._lock:
+            position = self._positions.get(key, 0)
+            self._positions[key] = (position + 1) % len(records)
+        offset, latency = records[position]
+        
+        if self._timing:
+            pause = self._timing(latency)
+            if timeout is not None and pause > timeout:
+                sleep(timeout)
+                raise socket.timeout('timed out')
+            sleep(pause)
+        return StringIO(self._read(offset))
+    
+    def bodies(self):
+        """Yields the body of every recorded response."""
+        for records in self._index.itervalues():
+            for offset, latency in records:
+                yield self._read(offset)
+    
+    def _read(self, offset):
+        key_len, body_len, latency = _record_header.unpack_from(self._data,
+            offset)
+        start = offset + _record_header.size + key_len
+        return zlib.decompress(self._data[start:start + body_len])
+    
+    def close(self):
+        """Closes the cassette."""
+        self._data.close()
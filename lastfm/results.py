@@ -16,23 +16,39 @@ class SearchResult(list):
     many items matched total.
     """
     
-    def __init__(self, loader, result_field, converter):
+    def __init__(self, loader, result_field, converter, local=None):
         """
         Constructs a new search result from JSON-decoded search results.
+        
+        If a list of `local` rows (from the client's search index) is given,
+        they take the place of the first page. The total number of results
+        and any further pages then come from last.fm when asked for, leaving
+        out the items already given.
         """
         
-        self._total_results, raw = read_search_results(loader(1),
-            result_field)
+        if local is None:
+            self._total_results, raw = read_search_results(loader(1),
+                result_field)
+            self._last_page = 1
+            self._given = None
+        else:
+            self._total_results, raw = None, local
+            self._last_page = 0
+            self._given = set(_item_key(row) for row in local)
         super(SearchResult, self).__init__(converter(e) for e in raw)
         
         self._result_field = result_field
         self._converter = converter
         self._loader = loader
-        self._last_page = 1
+        self._read = self._last_page and len(raw)
         
     @property
     def total_length(self):
         """The total number of items that resulted from the search."""
+        if self._total_results is None:
+            # Answered locally: last.fm's first page has the total.
+            self._total_results = read_search_results(self._loader(1),
+                self._result_field)[0]
         return self._total_results
     
     def load_next_page(self):
@@ -41,19 +57,34 @@ class SearchResult(list):
         results that were produced.
         """
         
-        if len(self) >= self.total_length: # already done
-            return 0
-        
-        results = self._loader(self._last_page + 1)
-        self._total_results, new_results = read_search_results(results,
-            self._result_field)
-        self.extend(map(self._converter, new_results))
-        self._last_page += 1
-        return len(new_results)
+        while self._last_page == 0 or self._read < self.total_length:
+            results = self._loader(self._last_page + 1)
+            self._total_results, new_results = read_search_results(results,
+                self._result_field)
+            self._last_page += 1
+            self._read += len(new_results)
+            if not new_results:
+                break
+            if self._given is not None:
+                new_results = [row for row in new_results
+                    if _item_key(row) not in self._given]
+                if not new_results:
+                    continue
+            self.extend(map(self._converter, new_results))
+            return len(new_results)
+        return 0
         
     def __repr__(self):
         return '<SearchResult %s>' % super(SearchResult, self).__repr__()
         
+def _item_key(row):
+    """Returns the artist and name of a search result row, in lowercase."""
+    
+    artist = row.get('artist')
+    if isinstance(artist, dict):
+        artist = artist.get('name')
+    return (artist or u'').lower(), (row.get('name') or u'').lower()
+
 def read_search_results(data, result_field):
     """
     Reads the search results from the stream, and returns a pair: the total
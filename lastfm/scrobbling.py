@@ -0,0 +1,349 @@
+# encoding: utf-8
+
+"""
+Submits scrobbles to last.fm in batches, spooling them to disk so that none
+are lost if the process stops before they are sent.
+    
+    queue = ScrobbleQueue(client, session_key, spool='/var/spool/scrobbles')
+    queue.scrobble('Cher', 'Believe', timestamp=1234567890)
+    ...
+    queue.close()
+
+Scrobbles are sent with `track.scrobble` in batches of up to 50 (the most the
+API accepts in one call) whenever enough of them are waiting, and otherwise
+every `flush_interval` seconds. The client must have been created with the
+application's secret, and `session_key` must be a session key for the user.
+
+Batches are sent by a background thread, so queueing a scrobble does not wait
+on last.fm (unless the queue was created with no `flush_interval`, in which
+case a full batch is sent by the thread that fills it). When a batch cannot be
+sent, the automatic flushes back off before trying again; batches that last.fm
+rejects outright are set aside rather than retried.
+"""
+
+from time import time
+import logging
+import os
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm.errors import APIError
+
+log = logging.getLogger('lastfm.scrobbling')
+
+MAX_BATCH_SIZE = 50
+
+# The last.fm error codes that reject a batch for good: invalid service,
+# method, authentication, format, parameters or resource (2 to 7), invalid
+# session key (9), invalid or suspended API key (10, 26) and invalid method
+# signature (13). Others, such as "operation failed" (8), "service offline"
+# (11), "temporarily unavailable" (16) and "rate limit exceeded" (29), are
+# retried.
+_REJECTED_CODES = frozenset([2, 3, 4, 5, 6, 7, 9, 10, 13, 26])
+
+# Optional scrobble fields and the names last.fm gives them.
+_optional_fields = (
+    ('album', 'album'),
+    ('album_artist', 'albumArtist'),
+    ('track_number', 'trackNumber'),
+    ('duration', 'duration'),
+    ('mbid', 'mbid'),
+    ('chosen_by_user', 'chosenByUser')
+)
+
+class ScrobbleQueue(object):
+    """
+    A durable queue of scrobbles waiting to be submitted to last.fm.
+    
+    All methods are thread-safe.
+    """
+    
+    def __init__(self, client, session_key, spool=None,
+        batch_size=MAX_BATCH_SIZE, flush_interval=30.0, fsync=False,
+        retry_interval=10.0, max_retry_interval=600.0):
+        """
+        Creates a new scrobble queue.
+        
+        If `spool` is given, it is the path of a file in which queued
+        scrobbles are kept until they have been submitted. Any scrobbles left
+        in the file by an earlier queue are loaded and submitted with the rest.
+        Each scrobble is written to the file before `scrobble` returns; if
+        `fsync` is true, it is also forced to disk, at a considerable cost in
+        throughput.
+        
+        Scrobbles are submitted by a background thread as soon as
+        `batch_size` of them are waiting, and otherwise at most
+        `flush_interval` seconds after being queued. If `flush_interval` is
+        None, there is no background thread: they are only submitted when the
+        batch is full (by the thread that queues the last scrobble) or when
+        `flush` is called.
+        
+        After a batch fails to be sent, automatic flushes wait
+        `retry_interval` seconds before trying again, doubling the wait after
+        each further failure up to `max_retry_interval` seconds. Batches that
+        last.fm rejects for good (e.g., as invalid) are not retried: they are
+        kept in `rejected`, and also appended to the spool path followed by
+        ".rejected" if there is a spool.
+        """
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError('batch size must be between 1 and %d' %
+                MAX_BATCH_SIZE)
+        
+        self._client = client
+        self._session_key = session_key
+        self._batch_size = batch_size
+        self._fsync = fsync
+        self._lock = threading.RLock()
+        # Held while sending, so that one batch is only sent by one thread.
+        self._sending = threading.Lock()
+        self._pending = []
+        self._rejected = []
+        self._submitted = 0
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._failures = 0
+        self._retry_at = 0.0
+        
+        self._spool_path = spool
+        self._spool = None
+        if spool:
+            self._pending.extend(self._read_spool(spool))
+            self._spool = open(spool, 'a')
+        
+        self._closed = threading.Event()
+        # Set to have the background thread flush before its interval is up.
+        self._wake = threading.Event()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(target=self._run,
+                args=(flush_interval,), name='lastfm-scrobbler')
+            self._thread.daemon = True
+            self._thread.start()
+    
+    @property
+    def pending(self):
+        """The number of scrobbles waiting to be submitted."""
+        return len(self._pending)
+    
+    @property
+    def submitted(self):
+        """The number of scrobbles submitted by this queue."""
+        return self._submitted
+    
+    @property
+    def rejected(self):
+        """The scrobbles that last.fm rejected for good."""
+        with self._lock:
+            return list(self._rejected)
+    
+    def scrobble(self, artist, track, timestamp=None, **optional):
+        """
+        Queues a scrobble of `track` by `artist`, played at the Unix time
+        `timestamp` (by default, now). The optional keyword arguments are
+        `album`, `album_artist`, `track_number`, `duration`, `mbid` and
+        `chosen_by_user`.
+        """
+        entry = {'artist': artist, 'track': track,
+            'timestamp': int(timestamp or time())}
+        for name, field in _optional_fields:
+            value = optional.pop(name, None)
+            if value is not None:
+                entry[field] = value
+        if optional:
+            raise TypeError('unknown scrobble fields: %s' %
+                ', '.join(sorted(optional)))
+        
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError('scrobble queue is closed')
+            if self._spool:
+                self._spool.write(json.dumps(entry) + '\n')
+                self._spool.flush()
+                if self._fsync:
+                    os.fsync(self._spool.fileno())
+            self._pending.append(entry)
+            full = len(self._pending) >= self._batch_size
+        
+        if full:
+            if self._thread:
+                self._wake.set()
+            else:
+                self._flush(partial=False, force=False)
+    
+    def now_playing(self, artist, track, **optional):
+        """
+        Tells last.fm that the user has started listening to `track` by
+        `artist`. Now-playing notifications are sent immediately and are not
+        queued. Takes the same optional keyword arguments as `scrobble`.
+        """
+        params = {'artist': artist, 'track': track, 'sk': self._session_key}
+        for name, field in _optional_fields:
+            if optional.get(name) is not None:
+                params[field] = optional[name]
+        return self._client.raw.track.update_now_playing.post(**params)
+    
+    def flush(self, partial=True):
+        """
+        Submits the waiting scrobbles and returns the number submitted. If
+        `partial` is false, only full batches are submitted.
+        
+        Unlike the automatic flushes, an explicit flush tries to send the
+        scrobbles even while backing off after a failure.
+        """
+        return self._flush(partial, force=True)
+    
+    def close(self):
+        """Stops the background flushing and submits the waiting scrobbles."""
+        self._closed.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        with self._lock:
+            if self._spool:
+                self._spool.close()
+                self._spool = None
+    
+    def _flush(self, partial, force):
+        # Automatic flushes leave the sending to a flush already in progress
+        # rather than wait for it.
+        if not self._sending.acquire(force):
+            return 0
+        
+        count = removed = 0
+        try:
+            while True:
+                with self._lock:
+                    if not force and time() < self._retry_at:
+                        break
+                    if not self._pending or (not partial and
+                        len(self._pending) < self._batch_size):
+                        break
+                    batch = self._pending[:self._batch_size]
+                
+                # The lock is not held while sending, so scrobbles can be
+                # queued meanwhile; they are added after this batch.
+                try:
+                    self._submit(batch)
+                except Exception as e:
+                    if not _rejected_for_good(e):
+                        self._back_off(len(batch), e)
+                        break
+                    log.error('setting aside %d scrobbles rejected by '
+                        'last.fm: %s', len(batch), e)
+                    self._set_aside(batch)
+                else:
+                    count += len(batch)
+                
+                with self._lock:
+                    del self._pending[:len(batch)]
+                    removed += len(batch)
+                    self._failures = 0
+                    self._retry_at = 0.0
+        finally:
+            with self._lock:
+                if removed:
+                    self._compact_spool()
+                self._submitted += count
+            self._sending.release()
+        return count
+    
+    def _back_off(self, size, error):
+        with self._lock:
+            delay = min(self._retry_interval * (2 ** self._failures),
+                self._max_retry_interval)
+            self._failures += 1
+            self._retry_at = time() + delay
+        log.warning('could not submit %d scrobbles, will retry in %.0f '
+            'seconds: %s', size, delay, error)
+    
+    def _set_aside(self, batch):
+        with self._lock:
+            self._rejected.extend(batch)
+            if not self._spool_path:
+                return
+            out = open('%s.rejected' % self._spool_path, 'a')
+            try:
+                for entry in batch:
+                    out.write(json.dumps(entry) + '\n')
+            finally:
+                out.close()
+    
+    def _submit(self, batch):
+        params = {'sk': self._session_key}
+        for i, entry in enumerate(batch):
+            for field, value in entry.iteritems():
+                params['%s[%d]' % (field, i)] = value
+        self._client.raw.track.scrobble.post(**params)
+    
+    def _run(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            try:
+                self._flush(partial=True, force=False)
+            except Exception:
+                log.exception('error while flushing scrobbles')
+    
+    def _read_spool(self, path):
+        try:
+            spool = open(path)
+        except IOError:
+            return []
+        
+        entries = []
+        try:
+            for line in spool:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash.
+                    log.warning('skipping damaged scrobble spool entry')
+        finally:
+            spool.close()
+        return entries
+    
+    def _compact_spool(self):
+        # Rewrite the spool with only the scrobbles that are still waiting,
+        # replacing the old file atomically.
+        if not self._spool:
+            return
+        
+        temporary = '%s.tmp' % self._spool_path
+        out = open(temporary, 'w')
+        try:
+            for entry in self._pending:
+                out.write(json.dumps(entry) + '\n')
+            out.flush()
+            if self._fsync:
+                os.fsync(out.fileno())
+        finally:
+            out.close()
+        
+        self._spool.close()
+        os.rename(temporary, self._spool_path)
+        self._spool = open(self._spool_path, 'a')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _rejected_for_good(error):
+    """
+    Returns whether an error raised while submitting scrobbles means that
+    sending them again would fail the same way.
+    """
+    if isinstance(error, APIError):
+        return error.code in _REJECTED_CODES
+    code = getattr(error, 'code', None)
+    # An HTTP client error response, other than "too many requests".
+    return (isinstance(error, IOError) and isinstance(code, int) and
+        400 <= code < 500 and code != 429)
@@ -0,0 +1,230 @@
+# encoding: utf-8
+
+"""
+A local fuzzy-search index over the artists and albums a client has seen.
+
+Turn it on by creating the client with `search_index=True` (or a SearchIndex
+of your own). Every artist and album row the client loads, whether from the
+API, the cache or a search, is then added to the index, and autocompletion
+and the first page of searches are answered from it:
+    
+    client = lastfm.Client(key, search_index=True)
+    ...
+    client.artists.search('madona')       # answered locally if confident
+    client.artists.autocomplete('mad')
+
+Names are matched by the trigrams (runs of three characters) they share,
+ignoring case, accents and punctuation. A search only goes to last.fm for its
+first page if the best local match scores below the index's `min_score`. A row
+that is added again replaces the indexed one, unless it has fewer fields (as
+search results have fewer than full artist or album information).
+"""
+
+from array import array
+from bisect import bisect_left, insort
+from heapq import merge
+from itertools import islice
+from math import ceil
+import re
+import threading
+import unicodedata
+
+_non_word = re.compile(r'[\W_]+', re.UNICODE)
+
+def normalize(text):
+    """
+    Lowercases `text`, removes its accents and replaces runs of punctuation
+    and spaces with single spaces.
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKD', text).lower()
+    text = u''.join(c for c in text if not unicodedata.combining(c))
+    return u' '.join(_non_word.sub(u' ', text).split())
+
+def trigrams(text):
+    """Returns the set of trigrams of normalized `text`."""
+    padded = u'  %s ' % text
+    return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+class SearchIndex(object):
+    """
+    A trigram index of artist and album rows, searchable by name.
+    """
+    
+    def __init__(self, min_score=0.8, min_similarity=0.5):
+        """
+        Creates an empty index.
+        
+        Searches are answered locally when the best match has a similarity
+        score (from 0 to 1) of at least `min_score`. Matches scoring below
+        `min_similarity` are never returned.
+        """
+        self.min_score = min_score
+        self.min_similarity = min_similarity
+        self._kinds = {}
+        self._lock = threading.Lock()
+    
+    def _kind(self, kind):
+        try:
+            return self._kinds[kind]
+        except KeyError:
+            return self._kinds.setdefault(kind, _KindIndex())
+    
+    def add(self, kind, row):
+        """
+        Adds an artist or album row (as decoded from the API) to the index,
+        replacing any row for the same artist or album that has no more
+        fields. `kind` is "artist" or "album".
+        """
+        name = row.get('name')
+        if not name:
+            return
+        if kind == 'album':
+            artist = row.get('artist')
+            if isinstance(artist, dict):
+                artist = artist.get('name')
+            key = normalize(u'%s/%s' % (artist or u'', name))
+        else:
+            key = normalize(name)
+        
+        with self._lock:
+            self._kind(kind).add(key, normalize(name), row)
+    
+    def search(self, kind, query, limit=10):
+        """
+        Returns up to `limit` (score, row) pairs for the indexed rows of the
+        given kind whose names best match `query`, best first.
+        """
+        index = self._kinds.get(kind)
+        text = normalize(query)
+        if index is None or not text:
+            return []
+        
+        # A name needs at least `needed` trigrams in common with the query to
+        # reach the minimum similarity, so it must have one of the rarest
+        # length - needed + 1 of them; only those are scanned.
+        similarity = self.min_similarity
+        grams = trigrams(text)
+        length = len(grams)
+        postings = sorted((index.postings.get(gram, ()) for gram in grams),
+            key=len)
+        needed = int(ceil(similarity * length / (2 - similarity)))
+        scanned = length - max(needed, 1) + 1
+        unscanned = postings[scanned:]
+        counts = dict.fromkeys(postings[0], 1)
+        get = counts.get
+        for entries in postings[1:scanned]:
+            for entry in entries:
+                counts[entry] = get(entry, 0) + 1
+        
+        # A name shares at most its count plus the unscanned trigrams with
+        # the query, so the names with a given count can only reach the
+        # minimum similarity if they have few enough trigrams; names with
+        # too few trigrams can't be similar enough, whatever they share.
+        low = similarity * length / (2 - similarity)
+        largest = [min(length * (2 - similarity) / similarity,
+            2 * (count + len(unscanned)) / similarity - length)
+            for count in xrange(scanned + 1)]
+        sizes = index.sizes
+        candidates = [(entry, count) for entry, count in counts.iteritems()
+            if low <= sizes[entry] <= largest[count]]
+        
+        # The rest are compared in full, by looking them up in the unscanned
+        # postings (which are sorted, as entries are only ever appended).
+        matches = []
+        for entry, count in candidates:
+            size = sizes[entry]
+            shared = count
+            for entries in unscanned:
+                position = bisect_left(entries, entry)
+                if position < len(entries) and entries[position] == entry:
+                    shared += 1
+            score = 2.0 * shared / (length + size)
+            if score >= similarity:
+                matches.append((score, entry))
+        matches.sort(key=lambda match: (-match[0],
+            len(index.names[match[1]])))
+        return [(score, index.rows[entry])
+            for score, entry in matches[:limit]]
+    
+    def complete(self, kind, prefix, limit=10):
+        """
+        Returns up to `limit` indexed rows of the given kind whose names
+        start with `prefix`, shortest first.
+        """
+        index = self._kinds.get(kind)
+        text = normalize(prefix)
+        if index is None or not text:
+            return []
+        
+        def starting(ordered):
+            position = bisect_left(ordered, (text, -1))
+            while position < len(ordered):
+                name, entry = ordered[position]
+                if not name.startswith(text):
+                    break
+                yield name, entry
+                position += 1
+        
+        with self._lock:
+            found = [entry for name, entry in islice(merge(
+                starting(index.ordered), starting(index.recent)), limit * 4)]
+        found.sort(key=lambda entry: len(index.names[entry]))
+        return [index.rows[entry] for entry in found[:limit]]
+    
+    def confident(self, matches):
+        """
+        Returns whether the (score, row) pairs returned by `search` are good
+        enough to answer a search without asking last.fm.
+        """
+        return bool(matches) and matches[0][0] >= self.min_score
+    
+    def __len__(self):
+        return sum(len(index.rows) for index in self._kinds.values())
+    
+    def __repr__(self):
+        return '<%s of %d rows>' % (type(self).__name__, len(self))
+
+
+class _KindIndex(object):
+    """The index of the rows of one kind."""
+    
+    def __init__(self):
+        self.rows = []
+        self.names = []
+        self.sizes = array('H')
+        self.keys = {}
+        self.postings = {}
+        # The (name, entry) pairs in name order: new pairs are inserted into
+        # the short `recent` list, which is merged into `ordered` when it has
+        # grown to a fraction of its size, so neither insertion nor merging
+        # has to move the whole list each time.
+        self.ordered = []
+        self.recent = []
+    
+    def add(self, key, name, row):
+        entry = self.keys.get(key)
+        if entry is not None:
+            # Keep the newer row unless it has fewer fields, as the summary
+            # rows of a search would otherwise replace full ones.
+            if len(row) >= len(self.rows[entry]):
+                self.rows[entry] = row
+            return
+        
+        entry = len(self.rows)
+        grams = trigrams(name)
+        self.rows.append(row)
+        self.names.append(name)
+        self.sizes.append(min(len(grams), 0xffff))
+        self.keys[key] = entry
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('i')
+            postings.append(entry)
+        insort(self.recent, (name, entry))
+        if len(self.recent) > max(1024, len(self.ordered) // 32):
+            self.ordered.extend(self.recent)
+            self.ordered.sort()
+            self.recent = []
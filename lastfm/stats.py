@@ -0,0 +1,236 @@
+# encoding: utf-8
+
+"""
+Collects counters and latency histograms from a last.fm client.
+
+Instrumentation is turned on by passing `stats=True` (or a Stats object) when
+creating a Client. The client then records:
+
+- `api.<method>.calls`, `api.<method>.errors` and the `api.<method>.latency`
+  histogram for every API call;
+- the `time.agent`, `time.read`, `time.json` and `time.decode` histograms,
+  which split the time spent in the HTTP agent, reading the response body,
+  in the JSON decoder, and in turning decoded rows into library objects;
+- `cache.<backend>.hits`, `.misses`, `.sets` and `.deletes` for the cache,
+  and `.evictions` for backends that count the items they drop: expired
+  items purged from the local cache, and items memcached evicted to make
+  room (as reported by the servers, when `snapshot()` is called).
+
+Call `snapshot()` on the client's `stats` object to get all of these as plain
+dictionaries suitable for exporting to a metrics system, or register a hook
+with `add_hook` to receive every measurement as it is made.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+    1.0, 2.0, 5.0, 10.0)
+
+class Histogram(object):
+    """
+    A latency histogram with fixed bucket boundaries.
+    """
+    
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self._bounds = tuple(bounds)
+        self._buckets = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+    
+    def observe(self, value):
+        """Records a single measurement (in seconds)."""
+        self._buckets[bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    
+    def percentile(self, p):
+        """
+        Estimates the `p`th percentile (0-100) of the recorded values. The
+        estimate is the upper bound of the bucket in which the percentile
+        falls, clamped to the largest value seen.
+        """
+        if not self.count:
+            return None
+        
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self._buckets):
+            seen += n
+            if n and seen >= rank:
+                if i < len(self._bounds):
+                    return min(self._bounds[i], self.max)
+                return self.max
+        return self.max
+    
+    def snapshot(self):
+        """Returns the state of the histogram as a dictionary."""
+        bounds = list(self._bounds) + [None]
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': zip(bounds, self._buckets)
+        }
+
+
+class Stats(object):
+    """
+    A thread-safe collection of named counters and latency histograms.
+    """
+    
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self._bounds = bounds
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._caches = {}
+        self._hooks = []
+    
+    def add_hook(self, hook):
+        """
+        Registers a callable that is invoked as hook(kind, name, value) for
+        every measurement, where `kind` is "count" or "time".
+        """
+        self._hooks.append(hook)
+    
+    def remove_hook(self, hook):
+        """Unregisters a hook added with `add_hook`."""
+        self._hooks.remove(hook)
+    
+    def count(self, name, n=1):
+        """Increments the counter `name` by `n`."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        for hook in self._hooks:
+            hook('count', name, n)
+    
+    def observe(self, name, seconds):
+        """Records a duration (in seconds) in the histogram `name`."""
+        with self._lock:
+            try:
+                histogram = self._histograms[name]
+            except KeyError:
+                histogram = self._histograms[name] = Histogram(self._bounds)
+            histogram.observe(seconds)
+        for hook in self._hooks:
+            hook('time', name, seconds)
+    
+    def monitor_cache(self, cache, name=None):
+        """
+        Returns a wrapper around `cache` that counts hits, misses, sets,
+        deletes and evictions under `cache.<name>`. The name defaults to the
+        name of the module that defines the cache's class (e.g., "local" or
+        "memcache").
+        """
+        if not name:
+            name = type(cache).__module__.rsplit('.', 1)[-1]
+        monitored = MonitoredCache(cache, self, name)
+        self._caches[name] = monitored
+        return monitored
+    
+    def snapshot(self):
+        """
+        Returns the current values of all counters and histograms as a
+        dictionary with "counters" and "histograms" keys.
+        """
+        for name, monitored in self._caches.items():
+            monitored._collect_evictions()
+        
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': dict((name, h.snapshot()) for name, h in
+                    self._histograms.iteritems())
+            }
+    
+    def reset(self):
+        """Clears all counters and histograms."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+    
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self._counters)
+
+
+class MonitoredCache(object):
+    """
+    Wraps a cache and records its activity in a Stats object. Attributes not
+    related to dictionary-style access are passed through to the cache.
+    """
+    
+    def __init__(self, cache, stats, name):
+        self._cache = cache
+        self._stats = stats
+        self._prefix = 'cache.%s.' % name
+        # Only evictions made after the cache started being monitored count.
+        self._evictions = getattr(cache, 'evictions', None) or 0
+        self._collecting = Lock()
+    
+    @property
+    def backend(self):
+        """The cache being monitored."""
+        return self._cache
+    
+    def __getitem__(self, key):
+        value = self._cache[key]
+        if value is None:
+            self._stats.count(self._prefix + 'misses')
+        else:
+            self._stats.count(self._prefix + 'hits')
+        return value
+    
+    def __setitem__(self, key, value):
+        self._cache[key] = value
+        self._stats.count(self._prefix + 'sets')
+    
+    def set(self, key, value, timeout=None):
+        try:
+            store = self._cache.set
+        except AttributeError:
+            self._cache[key] = value
+        else:
+            store(key, value, timeout)
+        self._stats.count(self._prefix + 'sets')
+    
+    def __delitem__(self, key):
+        del self._cache[key]
+        self._stats.count(self._prefix + 'deletes')
+    
+    def __contains__(self, key):
+        return key in self._cache
+    
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+    
+    def _collect_evictions(self):
+        # Expirations happen inside the backend; caches that count them expose
+        # an `evictions` attribute.
+        # The lock keeps concurrent snapshots from counting the same
+        # evictions twice.
+        with self._collecting:
+            total = getattr(self._cache, 'evictions', None)
+            if total is None:
+                return
+            if total < self._evictions:
+                # The backend's count was reset (e.g., a memcached server
+                # restarted), so all of it is new.
+                self._evictions = 0
+            if total > self._evictions:
+                self._stats.count(self._prefix + 'evictions',
+                    total - self._evictions)
+            self._evictions = total
+    
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self._cache)
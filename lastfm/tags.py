@@ -0,0 +1,167 @@
+# encoding: utf-8
+
+"""
+A local inverted index from tags to the artists and albums carrying them.
+
+Turn it on by creating the client with `tag_index=True` (or a TagIndex of
+your own). Every artist and album the client decodes with its top tags,
+whether from the API or the cache, is then indexed under those tags, and
+tag queries are answered without going back to last.fm:
+    
+    client = lastfm.Client(key, tag_index=True)
+    ...
+    client.artists.tagged('trip-hop', 'female vocalists')
+    client.tag_index.related('artist', 'trip-hop')
+
+The index is kept up to date as rows are decoded: when an artist or album is
+decoded again, its old tags are replaced by the new ones. Tags are matched
+without regard to case.
+"""
+
+import threading
+
+class TagIndex(object):
+    """
+    An inverted index of artist and album rows by tag, with the number of
+    rows on which each pair of tags appears together.
+    """
+    
+    def __init__(self):
+        """Creates an empty index."""
+        self._kinds = {}
+        self._lock = threading.Lock()
+    
+    def _kind(self, kind):
+        try:
+            return self._kinds[kind]
+        except KeyError:
+            return self._kinds.setdefault(kind, _KindIndex())
+    
+    def add(self, kind, row, tags):
+        """
+        Indexes an artist or album row (as decoded from the API) under the
+        given tag names, replacing the tags it was indexed under before.
+        `kind` is "artist" or "album".
+        """
+        name = row.get('name')
+        if not name:
+            return
+        if kind == 'album':
+            artist = row.get('artist')
+            if isinstance(artist, dict):
+                artist = artist.get('name')
+            key = (artist or u'').lower(), name.lower()
+        else:
+            key = name.lower()
+        
+        with self._lock:
+            self._kind(kind).add(key, row,
+                frozenset(tag.strip().lower() for tag in tags))
+    
+    def tagged(self, kind, *tags):
+        """
+        Returns the indexed rows of the given kind that carry all of `tags`,
+        in no particular order.
+        """
+        index = self._kinds.get(kind)
+        if index is None or not tags:
+            return []
+        
+        with self._lock:
+            postings = sorted((index.postings.get(tag.strip().lower(), ())
+                for tag in tags), key=len)
+            keys = set(postings[0])
+            for entries in postings[1:]:
+                if not keys:
+                    break
+                keys.intersection_update(entries)
+            return [index.rows[key] for key in keys]
+    
+    def count(self, kind, tag):
+        """Returns the number of indexed rows of the given kind with `tag`."""
+        index = self._kinds.get(kind)
+        if index is None:
+            return 0
+        return len(index.postings.get(tag.strip().lower(), ()))
+    
+    def related(self, kind, tag, limit=10):
+        """
+        Returns up to `limit` (count, tag) pairs for the tags that appear most
+        often on the indexed rows of the given kind alongside `tag`, most
+        frequent first.
+        """
+        index = self._kinds.get(kind)
+        if index is None:
+            return []
+        
+        with self._lock:
+            counts = index.pairs.get(tag.strip().lower(), {})
+            related = sorted(((count, other) for other, count in
+                counts.iteritems()), key=lambda pair: (-pair[0], pair[1]))
+        return related[:limit]
+    
+    def tags(self, kind):
+        """
+        Returns (count, tag) pairs for all the tags on the indexed rows of the
+        given kind, most frequent first.
+        """
+        index = self._kinds.get(kind)
+        if index is None:
+            return []
+        
+        with self._lock:
+            counts = [(len(keys), tag) for tag, keys in
+                index.postings.iteritems()]
+        counts.sort(key=lambda pair: (-pair[0], pair[1]))
+        return counts
+    
+    def __len__(self):
+        return sum(len(index.rows) for index in self._kinds.values())
+    
+    def __repr__(self):
+        return '<%s of %d rows>' % (type(self).__name__, len(self))
+
+
+class _KindIndex(object):
+    """The index of the rows of one kind."""
+    
+    def __init__(self):
+        self.rows = {}
+        self.tags = {}
+        self.postings = {}
+        self.pairs = {}
+    
+    def add(self, key, row, tags):
+        self.rows[key] = row
+        old = self.tags.get(key, frozenset())
+        if tags == old:
+            return
+        self.tags[key] = tags
+        
+        for tag in old - tags:
+            keys = self.postings[tag]
+            keys.discard(key)
+            if not keys:
+                del self.postings[tag]
+        for tag in tags - old:
+            self.postings.setdefault(tag, set()).add(key)
+        
+        # Only the pairs involving a changed tag need their counts updated.
+        for tag in old:
+            for other in old:
+                if other != tag and (tag not in tags or other not in tags):
+                    self._count(tag, other, -1)
+        for tag in tags:
+            for other in tags:
+                if other != tag and (tag not in old or other not in old):
+                    self._count(tag, other, 1)
+    
+    def _count(self, tag, other, change):
+        counts = self.pairs.setdefault(tag, {})
+        count = counts.get(other, 0) + change
+        if count > 0:
+            counts[other] = count
+        else:
+            counts.pop(other, None)
+            if not counts:
+                del self.pairs[tag]
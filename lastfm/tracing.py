@@ -0,0 +1,123 @@
+# encoding: utf-8
+
+"""
+Breaks last.fm API requests down into timed phases for latency investigations.
+
+Tracing is turned on by passing a Tracer to the Client (or to an Agent and an
+APIAccess object directly):
+    
+    tracer = lastfm.tracing.Tracer(sample_rate=0.1, slow_threshold=0.5)
+    client = lastfm.Client(key, tracer=tracer)
+
+Each traced request records these spans:
+
+- `build_url`: encoding the request parameters into the URL;
+- `connect`: acquiring and connecting the HTTP connection;
+- `first_byte`: sending the request and waiting for the response headers;
+- `read`: reading the response body;
+- `decode`: decoding the JSON response.
+
+Finished traces are logged to the "lastfm.tracing" logger and passed to the
+tracer's sink, if one was given.
+"""
+
+from time import time
+import logging
+import random
+import threading
+
+log = logging.getLogger('lastfm.tracing')
+
+class Trace(object):
+    """
+    The timing of the phases of a single API request.
+    """
+    
+    def __init__(self, method, params):
+        self.method = method
+        self.params = dict((k, v) for k, v in params.iteritems()
+            if k not in Tracer.hidden_params)
+        self.start = time()
+        self.end = None
+        self.error = None
+        self.spans = []
+    
+    def add(self, name, start, end):
+        """Records that the phase `name` ran from `start` to `end`."""
+        self.spans.append((name, start, end))
+    
+    @property
+    def duration(self):
+        """The total duration of the request in seconds."""
+        return (self.end or time()) - self.start
+    
+    def __str__(self):
+        phases = ' '.join('%s=%.1fms' % (name, (end - start) * 1000)
+            for name, start, end in self.spans)
+        params = ' '.join('%s=%s' % item
+            for item in sorted(self.params.items()))
+        status = (self.error and ' error=%s' % type(self.error).__name__) or ''
+        return '%s [%s] %.1fms: %s%s' % (self.method, params,
+            self.duration * 1000, phases, status)
+    
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self)
+
+
+class Tracer(object):
+    """
+    Decides which requests to trace and reports the finished traces.
+    """
+    
+    hidden_params = frozenset(['api_key', 'api_sig', 'sk', 'format', 'method'])
+    
+    def __init__(self, sample_rate=1.0, slow_threshold=None, sink=None,
+        logger=None):
+        """
+        Creates a new tracer.
+        
+        The `sample_rate` is the fraction of requests that are traced. If
+        `slow_threshold` is given, only traced requests that took at least that
+        many seconds are reported. The `sink` is an optional callable that is
+        given each reported Trace object. Reported traces are also logged to
+        `logger` (by default, the "lastfm.tracing" logger): at WARNING level if
+        they exceeded the slow-request threshold, and at INFO level otherwise.
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self._sink = sink
+        self._log = logger or log
+        self._local = threading.local()
+    
+    def begin(self, method, params):
+        """
+        Starts tracing a request if it is sampled, and returns the new Trace
+        object (or None if the request is not being traced).
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        
+        trace = Trace(method, params)
+        self._local.trace = trace
+        return trace
+    
+    def current(self):
+        """Returns the trace for the request running on this thread, if any."""
+        return getattr(self._local, 'trace', None)
+    
+    def finish(self, trace, error=None):
+        """Finishes a trace started by `begin`, reporting it if necessary."""
+        trace.end = time()
+        trace.error = error
+        if getattr(self._local, 'trace', None) is trace:
+            self._local.trace = None
+        
+        level = logging.INFO
+        if self.slow_threshold is not None:
+            if trace.duration < self.slow_threshold:
+                return
+            level = logging.WARNING
+        
+        self._log.log(level, '%s', trace)
+        if self._sink:
+            self._sink(trace)
@@ -0,0 +1,8 @@
+# encoding: utf-8
+
+"""
+Behaviour tests for the lastfm package. Run them from the root of the source
+tree with:
+    
+    python -m unittest discover tests
+"""
@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+import socket
+import unittest
+
+from lastfm import breaker
+from lastfm.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from lastfm.errors import (CircuitOpenError, InvalidParametersError,
+    ServiceOfflineError)
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self._time = breaker.time
+        breaker.time = lambda: self.now
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+    
+    def tearDown(self):
+        breaker.time = self._time
+    
+    def fail(self, times=1):
+        for i in xrange(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure()
+    
+    def open(self):
+        self.fail(3)
+        self.assertEqual(OPEN, self.breaker.state)
+    
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.fail()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertEqual(1, self.breaker.times_opened)
+    
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.fail(2)
+        self.assertEqual(CLOSED, self.breaker.state)
+    
+    def test_open_breaker_rejects_calls_until_the_timeout(self):
+        self.open()
+        self.now += 10
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(1, self.breaker.rejected)
+        self.assertEqual(20.0, self.breaker.retry_after())
+        
+        self.now += 20
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertEqual(0.0, self.breaker.retry_after())
+    
+    def test_lets_one_probe_through(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+    
+    def test_failed_probe_reopens_without_counting_again(self):
+        self.open()
+        self.now += 30
+        self.fail()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertEqual(1, self.breaker.times_opened)
+        self.assertEqual(30.0, self.breaker.retry_after())
+        
+        # Closing and opening again does count.
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.open()
+        self.assertEqual(2, self.breaker.times_opened)
+    
+    def test_abandoned_probe_frees_its_place(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.abandon()
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+    
+    def test_reset_closes(self):
+        self.open()
+        self.breaker.reset()
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+    
+    def test_failures_are_told_from_other_errors(self):
+        def http_error(code):
+            error = IOError('HTTP error')
+            error.code = code
+            return error
+        
+        is_failure = CircuitBreaker.is_failure
+        self.assertTrue(is_failure(ServiceOfflineError('offline', 11)))
+        self.assertTrue(is_failure(CircuitOpenError('open')))
+        self.assertTrue(is_failure(socket.error('connection refused')))
+        self.assertTrue(is_failure(http_error(503)))
+        self.assertFalse(is_failure(http_error(404)))
+        self.assertFalse(is_failure(InvalidParametersError('bad', 6)))
+        self.assertFalse(is_failure(ValueError('bad JSON')))
+
+
+if __name__ == '__main__':
+    unittest.main()
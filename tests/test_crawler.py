@@ -0,0 +1,118 @@
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lastfm.crawler import Crawler
+
+class FakeClient(object):
+    """
+    Stands in for a Client, answering artist.getSimilar from `graph`, a
+    dictionary of artist names to lists of (similar artist, match) pairs.
+    `fetched` lists the artists asked for, and `on_fetch`, if set, is called
+    with each.
+    """
+    
+    api_key = 'key'
+    breaker = None
+    
+    def __init__(self, graph):
+        self.graph = graph
+        self.fetched = []
+        self.on_fetch = None
+        # Calls are made with client.raw.artist.get_similar.
+        self.raw = self.artist = self
+    
+    def get_similar(self, artist, limit=None):
+        self.fetched.append(artist)
+        if self.on_fetch:
+            self.on_fetch(artist)
+        return {'similarartists': {'artist': [{'name': name,
+            'match': str(match)} for name, match in self.graph[artist]]}}
+
+
+class CrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'crawl')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def crawler(self, client, **kwargs):
+        kwargs.setdefault('rate', 1000.0)
+        kwargs.setdefault('workers', 1)
+        return Crawler(client, **kwargs)
+    
+    def edges(self, crawler):
+        return sorted((crawler.nodes[source][0], crawler.nodes[target][0],
+            round(match, 2)) for source, target, match in crawler.edges())
+    
+    def test_crawls_breadth_first_to_the_depth(self):
+        client = FakeClient({'A': [('B', 1.0), ('C', 0.5)], 'B': [('D', 0.5)],
+            'C': [('A', 0.5)], 'D': [('E', 1.0)]})
+        crawler = self.crawler(client, depth=2)
+        progress = crawler.crawl(['A'])
+        
+        self.assertEqual(['A', 'B', 'C'], sorted(client.fetched))
+        self.assertEqual(3, progress['expanded'])
+        self.assertEqual(2, crawler.depth_of(crawler.node_id('D')))
+        self.assertEqual([('A', 'B', 1.0), ('A', 'C', 0.5),
+            ('B', 'D', 0.5), ('C', 'A', 0.5)], self.edges(crawler))
+    
+    def test_shorter_path_lowers_depths_without_duplicating_edges(self):
+        client = FakeClient({'A': [('B', 1.0)], 'B': [('C', 0.5)],
+            'C': [('D', 0.5)], 'D': []})
+        crawler = self.crawler(client, depth=2)
+        crawler.crawl(['A'])
+        self.assertEqual(['A', 'B'], client.fetched)
+        
+        # B becomes a seed: it is expanded again, only to pass its new depth
+        # on to C, which now comes within reach.
+        progress = crawler.crawl(['B'])
+        self.assertEqual(['A', 'B', 'B', 'C'], client.fetched)
+        self.assertEqual(0, crawler.depth_of(crawler.node_id('B')))
+        self.assertEqual(1, crawler.depth_of(crawler.node_id('C')))
+        self.assertEqual(2, crawler.depth_of(crawler.node_id('D')))
+        self.assertEqual(3, progress['expanded'])
+        self.assertEqual([('A', 'B', 1.0), ('B', 'C', 0.5),
+            ('C', 'D', 0.5)], self.edges(crawler))
+    
+    def test_resumes_from_a_checkpoint(self):
+        graph = {'A': [('B', 1.0), ('C', 0.5)], 'B': [('C', 0.5)],
+            'C': [('D', 1.0)], 'D': []}
+        client = FakeClient(graph)
+        crawler = self.crawler(client, depth=3, checkpoint=self.checkpoint)
+        # Interrupted after the first artist.
+        client.on_fetch = lambda artist: crawler.stop()
+        progress = crawler.crawl(['A'])
+        self.assertEqual(1, progress['expanded'])
+        self.assertEqual(2, progress['frontier'])
+        
+        client = FakeClient(graph)
+        resumed = self.crawler(client, depth=3, checkpoint=self.checkpoint)
+        progress = resumed.crawl()
+        self.assertEqual(['B', 'C', 'D'], sorted(client.fetched))
+        self.assertEqual(4, progress['expanded'])
+        self.assertEqual([('A', 'B', 1.0), ('A', 'C', 0.5), ('B', 'C', 0.5),
+            ('C', 'D', 1.0)], self.edges(resumed))
+    
+    def test_retries_transient_failures(self):
+        client = FakeClient({'A': [('B', 1.0)], 'B': []})
+        failures = [IOError('connection reset')]
+        def fail(artist):
+            if failures:
+                raise failures.pop()
+        client.on_fetch = fail
+        crawler = self.crawler(client, depth=2, retry_delay=0.01)
+        progress = crawler.crawl(['A'])
+        self.assertEqual(['A', 'A', 'B'], client.fetched)
+        self.assertEqual(1, progress['errors'])
+        self.assertEqual(0, progress['failed'])
+        self.assertEqual(2, progress['expanded'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm import enrich
+from lastfm.enrich import BulkEnricher, _Progress
+
+def _echo(settings, tasks, results, limiter):
+    """A worker that "looks up" each artist without calling last.fm."""
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            number, row = task
+            results.put((number, {'row': number, 'input': row,
+                'artist': {'name': row['artist']}}))
+    finally:
+        results.put(None)
+
+class BulkEnricherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'out.jsonl')
+        self.rows = [{'artist': u'Artist %d' % i} for i in xrange(10)]
+        self._work = enrich._work
+        enrich._work = _echo
+    
+    def tearDown(self):
+        enrich._work = self._work
+        shutil.rmtree(self.directory)
+    
+    def run_enricher(self, rows):
+        enricher = BulkEnricher('key', processes=2, report_interval=60.0,
+            checkpoint_interval=60.0)
+        return enricher.run(iter(rows), self.output)
+    
+    def written(self):
+        stream = open(self.output)
+        try:
+            return [json.loads(line)['row'] for line in stream]
+        finally:
+            stream.close()
+    
+    def test_writes_every_row(self):
+        stats = self.run_enricher(self.rows)
+        self.assertEqual(10, stats['written'])
+        self.assertEqual(range(10), sorted(self.written()))
+    
+    def test_resumes_after_the_finished_rows(self):
+        self.run_enricher(self.rows[:6])
+        # Lines written after the last saved progress are discarded, and
+        # their rows looked up again.
+        out = open(self.output, 'a')
+        out.write('{"row": 6, "artist": {"name": "Artist')
+        out.close()
+        
+        stats = self.run_enricher(self.rows)
+        self.assertEqual(6, stats['skipped'])
+        self.assertEqual(4, stats['written'])
+        self.assertEqual(range(10), sorted(self.written()))
+    
+    def test_refuses_output_from_an_unknown_run(self):
+        out = open(self.output, 'w')
+        out.write('{}\n')
+        out.close()
+        self.assertRaises(ValueError, self.run_enricher, self.rows)
+
+
+class ProgressTest(unittest.TestCase):
+    def test_rows_finished_out_of_order(self):
+        progress = _Progress()
+        for number in (2, 0, 3):
+            progress.finish(number)
+        self.assertEqual(1, progress.next)
+        self.assertEqual(set([2, 3]), progress.done)
+        self.assertTrue(progress.is_finished(3))
+        self.assertFalse(progress.is_finished(1))
+        
+        progress.finish(1)
+        self.assertEqual(4, progress.next)
+        self.assertEqual(set(), progress.done)
+    
+    def test_saved_and_loaded(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'progress')
+            out = open(os.path.join(directory, 'out'), 'ab')
+            out.write('row\n')
+            progress = _Progress(3, [5, 7])
+            progress.save(path, out)
+            out.close()
+            
+            loaded = _Progress.load(path)
+            self.assertEqual((3, set([5, 7]), 4),
+                (loaded.next, loaded.done, loaded.offset))
+            self.assertEqual(None,
+                _Progress.load(os.path.join(directory, 'missing')))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# encoding: utf-8
+
+from time import time, sleep
+import threading
+import unittest
+
+import lastfm
+from lastfm.hedging import HedgePolicy
+from benchmarks.fakeserver import FakeLastFM
+
+class ScriptedLastFM(FakeLastFM):
+    """A fake last.fm that delays its responses by the given `delays`."""
+    
+    def __init__(self, delays):
+        FakeLastFM.__init__(self)
+        self.delays = list(delays)
+    
+    def delay(self, size):
+        if self.delays:
+            sleep(self.delays.pop(0))
+
+
+class HedgePolicyTest(unittest.TestCase):
+    def policy(self, **kwargs):
+        # Enough budget for a duplicate from the first call on, and a delay
+        # of 50 ms.
+        kwargs.setdefault('budget', 1.0)
+        kwargs.setdefault('min_samples', 1)
+        policy = HedgePolicy(min_delay=0.05, **kwargs)
+        policy.observe(0.01)
+        return policy
+    
+    def test_fast_calls_are_not_hedged(self):
+        policy = self.policy()
+        self.assertEqual('answer', policy.call(lambda: 'answer'))
+        self.assertEqual(0, policy.hedged)
+    
+    def test_first_answer_wins(self):
+        policy = self.policy()
+        release = threading.Event()
+        finished = []
+        def slow():
+            release.wait()
+            finished.append('slow')
+            return 'slow'
+        
+        self.assertEqual('fast', policy.call(slow,
+            lambda: (lambda: 'fast')))
+        self.assertEqual((1, 1), (policy.hedged, policy.won))
+        
+        # The loser is left to finish on its own, and its answer is dropped.
+        release.set()
+        sleep(0.05)
+        self.assertEqual(['slow'], finished)
+        self.assertEqual(1, policy.won)
+    
+    def test_answer_beats_an_earlier_failure(self):
+        policy = self.policy()
+        def failing():
+            sleep(0.1)
+            raise IOError('connection reset')
+        self.assertEqual('duplicate', policy.call(failing,
+            lambda: (lambda: 'duplicate')))
+    
+    def test_first_failure_is_raised_when_every_attempt_fails(self):
+        policy = self.policy()
+        def primary():
+            sleep(0.1)
+            raise IOError('primary failed')
+        def duplicate():
+            sleep(0.2)
+            raise ValueError('duplicate failed')
+        try:
+            policy.call(primary, lambda: duplicate)
+        except IOError as e:
+            self.assertEqual('primary failed', str(e))
+        else:
+            self.fail('no error raised')
+        self.assertEqual(0, policy.won)
+    
+    def test_no_duplicate_without_budget(self):
+        policy = self.policy(budget=0.01)
+        self.assertEqual('slow', policy.call(lambda: sleep(0.1) or 'slow'))
+        self.assertEqual(0, policy.hedged)
+    
+    def test_declined_duplicate_is_refunded(self):
+        policy = self.policy()
+        self.assertEqual('slow', policy.call(lambda: sleep(0.1) or 'slow',
+            lambda: None))
+        self.assertEqual(0, policy.hedged)
+
+
+class HedgedClientTest(unittest.TestCase):
+    def test_slow_response_is_hedged(self):
+        server = ScriptedLastFM([1.0]).start()
+        try:
+            policy = HedgePolicy(budget=1.0, min_samples=1, min_delay=0.05)
+            policy.observe(0.01)
+            client = lastfm.Client('key', agent=server.agent(), cache=False,
+                hedge=policy)
+            
+            started = time()
+            data = client.raw.artist.get_info(artist='Cher')
+            self.assertTrue(time() - started < 0.9)
+            self.assertEqual('Cher', data['artist']['name'])
+            self.assertEqual(2, server.requests)
+            self.assertEqual((1, 1), (policy.hedged, policy.won))
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
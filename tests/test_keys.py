@@ -0,0 +1,104 @@
+# encoding: utf-8
+
+import multiprocessing
+import unittest
+
+from lastfm import keys
+from lastfm.errors import (InvalidAPIKeyError, RateLimitExceededError,
+    SuspendedAPIKeyError)
+from lastfm.keys import KeyPool, SharedRateLimiter
+
+def _take(pool, count):
+    for i in xrange(count):
+        pool.acquire(0)
+
+class KeyPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self._time = keys.time
+        keys.time = lambda: self.now
+    
+    def tearDown(self):
+        keys.time = self._time
+    
+    def test_ties_are_taken_in_turn(self):
+        pool = KeyPool(['a', 'b', 'c'], rate=1000.0)
+        taken = []
+        for i in xrange(30):
+            taken.append(pool.acquire())
+            # Let the buckets refill, so that every key is tied.
+            self.now += 1
+        self.assertEqual([10, 10, 10], [taken.count(key) for key in 'abc'])
+    
+    def test_prefers_the_key_with_most_capacity(self):
+        pool = KeyPool(['a', 'b'], rate=1.0, burst=3)
+        pool._limiters['a'].try_acquire()
+        self.assertEqual('b', pool.acquire(0))
+        # Both keys have two calls left now.
+        taken = [pool.acquire(0) for i in xrange(4)]
+        self.assertEqual([2, 2], [taken.count(key) for key in 'ab'])
+        self.assertRaises(RateLimitExceededError, pool.acquire, 0)
+        
+        self.now += 1
+        self.assertTrue(pool.acquire(0) in 'ab')
+    
+    def test_rejected_key_is_paused(self):
+        pool = KeyPool(['a', 'b'], rate=1000.0, backoff=30.0)
+        pool.report('a', InvalidAPIKeyError('invalid key', 10))
+        self.assertEqual(['b'] * 5, [pool.acquire() for i in xrange(5)])
+        self.assertEqual(30.0, pool.snapshot()['a']['paused_for'])
+        
+        self.now += 30
+        self.assertTrue('a' in [pool.acquire() for i in xrange(5)])
+    
+    def test_pause_doubles_until_a_call_succeeds(self):
+        pool = KeyPool(['a'], backoff=30.0, max_backoff=100.0)
+        suspended = SuspendedAPIKeyError('suspended', 26)
+        for expected in (30.0, 60.0, 100.0):
+            pool.report('a', suspended)
+            self.assertEqual(expected, pool.snapshot()['a']['paused_for'])
+        
+        self.now += 100
+        pool.report('a')
+        pool.report('a', suspended)
+        self.assertEqual(30.0, pool.snapshot()['a']['paused_for'])
+    
+    def test_all_keys_paused(self):
+        pool = KeyPool(['a', 'b'])
+        for key in 'ab':
+            pool.report(key, RateLimitExceededError('slow down', 29))
+        self.assertRaises(RateLimitExceededError, pool.acquire)
+    
+    def test_acquiring_a_particular_key(self):
+        pool = KeyPool(['a', 'b'], rate=1.0, burst=2)
+        self.assertEqual('a', pool.signing_key)
+        self.assertEqual(['b', 'b'], [pool.acquire(0, 'b') for i in xrange(2)])
+        self.assertRaises(RateLimitExceededError, pool.acquire, 0, 'b')
+        self.assertEqual('a', pool.acquire(0))
+        
+        pool.report('a', InvalidAPIKeyError('invalid key', 10))
+        self.assertRaises(RateLimitExceededError, pool.acquire, None, 'a')
+        self.assertRaises(ValueError, KeyPool, ['a'], signing_key='b')
+    
+    def test_other_errors_do_not_pause(self):
+        pool = KeyPool(['a'])
+        pool.report('a', IOError('connection reset'))
+        pool.report('unknown', InvalidAPIKeyError('invalid key', 10))
+        self.assertEqual('a', pool.acquire(0))
+    
+    def test_shared_limits_are_kept_across_processes(self):
+        keys.time = self._time
+        pool = KeyPool(['a', 'b'], rate=0.001, burst=2, shared=True)
+        self.assertTrue(isinstance(pool._limiters['a'], SharedRateLimiter))
+        
+        child = multiprocessing.Process(target=_take, args=(pool, 3))
+        child.start()
+        child.join()
+        self.assertEqual(0, child.exitcode)
+        # The child took three of the four calls the keys allow.
+        pool.acquire(0)
+        self.assertRaises(RateLimitExceededError, pool.acquire, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# encoding: utf-8
+
+from StringIO import StringIO
+import socket
+import time
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import lastfm
+from lastfm.errors import DeadlineExceededError
+
+class StubAgent(object):
+    """
+    Stands in for an HTTP agent, answering every request with `body` and
+    recording the parameters of each request in `requests` and its other
+    arguments (such as `timeout`) in `options`.
+    """
+    
+    def __init__(self, body='{}'):
+        self.body = body
+        self.requests = []
+        self.options = []
+    
+    def respond(self, method, params):
+        return StringIO(self.body)
+    
+    def get(self, url, data=None, **kwargs):
+        self.requests.append(('GET', dict(data)))
+        self.options.append(kwargs)
+        return self.respond('GET', data)
+    
+    def post(self, url, data=None, **kwargs):
+        self.requests.append(('POST', dict(data)))
+        self.options.append(kwargs)
+        return self.respond('POST', data)
+
+class Response(StringIO):
+    """A response body with an HTTP status code and headers."""
+    
+    def __init__(self, body, code=200, headers=None):
+        StringIO.__init__(self, body)
+        self.code = code
+        self.headers = headers or {}
+    
+    def info(self):
+        return self.headers
+
+class RevalidatingAgent(StubAgent):
+    """
+    A stub agent that serves its body with an ETag, and answers requests
+    that carry that ETag with "304 Not Modified".
+    """
+    
+    etag = '"v1"'
+    
+    def respond(self, method, params):
+        conditions = self.options[-1].get('headers') or {}
+        if conditions.get('If-None-Match') == self.etag:
+            return Response('', 304)
+        return Response(self.body, headers={'ETag': self.etag})
+
+class SlowBody(StringIO):
+    """A response body that takes `delay` seconds to read."""
+    
+    delay = 0.2
+    
+    def read(self, *args):
+        time.sleep(self.delay)
+        self.delay = 0
+        return StringIO.read(self, *args)
+
+class SlowBodyAgent(StubAgent):
+    def respond(self, method, params):
+        return SlowBody(self.body)
+
+class SlowAgent(StubAgent):
+    """
+    A stub agent whose requests take until their timeout to fail, as they
+    would with a server that does not answer.
+    """
+    
+    def respond(self, method, params):
+        time.sleep(self.options[-1]['timeout'])
+        raise socket.timeout('timed out')
+
+
+class KeyPoolCallTest(unittest.TestCase):
+    def test_signed_calls_use_the_signing_key(self):
+        agent = StubAgent()
+        client = lastfm.Client(['key-a', 'key-b', 'key-c'], secret='secret',
+            agent=agent, cache=False)
+        for i in xrange(3):
+            client.raw.track.scrobble.post(sk='session', artist='Cher',
+                track='Believe', timestamp=i)
+            client.raw.artist.get_info(artist='Cher')
+        
+        used = [(method, params['api_key']) for method, params in
+            agent.requests]
+        self.assertEqual([('POST', 'key-a')] * 3,
+            [use for use in used if use[0] == 'POST'])
+        # Unsigned calls are still spread over the pool.
+        self.assertTrue(len(set(key for method, key in used
+            if method == 'GET')) > 1)
+
+class RevalidationTest(unittest.TestCase):
+    body = json.dumps({'artist': {'name': 'Cher'}})
+    
+    def test_unchanged_responses_are_reused(self):
+        agent = RevalidatingAgent(self.body)
+        client = lastfm.Client('key', agent=agent, revalidate=True,
+            stats=True)
+        first = client.raw.artist.get_info(artist='Cher')
+        second = client.raw.artist.get_info(artist='Cher')
+        
+        self.assertEqual({'artist': {'name': 'Cher'}}, first)
+        self.assertEqual(first, second)
+        self.assertEqual([None, {'If-None-Match': '"v1"'}],
+            [options.get('headers') for options in agent.options])
+        counters = client.stats.snapshot()['counters']
+        self.assertEqual(1, counters['api.artist.getInfo.not_modified'])
+    
+    def test_responses_without_validators_are_not_kept(self):
+        agent = StubAgent(self.body)
+        client = lastfm.Client('key', agent=agent, revalidate=True)
+        client.raw.artist.get_info(artist='Cher')
+        client.raw.artist.get_info(artist='Cher')
+        self.assertEqual([None, None],
+            [options.get('headers') for options in agent.options])
+
+class TimingTest(unittest.TestCase):
+    def test_reading_the_body_is_timed_apart_from_decoding_it(self):
+        agent = SlowBodyAgent(json.dumps({'artist': {'name': 'Cher'}}))
+        client = lastfm.Client('key', agent=agent, cache=False, stats=True)
+        client.raw.artist.get_info(artist='Cher')
+        
+        histograms = client.stats.snapshot()['histograms']
+        self.assertTrue(histograms['time.read']['sum'] >= SlowBody.delay)
+        self.assertTrue(histograms['time.json']['sum'] < SlowBody.delay)
+        self.assertTrue(histograms['time.agent']['sum'] < SlowBody.delay)
+
+class DeadlineTest(unittest.TestCase):
+    def test_no_call_is_sent_after_the_deadline(self):
+        agent = StubAgent()
+        client = lastfm.Client('key', agent=agent, cache=False, stats=True)
+        with client.deadline(0):
+            self.assertRaises(DeadlineExceededError,
+                client.raw.artist.get_info, artist='Cher')
+        self.assertEqual([], agent.requests)
+        counters = client.stats.snapshot()['counters']
+        self.assertEqual(1, counters['api.artist.getInfo.deadline_exceeded'])
+    
+    def test_calls_time_out_at_the_deadline(self):
+        agent = SlowAgent()
+        client = lastfm.Client('key', agent=agent, cache=False, timeout=10)
+        start = time.time()
+        with client.deadline(0.1):
+            self.assertRaises(DeadlineExceededError,
+                client.raw.artist.get_info, artist='Cher')
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(agent.options[0]['timeout'] <= 0.1)
+    
+    def test_nested_deadlines_keep_the_earliest(self):
+        agent = StubAgent()
+        client = lastfm.Client('key', agent=agent, cache=False, timeout=10)
+        with client.deadline(0.5):
+            with client.deadline(60):
+                client.raw.artist.get_info(artist='Cher')
+            client.raw.artist.get_info(artist='Cher')
+        client.raw.artist.get_info(artist='Cher')
+        timeouts = [options['timeout'] for options in agent.options]
+        self.assertTrue(timeouts[0] <= 0.5)
+        self.assertTrue(timeouts[1] <= 0.5)
+        self.assertEqual(10, timeouts[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
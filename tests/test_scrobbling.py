@@ -0,0 +1,185 @@
+# encoding: utf-8
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lastfm.errors import (APIError, InvalidParametersError,
+    InvalidSessionKeyError, RateLimitExceededError, ServiceOfflineError)
+from lastfm.scrobbling import ScrobbleQueue, _rejected_for_good
+
+# The queue logs the failures these tests provoke.
+logging.getLogger('lastfm.scrobbling').addHandler(logging.NullHandler())
+
+class FakeClient(object):
+    """
+    Stands in for a Client, recording the scrobble batches posted with it and
+    failing with `error` if it is set. If `release` is set to an event, posts
+    wait for it.
+    """
+    
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+        self.calls = 0
+        self.posting = threading.Event()
+        self.release = None
+        # Scrobbles are posted with client.raw.track.scrobble.post.
+        self.raw = self.track = self.scrobble = self
+    
+    def post(self, **params):
+        self.calls += 1
+        self.posting.set()
+        if self.release is not None:
+            self.release.wait()
+        if self.error is not None:
+            raise self.error
+        count = len([name for name in params if name.startswith('artist[')])
+        self.batches.append([params['track[%d]' % i] for i in xrange(count)])
+
+
+class ScrobbleQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = os.path.join(self.directory, 'scrobbles')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def queue(self, client, **kwargs):
+        kwargs.setdefault('flush_interval', None)
+        return ScrobbleQueue(client, 'session', spool=self.spool, **kwargs)
+    
+    def spooled(self, path=None):
+        stream = open(path or self.spool)
+        try:
+            return [json.loads(line)['track'] for line in stream]
+        finally:
+            stream.close()
+    
+    def test_full_batch_is_sent(self):
+        client = FakeClient()
+        queue = self.queue(client, batch_size=2)
+        queue.scrobble('Cher', 'Believe', timestamp=1)
+        self.assertEqual([], client.batches)
+        queue.scrobble('Cher', 'Strong Enough', timestamp=2)
+        self.assertEqual([['Believe', 'Strong Enough']], client.batches)
+        self.assertEqual(0, queue.pending)
+        self.assertEqual(2, queue.submitted)
+        self.assertEqual([], self.spooled())
+        queue.close()
+    
+    def test_unsent_scrobbles_survive_a_restart(self):
+        queue = self.queue(FakeClient(ServiceOfflineError('offline', 11)))
+        queue.scrobble('Cher', 'Believe', timestamp=1)
+        queue.scrobble('Cher', 'Strong Enough', timestamp=2)
+        queue.close()
+        self.assertEqual(['Believe', 'Strong Enough'], self.spooled())
+        
+        client = FakeClient()
+        queue = self.queue(client)
+        self.assertEqual(2, queue.pending)
+        self.assertEqual(2, queue.flush())
+        self.assertEqual([['Believe', 'Strong Enough']], client.batches)
+        self.assertEqual([], self.spooled())
+        queue.close()
+    
+    def test_damaged_spool_entry_is_skipped(self):
+        spool = open(self.spool, 'w')
+        spool.write(json.dumps({'artist': 'Cher', 'track': 'Believe',
+            'timestamp': 1}) + '\n{"artist": "Ch')
+        spool.close()
+        queue = self.queue(FakeClient())
+        self.assertEqual(1, queue.pending)
+        queue.close()
+    
+    def test_failed_flush_backs_off(self):
+        client = FakeClient(ServiceOfflineError('offline', 11))
+        queue = self.queue(client, batch_size=1, retry_interval=60.0)
+        
+        queue.scrobble('Cher', 'Believe', timestamp=1)
+        self.assertEqual(1, client.calls)
+        # Automatic flushes wait for the retry interval...
+        queue.scrobble('Cher', 'Strong Enough', timestamp=2)
+        self.assertEqual(1, client.calls)
+        self.assertEqual(2, queue.pending)
+        # ...but an explicit flush tries at once.
+        client.error = None
+        self.assertEqual(2, queue.flush())
+        self.assertEqual(3, client.calls)
+        self.assertEqual(0, queue.pending)
+        queue.close()
+    
+    def test_rejected_batch_is_set_aside(self):
+        client = FakeClient(InvalidParametersError('bad timestamp', 6))
+        queue = self.queue(client)
+        queue.scrobble('Cher', 'Believe', timestamp=1)
+        self.assertEqual(0, queue.flush())
+        self.assertEqual(0, queue.pending)
+        self.assertEqual(0, queue.submitted)
+        self.assertEqual(['Believe'],
+            [entry['track'] for entry in queue.rejected])
+        self.assertEqual(['Believe'], self.spooled(self.spool + '.rejected'))
+        self.assertEqual([], self.spooled())
+        queue.close()
+    
+    def test_full_batch_is_sent_in_the_background(self):
+        client = FakeClient()
+        client.release = threading.Event()
+        queue = self.queue(client, batch_size=2, flush_interval=60.0)
+        queue.scrobble('Cher', 'Believe', timestamp=1)
+        # Returns while the batch is still being sent.
+        queue.scrobble('Cher', 'Strong Enough', timestamp=2)
+        client.posting.wait(5)
+        self.assertTrue(client.posting.is_set())
+        self.assertEqual([], client.batches)
+        client.release.set()
+        queue.close()
+        self.assertEqual([['Believe', 'Strong Enough']], client.batches)
+    
+    def test_transient_errors_are_retried(self):
+        for code in (8, 11, 16, 29):
+            self.assertFalse(_rejected_for_good(APIError('try again', code)))
+        self.assertFalse(_rejected_for_good(RateLimitExceededError('slow',
+            29)))
+        self.assertFalse(_rejected_for_good(IOError('connection reset')))
+        
+        for code in (6, 9, 13, 26):
+            self.assertTrue(_rejected_for_good(APIError('rejected', code)))
+        self.assertTrue(_rejected_for_good(InvalidSessionKeyError('bad', 9)))
+        error = IOError('HTTP error')
+        error.code = 400
+        self.assertTrue(_rejected_for_good(error))
+    
+    def test_scrobbling_while_a_batch_is_sent(self):
+        client = FakeClient()
+        client.release = threading.Event()
+        queue = self.queue(client)
+        queue.scrobble('Cher', 'Believe', timestamp=1)
+        flusher = threading.Thread(target=queue.flush)
+        flusher.start()
+        client.posting.wait()
+        
+        # The queue is not locked while the batch is being sent.
+        queue.scrobble('Cher', 'Strong Enough', timestamp=2)
+        self.assertEqual(2, queue.pending)
+        client.release.set()
+        flusher.join()
+        
+        # The flush goes on to send the scrobble queued meanwhile.
+        self.assertEqual([['Believe'], ['Strong Enough']], client.batches)
+        self.assertEqual(0, queue.pending)
+        self.assertEqual([], self.spooled())
+        queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
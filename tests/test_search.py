@@ -0,0 +1,100 @@
+# encoding: utf-8
+
+import unittest
+
+import lastfm
+from lastfm.search import SearchIndex, normalize
+from benchmarks import payloads
+from benchmarks.fakeserver import FakeLastFM
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        for name in (u'Madonna', u'Madness', u'Metallica', u'Massive Attack',
+            u'Beyoncé', u'Portishead'):
+            self.index.add('artist', {'name': name})
+    
+    def names(self, matches):
+        return [row['name'] for score, row in matches]
+    
+    def test_normalize(self):
+        self.assertEqual(u'beyonce', normalize(u'Beyoncé'))
+        self.assertEqual(u'ac dc', normalize('AC/DC'))
+    
+    def test_misspelled_names_match(self):
+        matches = self.index.search('artist', 'madona')
+        self.assertEqual(u'Madonna', self.names(matches)[0])
+        self.assertTrue(self.index.confident(matches))
+        self.assertEqual([u'Beyoncé'],
+            self.names(self.index.search('artist', 'beyonce')))
+    
+    def test_poor_matches_are_left_out(self):
+        self.assertEqual([], self.index.search('artist', 'radiohead'))
+        self.assertFalse(self.index.confident([]))
+    
+    def test_complete(self):
+        self.assertEqual([u'Madness', u'Madonna'],
+            sorted(row['name'] for row in self.index.complete('artist',
+                'mad')))
+        self.assertEqual([u'Massive Attack'],
+            [row['name'] for row in self.index.complete('artist', 'mass')])
+    
+    def test_complete_after_many_additions(self):
+        # Enough names that some are merged into the main ordering and some
+        # are still waiting to be.
+        for i in xrange(3000):
+            self.index.add('artist', {'name': u'Band %04d' % i})
+        self.assertEqual([u'Band 0420', u'Band 0421'],
+            [row['name'] for row in self.index.complete('artist', 'band 042',
+                limit=2)])
+        self.assertEqual(u'Band 2999',
+            self.index.complete('artist', 'band 2999')[0]['name'])
+    
+    def test_richer_rows_are_kept(self):
+        full = {'name': u'Madonna', 'mbid': 'id', 'bio': {}, 'tags': {}}
+        self.index.add('artist', full)
+        self.index.add('artist', {'name': u'Madonna', 'url': 'url'})
+        self.assertTrue(self.index.search('artist', 'madonna')[0][1] is full)
+        
+        fuller = dict(full, stats={})
+        self.index.add('artist', fuller)
+        self.assertTrue(self.index.search('artist', 'madonna')[0][1] is
+            fuller)
+
+
+class LocalSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeLastFM().start()
+        self.client = lastfm.Client('key', agent=self.server.agent(),
+            cache=False, search_index=True)
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def test_first_page_is_answered_locally(self):
+        for name in ('madonna 1', 'madonna 12'):
+            self.client.search_index.add('artist', payloads.artist_row(name))
+        result = self.client.artists.search('madonna')
+        self.assertEqual(0, self.server.requests)
+        self.assertEqual(['madonna 1', 'madonna 12'],
+            sorted(artist.name for artist in result))
+        
+        # The total and the other pages come from last.fm, without the
+        # artists already given.
+        self.assertEqual(300, result.total_length)
+        while result.load_next_page():
+            pass
+        names = [artist.name for artist in result]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(set('madonna %d' % i for i in xrange(300)),
+            set(names))
+    
+    def test_unknown_names_are_searched_on_last_fm(self):
+        result = self.client.artists.search('cher')
+        self.assertEqual(1, self.server.requests)
+        self.assertEqual(300, result.total_length)
+        self.assertEqual(30, len(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
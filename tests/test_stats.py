@@ -0,0 +1,73 @@
+# encoding: utf-8
+
+import unittest
+
+from lastfm.caching import local
+from lastfm.stats import Stats
+
+class Backend(object):
+    """A stand-in for a cache backend that counts its own evictions."""
+    
+    evictions = 0
+    
+    def __getitem__(self, key):
+        return None
+
+
+class CacheStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self._time = local.time
+        local.time = lambda: self.now
+        self.stats = Stats()
+    
+    def tearDown(self):
+        local.time = self._time
+    
+    def counters(self):
+        return self.stats.snapshot()['counters']
+    
+    def test_counts_hits_misses_sets_and_deletes(self):
+        cache = self.stats.monitor_cache(local.Cache())
+        cache['a'] = 1
+        cache.set('b', 2, 60)
+        cache['a']
+        cache['c']
+        del cache['b']
+        counters = self.counters()
+        self.assertEqual(1, counters['cache.local.hits'])
+        self.assertEqual(1, counters['cache.local.misses'])
+        self.assertEqual(2, counters['cache.local.sets'])
+        self.assertEqual(1, counters['cache.local.deletes'])
+    
+    def test_expired_items_are_evicted_as_items_are_stored(self):
+        cache = self.stats.monitor_cache(local.Cache(timeout=600))
+        cache.set('a', 1, 10)
+        cache.set('b', 2, 10)
+        cache['c'] = 3
+        self.now += 60
+        cache['d'] = 4
+        self.assertFalse('cache.local.evictions' in self.counters())
+        
+        # Once per timeout, storing an item drops the ones that expired.
+        self.now += 600
+        cache['e'] = 5
+        self.assertEqual(3, self.counters()['cache.local.evictions'])
+        self.assertEqual(['d', 'e'], sorted(cache.backend._store))
+        self.assertEqual(3, self.counters()['cache.local.evictions'])
+    
+    def test_backend_evictions_are_counted_from_when_monitoring_began(self):
+        backend = Backend()
+        backend.evictions = 40
+        cache = self.stats.monitor_cache(backend, 'remote')
+        self.assertFalse('cache.remote.evictions' in self.counters())
+        backend.evictions = 45
+        self.assertEqual(5, self.counters()['cache.remote.evictions'])
+        
+        # A count that goes down was reset, so all of it is new.
+        backend.evictions = 3
+        self.assertEqual(8, self.counters()['cache.remote.evictions'])
+
+
+if __name__ == '__main__':
+    unittest.main()